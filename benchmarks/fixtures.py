@@ -0,0 +1,232 @@
+"""Synthetic Genshin models and placeholder images, for the benchmarks to
+run without the network or the downloaded assets.
+"""
+
+import os
+import random
+import shutil
+import sys
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, Iterable
+
+from genshin.models.character import Character
+from genshin.models.stats import PartialUserStats
+from PIL import Image
+
+from bot.utils.assets import assets
+from bot.utils.fonts import fonts
+
+# The card templates and the element icons are in the repository.
+STATIC_DIR = Path(__file__).resolve().parent.parent / "static" / "genshin"
+ELEMENTS = ("Anemo", "Cryo", "Dendro", "Electro", "Geo", "Hydro", "Pyro")
+FIRST_CHARACTER_ID = 10000002
+ARTIFACT_IDS = range(5)
+EQUIP_URL = "https://upload-os-bbs.mihoyo.com/game_record/genshin/equip"
+# Used when `GENSHIN_FONT_PATH` doesn't exist, e.g. on a CI runner.
+FALLBACK_FONTS = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+)
+
+
+def use_font(path: str = "") -> None:
+    for font in (path, fonts.path, *FALLBACK_FONTS):
+        if font and os.path.exists(font):
+            fonts.path = font
+            return
+    sys.exit("No font found, set GENSHIN_FONT_PATH or --font.")
+
+
+def use_placeholder_assets(image_dir: str, font: str) -> None:
+    """The initializer of the render processes, which don't share the
+    settings of the benchmark process.
+    """
+    from bot.cogs.genshin import warm_render_worker
+
+    fonts.path = font
+    assets.image_dir = image_dir
+    assets.bundle = None
+    warm_render_worker()
+
+
+def character_name(id: int) -> str:
+    return f"角色{id - FIRST_CHARACTER_ID}"
+
+
+def user_payload(characters: int = 48) -> Dict[str, Any]:
+    """The `data` of a HoYoLAB `genshin/api/index` response."""
+    avatars = [
+        {
+            "id": FIRST_CHARACTER_ID + i,
+            "name": character_name(FIRST_CHARACTER_ID + i),
+            "element": "Pyro",
+            "rarity": 4 + i % 2,
+            "icon": f"https://upload-os-bbs.mihoyo.com/game_record/genshin/character_icon/UI_AvatarIcon_{i}.png",
+            "level": 90,
+            "fetter": 10,
+            "actived_constellation_num": i % 7,
+        }
+        for i in range(characters)
+    ]
+    explorations = [
+        {
+            "id": i,
+            "icon": f"https://upload-os-bbs.mihoyo.com/game_record/genshin/city_icon/UI_ChapterIcon_{i}.png",
+            "name": f"地区{i}",
+            "type": "Reputation",
+            "level": 10,
+            "exploration_percentage": 1000,
+            "offerings": [{"name": f"供奉{i}", "level": 10}],
+        }
+        for i in range(8)
+    ]
+    homes = [
+        {
+            "level": 10,
+            "visit_num": 100,
+            "comfort_num": 20000,
+            "item_num": 2000,
+            "name": f"洞天{i}",
+            "icon": f"https://upload-os-bbs.mihoyo.com/game_record/genshin/home/UI_HomeworldModule_{i}.png",
+            "comfort_level_name": "贝阙珠宫",
+            "comfort_level_icon": "https://upload-os-bbs.mihoyo.com/game_record/genshin/home/UI_Homeworld_Comfort_10.png",
+        }
+        for i in range(4)
+    ]
+    stats = {
+        "achievement_number": 600,
+        "active_day_number": 700,
+        "avatar_number": characters,
+        "spiral_abyss": "12-3",
+        "anemoculus_number": 66,
+        "geoculus_number": 131,
+        "electroculus_number": 181,
+        "common_chest_number": 1500,
+        "exquisite_chest_number": 1000,
+        "precious_chest_number": 300,
+        "luxurious_chest_number": 100,
+        "magic_chest_number": 40,
+        "way_point_number": 250,
+        "domain_number": 40,
+    }
+    return {
+        "stats": stats,
+        "avatars": avatars,
+        "world_explorations": explorations,
+        "homes": homes,
+    }
+
+
+def synthetic_stats(characters: int = 48) -> Dict[str, Any]:
+    return PartialUserStats(**user_payload(characters)).dict()
+
+
+def synthetic_user(characters: int) -> PartialUserStats:
+    return PartialUserStats(**user_payload(characters))
+
+
+def character_payload(id: int, equip_url: str = EQUIP_URL) -> Dict[str, Any]:
+    """A fully built character of a HoYoLAB `genshin/api/character` response:
+    5 artifacts of one set and 6 constellations.
+    """
+    effects = [
+        {"activation_number": 2, "effect": "效果" * 10},
+        {"activation_number": 4, "effect": "效果" * 40},
+    ]
+    return dict(
+        id=id,
+        name=character_name(id),
+        element=ELEMENTS[id % len(ELEMENTS)],
+        rarity=5,
+        icon=f"https://upload-os-bbs.mihoyo.com/game_record/genshin/character_icon/UI_AvatarIcon_{id}.png",
+        image=f"https://upload-os-bbs.mihoyo.com/game_record/genshin/character_image/UI_AvatarImg_{id}.png",
+        level=90,
+        fetter=10,
+        actived_constellation_num=6,
+        weapon={
+            "id": id,
+            "icon": f"{equip_url}/UI_EquipIcon_{id}.png",
+            "name": "武器",
+            "rarity": 5,
+            "desc": "描述" * 60,
+            "level": 90,
+            "type_name": "单手剑",
+            "promote_level": 6,
+            "affix_level": 5,
+        },
+        reliquaries=[
+            {
+                "id": i,
+                "icon": f"{equip_url}/UI_RelicIcon_{i}.png",
+                "name": f"圣遗物{i}",
+                "pos_name": f"部位{i}",
+                "pos": i + 1,
+                "rarity": 5,
+                "level": 20,
+                "set": {"id": 1, "name": "套装", "affixes": effects},
+            }
+            for i in ARTIFACT_IDS
+        ],
+        constellations=[
+            {
+                "id": i,
+                "icon": f"https://upload-os-bbs.mihoyo.com/game_record/genshin/constellation_icon/UI_Talent_S_{i}.png",
+                "pos": i + 1,
+                "name": f"命之座{i}",
+                "effect": "效果" * 20,
+                "is_actived": True,
+            }
+            for i in range(6)
+        ],
+        costumes=[],
+    )
+
+
+def synthetic_character(id: int = FIRST_CHARACTER_ID) -> Character:
+    return Character(**character_payload(id))
+
+
+def placeholder_assets(
+    directory: str,
+    characters: int,
+    kinds: Iterable[str] = ("avatars", "characters", "weapons", "artifacts"),
+) -> str:
+    """Fill `directory` with the images the cards of up to `characters`
+    characters need, and return it as an `AssetCache.image_dir`. The
+    `kinds` left out are downloaded by the bot.
+    """
+    for kind in ("card", "elements"):
+        shutil.copytree(
+            STATIC_DIR / kind, os.path.join(directory, kind), dirs_exist_ok=True
+        )
+
+    def generate(kind: str, ids: Iterable[Any], size: int) -> None:
+        os.makedirs(os.path.join(directory, kind), exist_ok=True)
+        if kind not in kinds:
+            return
+        for id in ids:
+            path = os.path.join(directory, kind, f"{id}.png")
+            if not os.path.exists(path):
+                color = (id * 37 % 256, id * 91 % 256, id * 53 % 256, 255)
+                Image.new("RGBA", (size, size), color).save(path)
+
+    ids = range(FIRST_CHARACTER_ID, FIRST_CHARACTER_ID + characters)
+    generate("avatars", ids, 256)
+    generate("characters", ids, 600)
+    generate("weapons", ids, 256)
+    generate("artifacts", ARTIFACT_IDS, 256)
+
+    return directory.rstrip("/") + "/"
+
+
+def synthetic_photo(width: int = 4000, height: int = 5000, quality: int = 95) -> bytes:
+    """A JPEG of noise, which hardly compresses, like a large Pixiv original."""
+    rng = random.Random(0)
+    img = Image.frombytes(
+        "RGB", (width // 4, height // 4), rng.randbytes(width * height * 3 // 16)
+    )
+    img = img.resize((width, height), Image.BICUBIC)
+    out = BytesIO()
+    img.save(out, "JPEG", quality=quality)
+    return out.getvalue()
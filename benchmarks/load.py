@@ -0,0 +1,376 @@
+"""Drive the Genshin and Setu cogs at a target request rate, offline.
+
+    $ python -m benchmarks.load --redis redis://localhost/15 [--rate 10] [--duration 60]
+          [--mix user=5,character=3,setu=2] [--hoyolab-limits 0.05] [--upstream URL]
+
+The cogs are the real ones, with their render engine, caches, cookie pool
+and downloads. HoYoLAB, lolicon and Pixiv are the stand-ins of
+`benchmarks.stubs`, started here or already running at `--upstream`, and
+Discord is a fake context whose `send` takes `--discord-latency`.
+
+The requests arrive at `--rate` per second whatever the bot's latency,
+evenly or as a Poisson process, split between the scenarios by `--mix`.
+The Genshin lookups are cached in Redis, use a database of its own for the
+test, `--flush` empties it first for cold caches. The UIDs are drawn from
+`--uids` accounts, fewer of them means more cache hits.
+
+The report has the throughput, the latency percentiles and the outcomes of
+each scenario, what the stand-ins answered, the peak queue depths and the
+stage latencies of `!!stats`.
+"""
+
+import argparse
+import asyncio
+import functools
+import os
+import random
+import sys
+import tempfile
+import time
+import warnings
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+workdir = tempfile.TemporaryDirectory(prefix="bench-load-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{workdir.name}/db.sqlite")
+os.environ.setdefault("GENSHIN_RENDER_CACHE_DIR", f"{workdir.name}/renders/")
+
+import disnake
+import loguru
+
+from bot.bot import Bot
+from bot.cogs import setu as setu_cog
+from bot.cogs.genshin import Genshin
+from bot.cogs.setu import Setu
+from bot.cogs.stats import latency_table
+from bot.utils.assets import assets
+from bot.utils.character_index import CharacterEntry
+from bot.utils.fonts import fonts
+from bot.utils.http import HTTP_CONNECTIONS
+from bot.utils.metrics import QUEUE_DEPTH, STAGE_SECONDS
+from bot.utils.render import RenderEngine
+
+from .fixtures import (
+    FIRST_CHARACTER_ID,
+    character_name,
+    placeholder_assets,
+    use_font,
+    use_placeholder_assets,
+)
+from .stubs import (
+    MAX_CHARACTERS,
+    Upstreams,
+    account_size,
+    add_behavior_arguments,
+    behaviors_from,
+)
+
+FIRST_UID = 800000000
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+# Latency and outcome of each request of a scenario.
+Results = Dict[str, List[Tuple[float, str]]]
+
+
+class FakeChannel:
+    def __init__(self, id: int, nsfw: bool = False):
+        self.id = id
+        self.nsfw = nsfw
+
+    def __str__(self) -> str:
+        return f"load-{self.id}"
+
+
+class FakeGuild:
+    def __init__(self, id: int, filesize_limit: int = 8 << 20):
+        self.id = id
+        self.filesize_limit = filesize_limit
+
+
+class FakeContext:
+    """The part of `commands.Context` used by the cog commands."""
+
+    def __init__(self, id: int, channel: FakeChannel, guild: FakeGuild, latency: float):
+        self.author = f"load#{id % 10000:04d}"
+        self.channel = channel
+        self.guild = guild
+        self.latency = latency
+        # (content, bytes of the files) of each message sent.
+        self.sent: List[Tuple[Optional[str], int]] = []
+
+    async def send(
+        self,
+        content: Optional[str] = None,
+        *,
+        file: Optional[disnake.File] = None,
+        files: Optional[List[disnake.File]] = None,
+        **kwargs,
+    ) -> None:
+        files = [file] if file else files or []
+        # Read like the upload reads them.
+        size = sum(len(f.fp.read()) for f in files)
+        await asyncio.sleep(self.latency)
+        self.sent.append((content, size))
+
+    def outcome(self) -> str:
+        if any(size for _, size in self.sent):
+            return "ok"
+        if self.sent:
+            return f"reply {self.sent[-1][0]}"
+        return "no reply"
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace, genshin: Genshin, setu: Setu):
+        self.args = args
+        self.genshin = genshin
+        self.setu = setu
+        self.results: Results = {}
+        self.peaks: Dict[str, float] = {}
+        # How late the requests were sent, a busy event loop delays them.
+        self.max_lag = 0.0
+        self._ids = iter(range(1, sys.maxsize))
+        self.scenarios: Dict[str, Callable[[FakeContext], Awaitable[None]]] = {
+            "user": self.user,
+            "character": self.character,
+            "setu": self.setu_request,
+        }
+
+    def uid(self) -> int:
+        return FIRST_UID + random.randrange(self.args.uids)
+
+    async def user(self, ctx: FakeContext) -> None:
+        await self.genshin.genshin_user.callback(self.genshin, ctx, self.uid())
+
+    async def character(self, ctx: FakeContext) -> None:
+        uid = self.uid()
+        ids = range(FIRST_CHARACTER_ID, FIRST_CHARACTER_ID + account_size(uid))
+        names = [character_name(id) for id in random.sample(ids, random.randint(1, 3))]
+        await self.genshin.genshin_character.callback(
+            self.genshin, ctx, uid, ",".join(names)
+        )
+
+    async def setu_request(self, ctx: FakeContext) -> None:
+        await self.setu.setu.callback(self.setu, ctx)
+
+    async def request(self, scenario: str) -> None:
+        id = next(self._ids)
+        ctx = FakeContext(
+            id,
+            FakeChannel(id % 100, nsfw=id % 2 == 0),
+            FakeGuild(id % 10),
+            self.args.discord_latency,
+        )
+        start = time.perf_counter()
+        try:
+            await self.scenarios[scenario](ctx)
+            outcome = ctx.outcome()
+        except Exception as e:
+            outcome = f"exception {type(e).__name__}"
+        self.results.setdefault(scenario, []).append(
+            (time.perf_counter() - start, outcome)
+        )
+
+    async def sample_queues(self) -> None:
+        while True:
+            for labels in QUEUE_DEPTH.labels():
+                queue = labels["queue"]
+                depth = QUEUE_DEPTH.value(**labels)
+                self.peaks[queue] = max(self.peaks.get(queue, 0), depth)
+            for state in ("in_use", "waiting"):
+                depth = HTTP_CONNECTIONS.value(state=state)
+                queue = f"http_{state}"
+                self.peaks[queue] = max(self.peaks.get(queue, 0), depth)
+            await asyncio.sleep(0.1)
+
+    async def run(self) -> Tuple[float, int]:
+        """Send the requests, wait for them, return the elapsed time and the
+        number of requests still running after `--drain`.
+        """
+        mix = parse_mix(self.args.mix)
+        unknown = mix.keys() - self.scenarios.keys()
+        if unknown:
+            sys.exit(f"Unknown scenarios: {', '.join(unknown)}.")
+        names, weights = list(mix), list(mix.values())
+
+        sampler = asyncio.create_task(self.sample_queues())
+        tasks = set()
+        start = time.perf_counter()
+        next_at = start
+        while next_at - start < self.args.duration:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            self.max_lag = max(self.max_lag, time.perf_counter() - next_at)
+            scenario = random.choices(names, weights)[0]
+            tasks.add(asyncio.create_task(self.request(scenario)))
+            if self.args.poisson:
+                next_at += random.expovariate(self.args.rate)
+            else:
+                next_at += 1 / self.args.rate
+
+        _, pending = await asyncio.wait(tasks, timeout=self.args.drain)
+        elapsed = time.perf_counter() - start
+        for task in pending:
+            task.cancel()
+        sampler.cancel()
+        return elapsed, len(pending)
+
+    def report(self, elapsed: float, unfinished: int, upstreams: Optional[Upstreams]):
+        total = sum(len(results) for results in self.results.values())
+        ok = sum(o == "ok" for results in self.results.values() for _, o in results)
+        print(
+            f"{total} requests in {elapsed:.1f}s: {total / elapsed:.1f}/s, "
+            f"{ok / elapsed:.1f}/s ok, {unfinished} unfinished, "
+            f"sent up to {self.max_lag * 1000:.0f}ms late"
+        )
+
+        header = "".join(f"{f'p{q * 100:g}ms':>8}" for q in PERCENTILES)
+        print(f"\n{'scenario':<12}{'count':>7}{'ok':>7}{header}{'maxms':>8}")
+        outcomes: Dict[Tuple[str, str], int] = Counter()
+        for scenario, results in sorted(self.results.items()):
+            latencies = sorted(latency for latency, _ in results)
+            for _, outcome in results:
+                outcomes[scenario, outcome] += 1
+            print(
+                f"{scenario:<12}{len(results):>7}{outcomes[scenario, 'ok']:>7}"
+                + "".join(
+                    f"{percentile(latencies, q) * 1000:>8.0f}" for q in PERCENTILES
+                )
+                + f"{latencies[-1] * 1000:>8.0f}"
+            )
+
+        errors = [(key, n) for key, n in outcomes.items() if key[1] != "ok"]
+        if errors:
+            print("\nerrors:")
+            for (scenario, outcome), n in sorted(errors, key=lambda e: -e[1]):
+                print(f"  {scenario:<12}{n:>7}  {outcome}")
+
+        if upstreams:
+            print("\nupstreams:")
+            for (service, outcome), n in sorted(upstreams.outcomes.items()):
+                print(f"  {service:<12}{n:>7}  {outcome}")
+
+        print("\npeak queue depths:")
+        for queue, depth in sorted(self.peaks.items()):
+            print(f"  {queue:<16}{depth:>5.0f}")
+
+        print()
+        print("\n".join(latency_table(STAGE_SECONDS, "stage")))
+
+
+async def setup_bot(
+    args: argparse.Namespace, record_url: str
+) -> Tuple[Bot, Genshin, Setu]:
+    bot = Bot(command_prefix="!!", intents=disnake.Intents.none())
+    os.environ["REDIS_URL"] = args.redis
+    bot.redis_session = bot._create_redis_session()
+    bot.redis_bytes_session = bot._create_redis_session(decode_responses=False)
+    if args.flush:
+        await bot.redis_session.flushdb()
+
+    # The icons of the characters are on the official CDN, generate them.
+    image_dir = os.path.join(workdir.name, "images")
+    assets.image_dir = placeholder_assets(
+        image_dir, MAX_CHARACTERS, ("avatars", "characters")
+    )
+    assets.bundle = None
+    assets.clear()
+
+    os.environ["GENSHIN_COOKIES"] = "#".join(
+        f"ltuid={i}; ltoken=load{i}" for i in range(args.cookies)
+    )
+    genshin = Genshin(bot)
+    genshin.render.shutdown()
+    genshin.render = RenderEngine(
+        warm=functools.partial(use_placeholder_assets, assets.image_dir, fonts.path)
+    )
+    genshin.genshin_client.RECORD_URL = record_url
+    genshin.genshin_client.debug = args.log_level == "DEBUG"
+    genshin.character_index.update(
+        CharacterEntry(id, character_name(id), "")
+        for id in range(FIRST_CHARACTER_ID, FIRST_CHARACTER_ID + MAX_CHARACTERS)
+    )
+    setu = Setu(bot)
+    # `bot.wait_until_ready` never returns without Discord.
+    await genshin.cog_ready()
+    await setu.cog_ready()
+    return bot, genshin, setu
+
+
+async def close_bot(bot: Bot, genshin: Genshin, setu: Setu) -> None:
+    running = asyncio.all_tasks()
+    genshin.cog_unload()
+    setu.cog_unload()
+    # The closing tasks started by `cog_unload`.
+    await asyncio.gather(*(asyncio.all_tasks() - running), return_exceptions=True)
+    await bot.http_session.close()
+    await bot.http_pool.close()
+    await bot.redis_session.close()
+    await bot.redis_bytes_session.close()
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    upstreams = None
+    base_url = args.upstream.rstrip("/")
+    if not base_url:
+        upstreams = Upstreams(behaviors_from(args))
+        base_url = await upstreams.start()
+    setu_cog.SETU_API = f"{base_url}/lolicon/setu/v2"
+
+    bot, genshin, setu = await setup_bot(args, f"{base_url}/game_record/")
+    test = LoadTest(args, genshin, setu)
+    try:
+        elapsed, unfinished = await test.run()
+        test.report(elapsed, unfinished, upstreams)
+    finally:
+        await close_bot(bot, genshin, setu)
+        if upstreams:
+            await upstreams.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--redis", required=True, help="a Redis database for the test only"
+    )
+    parser.add_argument("--flush", action="store_true", help="empty it first")
+    parser.add_argument("--rate", type=float, default=10, help="requests per second")
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument("--drain", type=float, default=60, help="seconds")
+    parser.add_argument("--poisson", action="store_true")
+    parser.add_argument("--mix", default="user=5,character=3,setu=2")
+    parser.add_argument("--uids", type=int, default=1000)
+    parser.add_argument("--cookies", type=int, default=4)
+    parser.add_argument("--discord-latency", type=float, default=0.2, metavar="S")
+    parser.add_argument("--upstream", default="", help="the base URL of the stubs")
+    parser.add_argument("--font", default="")
+    parser.add_argument("--log-level", default="WARNING")
+    add_behavior_arguments(parser)
+    args = parser.parse_args()
+
+    # The synthetic characters are unknown to genshin.py.
+    warnings.simplefilter("ignore", UserWarning)
+    loguru.logger.remove()
+    loguru.logger.add(sys.stderr, level=args.log_level)
+    use_font(args.font)
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
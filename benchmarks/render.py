@@ -0,0 +1,291 @@
+"""Time the card renderers and the setu download path, offline.
+
+    $ python -m benchmarks.render [-n 20] [--save] [--threshold 0.25]
+
+The accounts are synthetic (8, 24 and 50 characters) and the character,
+weapon and artifact images are generated placeholders, the card templates
+come from `static/genshin`. The caches are warm after the first round, like
+in production, `--cold` clears them before every round.
+
+Each case reports p50/p95 time, the peak RSS while it ran and the size of
+its output. The results are compared to the baseline file, the run fails
+when a case is slower, larger or uses more memory than the baseline by
+more than the threshold. `--save` writes the results as the new baseline.
+Baselines depend on the machine, keep one per machine or CI runner.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from io import BytesIO
+from typing import AsyncIterator, Callable, Dict, List, NamedTuple, Tuple
+
+# `bot.utils.database` needs one, nothing is queried.
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import PIL
+from PIL import Image
+
+from bot.cogs import genshin as cog
+from bot.utils.assets import assets
+from bot.utils.encoding import ENCODING_MAX_BYTES, ENCODING_PROFILE, shrink_to_fit
+from bot.utils.fonts import fonts
+from bot.utils.streaming import read_spooled
+
+from .fixtures import (
+    placeholder_assets,
+    synthetic_character,
+    synthetic_photo,
+    synthetic_user,
+    use_font,
+)
+
+ACCOUNTS = {"small": 8, "medium": 24, "large": 50}
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "render_baseline.json")
+# Time differences below this are noise, whatever the ratio.
+NOISE_SECONDS = 0.002
+# Setu larger than the upload limit of the guilds without boosts.
+SETU_MAX_BYTES = (8 << 20) - (16 << 10)
+
+Results = Dict[str, Dict[str, float]]
+
+
+class Case(NamedTuple):
+    name: str
+    # Returns the output size in bytes.
+    run: Callable[[], int]
+
+
+def image_bytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+def reset_peak_rss() -> None:
+    try:
+        # Linux: resets VmHWM to the current RSS.
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) << 10
+    except OSError:
+        pass
+    # Since the start of the process, kilobytes on Linux, bytes on macOS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss << 10
+
+
+class FakeContent:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def iter_chunked(self, n: int) -> AsyncIterator[bytes]:
+        for i in range(0, len(self.data), n):
+            yield self.data[i : i + n]
+
+
+class FakeResponse:
+    """The part of `aiohttp.ClientResponse` used by `read_spooled`."""
+
+    url = "https://i.pximg.net/img-original/img/synthetic.jpg"
+
+    def __init__(self, data: bytes):
+        self.content_length = len(data)
+        self.content = FakeContent(data)
+
+
+def account_cases(size: str, characters: int, profile: str) -> List[Case]:
+    uid = 100000001
+    stats = synthetic_user(characters)
+
+    def base() -> int:
+        with cog.draw_user_base(uid, stats) as img:
+            return image_bytes(img)
+
+    def roster() -> int:
+        size = 0
+        for characters in cog.chunk_list(stats.characters):
+            with cog.draw_user_characters(characters) as img:
+                size += image_bytes(img)
+        return size
+
+    images = [
+        cog.draw_user_base(uid, stats),
+        *[cog.draw_user_characters(c) for c in cog.chunk_list(stats.characters)],
+        assets.get("card", "card-new-bottom"),
+    ]
+
+    def concat() -> int:
+        with cog.concat_images(images) as img:
+            return image_bytes(img)
+
+    def card() -> int:
+        return len(cog.render_user_stats(uid, stats, profile, ENCODING_MAX_BYTES).data)
+
+    return [
+        Case(f"draw_user_base[{size}]", base),
+        Case(f"draw_user_characters[{size}]", roster),
+        Case(f"concat_images[{size}]", concat),
+        Case(f"render_user_stats[{size}]", card),
+    ]
+
+
+def character_cases(profile: str) -> List[Case]:
+    uid = 100000001
+    character = synthetic_character()
+
+    def draw() -> int:
+        with cog.draw_character(uid, character) as img:
+            return image_bytes(img)
+
+    def card() -> int:
+        return len(
+            cog.render_character(uid, character, profile, ENCODING_MAX_BYTES).data
+        )
+
+    return [Case("draw_character", draw), Case("render_character", card)]
+
+
+def setu_cases() -> List[Case]:
+    photo = synthetic_photo()
+    loop = asyncio.new_event_loop()
+
+    def download() -> int:
+        with loop.run_until_complete(read_spooled(FakeResponse(photo), 32 << 20)) as f:
+            return f.seek(0, os.SEEK_END)
+
+    def shrink() -> int:
+        data = shrink_to_fit(BytesIO(photo), len(photo), SETU_MAX_BYTES)
+        return len(data) if data else 0
+
+    return [Case("setu_download", download), Case("setu_shrink", shrink)]
+
+
+def measure(case: Case, rounds: int, cold: bool) -> Dict[str, float]:
+    case.run()  # Warm up.
+    times = []
+    size = 0
+    reset_peak_rss()
+    for _ in range(rounds):
+        if cold:
+            assets.clear()
+            cog.character_tiles.clear()
+        start = time.perf_counter()
+        size = case.run()
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+    return {
+        "p50": statistics.median(times),
+        "p95": times[min(len(times) - 1, int(len(times) * 0.95))],
+        "rss": peak_rss(),
+        "size": size,
+    }
+
+
+def compare(
+    results: Results, baseline: Results, threshold: float
+) -> List[Tuple[str, str, float, float]]:
+    """The (case, metric, baseline, current) regressed beyond `threshold`."""
+    regressions = []
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        for metric, value in current.items():
+            before = baseline[name].get(metric)
+            if not before or value <= before * (1 + threshold):
+                continue
+            if metric in ("p50", "p95") and value - before < NOISE_SECONDS:
+                continue
+            regressions.append((name, metric, before, value))
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-n", "--rounds", type=int, default=20)
+    parser.add_argument(
+        "-k", "--filter", default="", help="only the cases containing this text"
+    )
+    parser.add_argument("--profile", default=ENCODING_PROFILE)
+    parser.add_argument("--font", default="")
+    parser.add_argument("--cold", action="store_true")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args()
+    # The synthetic characters are unknown to genshin.py.
+    warnings.simplefilter("ignore", UserWarning)
+
+    use_font(args.font)
+    image_dir = tempfile.TemporaryDirectory(prefix="bench-assets-")
+    assets.image_dir = placeholder_assets(image_dir.name, max(ACCOUNTS.values()))
+    assets.bundle = None
+    assets.clear()
+
+    cases = []
+    for size, characters in ACCOUNTS.items():
+        cases += account_cases(size, characters, args.profile)
+    cases += character_cases(args.profile)
+    cases += setu_cases()
+
+    results: Results = {}
+    print(f"{'case':<34}{'p50 ms':>9}{'p95 ms':>9}{'peak MiB':>10}{'size KiB':>10}")
+    for case in cases:
+        if args.filter not in case.name:
+            continue
+        result = results[case.name] = measure(case, args.rounds, args.cold)
+        print(
+            f"{case.name:<34}{result['p50'] * 1000:>9.1f}{result['p95'] * 1000:>9.1f}"
+            f"{result['rss'] / (1 << 20):>10.0f}{result['size'] / 1024:>10.0f}"
+        )
+    image_dir.cleanup()
+
+    meta = {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "machine": platform.machine(),
+        "font": os.path.basename(fonts.path),
+        "profile": args.profile,
+        "cold": args.cold,
+    }
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}.")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, save one with --save.")
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["meta"] != meta:
+        print(f"\nThe baseline was taken with {baseline['meta']}, not {meta}.")
+    regressions = compare(results, baseline["results"], args.threshold)
+    for name, metric, before, value in regressions:
+        print(f"REGRESSION {name} {metric}: {before:.4g} -> {value:.4g}")
+    if regressions:
+        sys.exit(1)
+    print(f"\nNo regression over {args.threshold:.0%} against {args.baseline}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Compare the cache encodings on `PartialUserStats` payloads.
+
+    $ python -m benchmarks.serializer [user.json ...]
+
+The payloads are cached entries dumped as JSON, e.g.
+`redis-cli --raw GET bot:genshin:user:<uid> > user.json` on an entry written
+before the binary encoding. Without any, a synthetic large account is used.
+"""
+
+import argparse
+import json
+import time
+import warnings
+from typing import Any, Callable, Dict, List
+
+from genshin.models.stats import PartialUserStats
+
+from bot.utils.serializer import Serializer, msgpack, zstandard
+
+from .fixtures import synthetic_stats
+
+
+def measure(func: Callable[[], Any], rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("payloads", nargs="*")
+    parser.add_argument("-n", "--rounds", type=int, default=2000)
+    args = parser.parse_args()
+    # The synthetic characters are unknown to genshin.py.
+    warnings.simplefilter("ignore", UserWarning)
+
+    payloads: List[Dict[str, Any]] = []
+    for path in args.payloads:
+        with open(path, encoding="utf-8") as f:
+            payloads.append(PartialUserStats(**json.load(f)).dict())
+    if not payloads:
+        payloads.append(synthetic_stats())
+
+    codecs = [("json", "none"), ("json", "zlib")]
+    if zstandard is not None:
+        codecs.append(("json", "zstd"))
+    if msgpack is not None:
+        codecs += [("msgpack", "none"), ("msgpack", "zlib")]
+        if zstandard is not None:
+            codecs.append(("msgpack", "zstd"))
+
+    print(f"{'encoding':<16}{'bytes':>10}{'encode us':>12}{'decode us':>12}")
+    for obj in payloads:
+        # What was stored before: JSON text, parsed into the model on read.
+        legacy = json.dumps(obj)
+        print(
+            f"{'legacy json':<16}{len(legacy.encode()):>10}"
+            f"{measure(lambda: json.dumps(obj), args.rounds):>12.1f}"
+            f"{measure(lambda: PartialUserStats(**json.loads(legacy)), args.rounds):>12.1f}"
+        )
+        for fmt, compression in codecs:
+            serializer = Serializer(fmt, compression, min_compress=0)
+            data = serializer.dumps(obj)
+            print(
+                f"{serializer.name:<16}{len(data):>10}"
+                f"{measure(lambda: serializer.dumps(obj), args.rounds):>12.1f}"
+                f"{measure(lambda: PartialUserStats(**serializer.loads(data)), args.rounds):>12.1f}"
+            )
+        print()
+
+
+if __name__ == "__main__":
+    main()
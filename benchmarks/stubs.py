@@ -0,0 +1,234 @@
+"""Local stand-ins of HoYoLAB, lolicon and Pixiv, for the load tests.
+
+    $ python -m benchmarks.stubs --port 8900 [--hoyolab-latency 0.3] [--pixiv-errors 0.05]
+
+Every service answers after its latency (plus a random jitter), fails with
+a 500 at its error rate and is rate limited at its limit rate, HoYoLAB with
+the retcode 10101 like the real one, the others with a 429. The accounts
+are synthetic, the number of characters of a UID is always the same.
+"""
+
+import argparse
+import asyncio
+import random
+from collections import Counter
+from io import BytesIO
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from aiohttp import web
+from PIL import Image
+
+from .fixtures import (
+    FIRST_CHARACTER_ID,
+    character_payload,
+    synthetic_photo,
+    user_payload,
+)
+
+SERVICES = ("hoyolab", "lolicon", "pixiv", "assets")
+# The characters of the synthetic accounts.
+MIN_CHARACTERS = 8
+MAX_CHARACTERS = 50
+
+
+class Behavior(NamedTuple):
+    latency: float = 0.0
+    jitter: float = 0.0
+    errors: float = 0.0
+    limits: float = 0.0
+
+    def delay(self) -> float:
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+
+DEFAULT_BEHAVIORS = {
+    "hoyolab": Behavior(0.3, 0.1),
+    "lolicon": Behavior(0.2, 0.05),
+    "pixiv": Behavior(0.5, 0.2),
+    "assets": Behavior(0.05, 0.01),
+}
+
+
+def account_size(uid: int) -> int:
+    return MIN_CHARACTERS + uid % (MAX_CHARACTERS - MIN_CHARACTERS + 1)
+
+
+def placeholder_png(size: int = 256) -> bytes:
+    out = BytesIO()
+    Image.new("RGBA", (size, size), (128, 128, 128, 255)).save(out, "PNG")
+    return out.getvalue()
+
+
+class Upstreams:
+    """The stand-ins, served by one aiohttp application under one base URL."""
+
+    def __init__(
+        self,
+        behaviors: Dict[str, Behavior] = DEFAULT_BEHAVIORS,
+        photo: Optional[bytes] = None,
+    ):
+        self.behaviors = {**DEFAULT_BEHAVIORS, **behaviors}
+        # About 1MiB, a Pixiv `regular` image.
+        self.photo = photo or synthetic_photo(1200, 1500, 95)
+        self.icon = placeholder_png()
+        self.base_url = ""
+        # (service, outcome): requests.
+        self.outcomes: Dict[Tuple[str, str], int] = Counter()
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/game_record/genshin/api/index", self.hoyolab_index)
+        self.app.router.add_post(
+            "/game_record/genshin/api/character", self.hoyolab_character
+        )
+        self.app.router.add_post("/lolicon/setu/v2", self.lolicon)
+        self.app.router.add_get("/pixiv/img/{name}", self.pixiv)
+        self.app.router.add_get("/assets/{name}", self.asset)
+
+    @property
+    def record_url(self) -> str:
+        return f"{self.base_url}/game_record/"
+
+    @property
+    def setu_api(self) -> str:
+        return f"{self.base_url}/lolicon/setu/v2"
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve the stand-ins, on a free port by default, return the base URL."""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # type: ignore
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def close(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def hoyolab_index(self, request: web.Request) -> web.StreamResponse:
+        if (failed := await self._answer("hoyolab")) is not None:
+            return failed
+        uid = int(request.query["role_id"])
+        return self._hoyolab_data(user_payload(account_size(uid)))
+
+    async def hoyolab_character(self, request: web.Request) -> web.StreamResponse:
+        if (failed := await self._answer("hoyolab")) is not None:
+            return failed
+        body = await request.json()
+        last = FIRST_CHARACTER_ID + account_size(int(body["role_id"]))
+        avatars = [
+            character_payload(id, f"{self.base_url}/assets")
+            for id in body["character_ids"]
+            if FIRST_CHARACTER_ID <= id < last
+        ]
+        return self._hoyolab_data({"avatars": avatars})
+
+    async def lolicon(self, request: web.Request) -> web.StreamResponse:
+        if (failed := await self._answer("lolicon")) is not None:
+            return failed
+        body = await request.json()
+        data = []
+        for _ in range(int(body.get("num", 1))):
+            pid = random.randrange(10000000, 99999999)
+            url = f"{self.base_url}/pixiv/img/{pid}_p0.jpg"
+            data.append(
+                {
+                    "pid": pid,
+                    "title": f"作品{pid}",
+                    "author": "作者",
+                    "tags": body.get("tag") or ["标签"],
+                    "urls": {"original": url, "regular": url},
+                }
+            )
+        return web.json_response({"error": "", "data": data})
+
+    async def pixiv(self, request: web.Request) -> web.StreamResponse:
+        if (failed := await self._answer("pixiv")) is not None:
+            return failed
+        return web.Response(body=self.photo, content_type="image/jpeg")
+
+    async def asset(self, request: web.Request) -> web.StreamResponse:
+        if (failed := await self._answer("assets")) is not None:
+            return failed
+        return web.Response(body=self.icon, content_type="image/png")
+
+    async def _answer(self, service: str) -> Optional[web.StreamResponse]:
+        """Wait for the latency, and the failed response if it's rolled."""
+        behavior = self.behaviors[service]
+        await asyncio.sleep(behavior.delay())
+        roll = random.random()
+        if roll < behavior.errors:
+            self.outcomes[service, "error"] += 1
+            return web.Response(status=500, text="Internal Server Error")
+        if roll < behavior.errors + behavior.limits:
+            self.outcomes[service, "rate_limited"] += 1
+            if service == "hoyolab":
+                return web.json_response(
+                    {"retcode": 10101, "message": "Too Many Requests", "data": None}
+                )
+            return web.Response(status=429, text="Too Many Requests")
+        self.outcomes[service, "ok"] += 1
+        return None
+
+    @staticmethod
+    def _hoyolab_data(data: dict) -> web.Response:
+        return web.json_response({"retcode": 0, "message": "OK", "data": data})
+
+
+def add_behavior_arguments(parser: argparse.ArgumentParser) -> None:
+    for service in SERVICES:
+        default = DEFAULT_BEHAVIORS[service]
+        group = parser.add_argument_group(service)
+        group.add_argument(
+            f"--{service}-latency", type=float, default=default.latency, metavar="S"
+        )
+        group.add_argument(
+            f"--{service}-jitter", type=float, default=default.jitter, metavar="S"
+        )
+        group.add_argument(
+            f"--{service}-errors", type=float, default=default.errors, metavar="RATIO"
+        )
+        group.add_argument(
+            f"--{service}-limits", type=float, default=default.limits, metavar="RATIO"
+        )
+
+
+def behaviors_from(args: argparse.Namespace) -> Dict[str, Behavior]:
+    return {
+        service: Behavior(
+            *(getattr(args, f"{service}_{field}") for field in Behavior._fields)
+        )
+        for service in SERVICES
+    }
+
+
+async def serve_forever(args: argparse.Namespace) -> None:
+    upstreams = Upstreams(behaviors_from(args))
+    base_url = await upstreams.start(args.host, args.port)
+    print(f"HoYoLAB RECORD_URL: {upstreams.record_url}")
+    print(f"SETU_API: {upstreams.setu_api}")
+    print(f"Serving at {base_url}, Ctrl+C to stop.")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await upstreams.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_behavior_arguments(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve_forever(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,19 @@
-import importlib
-import inspect
+# First, the profile starts when it's imported.
+from .utils.startup import startup
+
 import os
 import pkgutil
-from pathlib import Path
 
 import disnake
 
 from . import cogs
 from .bot import Bot
 
+startup.mark("imported disnake, aiohttp, aioredis")
+
 DISCORD_COMMAND_PREFIX = os.getenv("DISCORD_COMMAND_PREFIX", "!!")
+# Load the cogs in the background once connected, instead of before connecting.
+LAZY_STARTUP = os.getenv("LAZY_STARTUP", "1") == "1"
 
 intents = disnake.Intents.default()
 intents.bans = False
@@ -26,14 +30,16 @@ bot = Bot(
 )
 
 
-path = Path(__file__).parent.joinpath("cogs")
-for cog in pkgutil.walk_packages(cogs.__path__, cogs.__name__ + "."):
-    if not cog.ispkg:
-        imported = importlib.import_module(cog.name)
-        if inspect.isfunction(getattr(imported, "setup", None)):
-            try:
-                bot.load_extension(cog.name)
-            except Exception as e:
-                bot.logger.error(e)
+# Found without importing them, `load_extension` imports each one once.
+extensions = [
+    cog.name
+    for cog in pkgutil.walk_packages(cogs.__path__, cogs.__name__ + ".")
+    if not cog.ispkg
+]
+if LAZY_STARTUP:
+    bot.defer_extensions(extensions)
+else:
+    for name in extensions:
+        bot.load_extension_timed(name)
 
 bot.run(os.getenv("DISCORD_TOKEN"))
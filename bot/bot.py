@@ -1,42 +1,198 @@
+import ast
+import asyncio
+import importlib.util
 import os
+import sys
+import time
+from typing import Dict, Iterable, List, Optional
 
-import aiohttp
 import aioredis
 import disnake
 import loguru
+from aiohttp import web
 from disnake.ext import commands
 from dotenv import load_dotenv
 
+from .utils.claims import Claims
+from .utils.http import HttpPool
+from .utils.metrics import (
+    COMMAND_ERRORS,
+    COMMAND_SECONDS,
+    METRICS_HOST,
+    METRICS_PORT,
+    metrics,
+    serve,
+)
+from .utils.sharding import (
+    SHARD_COUNT,
+    SHARDS_PER_PROCESS,
+    claim_shards,
+    shard_of,
+    shard_ranges,
+)
+from .utils.startup import startup
+
 load_dotenv()
 
 
-class Bot(commands.Bot):
+def import_dependencies(name: str) -> None:
+    """Import the modules imported at the top of the module `name`, without
+    running it. `load_extension` then finds them in `sys.modules`.
+    """
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.origin is None:
+        return
+    with open(spec.origin, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), spec.origin)
+
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                importlib.import_module(alias.name)
+        elif isinstance(node, ast.ImportFrom):
+            base = importlib.util.resolve_name(
+                "." * node.level + (node.module or ""), spec.parent
+            )
+            importlib.import_module(base)
+            for alias in node.names:
+                # Only the submodules, found without running them.
+                if _is_submodule(base, alias.name):
+                    importlib.import_module(f"{base}.{alias.name}")
+
+
+def _is_submodule(package: str, name: str) -> bool:
+    if not hasattr(sys.modules[package], "__path__"):
+        return False
+    return importlib.util.find_spec(f"{package}.{name}") is not None
+
+
+class Bot(commands.AutoShardedBot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.http_session = aiohttp.ClientSession(trust_env=True)
+        # Shared with the sessions of the cogs.
+        self.http_pool = HttpPool()
+        self.http_session = self.http_pool.session()
         self.redis_session = None
+        # Without `decode_responses`, for the binary values.
+        self.redis_bytes_session = None
         self.logger = loguru.logger
+        self._deferred_extensions: List[str] = []
+        self._extensions_task: Optional[asyncio.Task] = None
+        self._ready_once = False
+        self.metrics_runner: Optional[web.AppRunner] = None
+        # Message or interaction id: start of the command.
+        self._command_started: Dict[int, float] = {}
+        self.shard_claims = Claims(lambda: self.redis_session, "bot:shards:")
+        # Whether the shards are split between processes, through the claims.
+        self.shards_claimed = False
+        self.shard_claims.on_lost.append(self._shards_lost)
+
+    def defer_extensions(self, names: Iterable[str]) -> None:
+        """Load the extensions in the background once started, their imports in
+        an executor, so the connection to Discord doesn't wait for them.
+        """
+        self._deferred_extensions.extend(names)
+
+    def load_extension_timed(self, name: str) -> None:
+        with startup.phase(f"load {name}"):
+            try:
+                self.load_extension(name)
+            except commands.NoEntryPointError:
+                self.logger.debug(f"{name} has no `setup`, not an extension.")
+            except Exception as e:
+                self.logger.error(f"Loading {name} failed: {e}")
 
     async def start(self, token: str, *, reconnect: bool = True) -> None:
         self.redis_session = self._create_redis_session()
+        self.redis_bytes_session = self._create_redis_session(decode_responses=False)
+        if METRICS_PORT:
+            try:
+                self.metrics_runner = await serve(metrics, METRICS_HOST, METRICS_PORT)
+            except OSError as e:
+                self.logger.warning(f"Can't serve the metrics: {e}")
+        if self._deferred_extensions:
+            self._extensions_task = self.loop.create_task(
+                self._load_deferred_extensions()
+            )
+
+        await self.login(token)
+        with startup.phase("claim shards"):
+            await self.claim_shards()
+        await self.connect(reconnect=reconnect)
 
-        await super().start(token, reconnect=reconnect)
+    async def claim_shards(self) -> None:
+        """Run a range of the shards no other process runs, see `claim_shards`."""
+        if SHARD_COUNT:
+            self.shard_count = SHARD_COUNT
+        if not SHARDS_PER_PROCESS:
+            # Every shard in this process, there's nothing to share.
+            return
+        if not SHARD_COUNT:
+            # Discord's recommendation changes over time, the processes started
+            # at different times would split different counts.
+            raise RuntimeError("Set SHARD_COUNT along with SHARDS_PER_PROCESS.")
+        if len(shard_ranges(SHARD_COUNT, SHARDS_PER_PROCESS)) == 1:
+            return
+
+        self.shard_ids = await claim_shards(self.shard_claims, SHARD_COUNT)
+        self.shards_claimed = True
+        self.shard_claims.start()
+        # The application commands are global, one process syncs them.
+        self._sync_commands = self._sync_commands and 0 in self.shard_ids
+
+    def owns_guild(self, guild_id: int) -> bool:
+        """Whether the events of the guild come to this process."""
+        if self.shard_count is None or self.shard_ids is None:
+            return True
+        return shard_of(guild_id, self.shard_count) in self.shard_ids
 
     async def close(self) -> None:
         await super().close()
 
+        await self.shard_claims.close()
+
         if self.http_session:
             await self.http_session.close()
+        await self.http_pool.close()
+
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
 
         if self.redis_session:
             await self.redis_session.close()
 
+        if self.redis_bytes_session:
+            await self.redis_bytes_session.close()
+
     async def on_ready(self) -> None:
         self.logger.info(f"{self.user} has connected to Discord!")
+        # Dispatched again after a reconnection.
+        if not self._ready_once:
+            self._ready_once = True
+            startup.mark("first on_ready")
+            self.logger.info(startup.report())
+
+    async def on_shard_ready(self, shard_id: int) -> None:
+        self.logger.info(f"Shard {shard_id} of {self.shard_count} is ready.")
+
+    async def on_command(self, ctx: commands.Context) -> None:
+        self._command_started[ctx.message.id] = time.perf_counter()
+
+    async def on_command_completion(self, ctx: commands.Context) -> None:
+        self._observe_command(ctx.message.id, ctx.command.qualified_name)
+
+    async def on_slash_command(self, inter: disnake.AppCmdInter) -> None:
+        self._command_started[inter.id] = time.perf_counter()
+
+    async def on_slash_command_completion(self, inter: disnake.AppCmdInter) -> None:
+        self._observe_command(inter.id, self._slash_name(inter))
 
     async def on_command_error(
         self, ctx: commands.Context, error: commands.CommandError
     ) -> None:
+        if ctx.command:
+            self._command_started.pop(ctx.message.id, None)
+            COMMAND_ERRORS.inc(command=ctx.command.qualified_name)
         if isinstance(error, commands.CommandNotFound):
             pass
         elif isinstance(error, commands.CheckFailure):
@@ -47,8 +203,48 @@ class Bot(commands.Bot):
     async def on_slash_command_error(
         self, inter: disnake.AppCmdInter, exception: commands.CommandError
     ) -> None:
+        self._command_started.pop(inter.id, None)
+        COMMAND_ERRORS.inc(command=self._slash_name(inter))
         await super().on_slash_command_error(inter, exception)
         self.logger.error(f"{exception}")
 
-    def _create_redis_session(self) -> aioredis.Redis:
-        return aioredis.from_url(os.environ["REDIS_URL"], decode_responses=True)
+    async def _load_deferred_extensions(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._deferred_extensions:
+            name = self._deferred_extensions.pop(0)
+            try:
+                with startup.phase(f"import {name} dependencies"):
+                    await loop.run_in_executor(None, import_dependencies, name)
+            except Exception as e:
+                self.logger.exception(
+                    f"Importing the dependencies of {name} failed: {e}"
+                )
+                continue
+            self.load_extension_timed(name)
+
+    def _shards_lost(self, name: str) -> None:
+        # Another process runs them now, restart as a standby.
+        self.logger.error(f"The shards {name} were claimed by another process.")
+        asyncio.create_task(self.close())
+
+    def _observe_command(self, id: int, command: str) -> None:
+        if (start := self._command_started.pop(id, None)) is not None:
+            COMMAND_SECONDS.observe(time.perf_counter() - start, command=command)
+
+    @staticmethod
+    def _slash_name(inter: disnake.AppCmdInter) -> str:
+        names = [inter.data.name]
+        options = inter.data.options
+        sub_commands = (
+            disnake.OptionType.sub_command,
+            disnake.OptionType.sub_command_group,
+        )
+        while options and options[0].type in sub_commands:
+            names.append(options[0].name)
+            options = options[0].options
+        return "/" + " ".join(names)
+
+    def _create_redis_session(self, decode_responses: bool = True) -> aioredis.Redis:
+        return aioredis.from_url(
+            os.environ["REDIS_URL"], decode_responses=decode_responses
+        )
@@ -1,28 +1,80 @@
 import asyncio
+import contextlib
 from datetime import datetime
 import json
 import os
+import re
+import socket
 import textwrap
 import time
-from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from functools import partial
 from http.cookies import SimpleCookie
 from io import BytesIO
-from pathlib import Path
-from typing import Any, Iterable, List, Mapping, Optional, Tuple, Union
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
-import aiofiles
 import aiohttp
 import disnake
 import genshin
+import pydantic
 from genshin.models.base import PartialCharacter
 from genshin.models.character import Character
+from genshin.models.hoyolab import RecordCard
+from genshin.models.notes import Notes
 from genshin.models.stats import PartialUserStats
 from disnake.ext import commands, tasks
 from PIL import Image, ImageDraw, ImageFont
+from yarl import URL
 
 from bot.utils import database
+from bot.utils.assets import ImageLRU, assets
+from bot.utils.downloader import AssetDownloader, AssetRequest
+from bot.utils.encoding import (
+    ENCODING_MAX_BYTES,
+    ENCODING_PROFILE,
+    PROFILES,
+    EncodedImage,
+    encode_image,
+    guess_extension,
+)
 from bot.utils.base_cog import BaseCog
+from bot.utils.character_index import CharacterEntry, CharacterIndex
+from bot.utils.claims import Claims
+from bot.utils.cookie_pool import (
+    Cookie,
+    CookiePool,
+    CookieQuarantined,
+    NoCookieAvailable,
+)
 from bot.utils.errors import GenshinCogError
+from bot.utils.fonts import fonts
+from bot.utils.http import HttpPool
+from bot.utils.metrics import (
+    CACHE_REQUESTS,
+    QUEUE_DEPTH,
+    STAGE_SECONDS,
+    cache_ratio,
+    stage,
+)
+from bot.utils.render import RenderEngine
+from bot.utils.render_cache import RenderCache
+from bot.utils.serializer import serializer
+from bot.utils.singleflight import SingleFlight
+from bot.utils.startup import startup
 
 SERVER_NAME = {
     "1": "天空岛",
@@ -54,9 +106,37 @@ ELEMENT_BACKGROUND_COLORS = {
     "Pyro": "#ECC5C3",
 }
 
+# Bump it whenever the card layout or the templates change,
+# so the rendered images cached before are not reused.
+RENDER_VERSION = "1"
+
+# Every font size used by the card renderers, preloaded once the cog is ready.
+FONT_SIZES = (12, 18, 20, 22, 24, 26, 28, 30, 32, 34, 40, 50)
+# The static parts of the cards, loaded by every render process as it starts.
+CARD_TEMPLATES = ("info-new-upper", "element", "card-new-middle", "card-new-bottom")
+
+TILE_CACHE_MB = int(os.getenv("GENSHIN_TILE_CACHE_MB", "64"))
+# Seconds between the checks of `genshin_characters` for changes.
+CHARACTER_INDEX_REFRESH = int(os.getenv("GENSHIN_CHARACTER_INDEX_REFRESH", "600"))
+# Seconds each account's notes may take before it's shown as failed.
+NOTE_TIMEOUT = float(os.getenv("GENSHIN_NOTE_TIMEOUT", "10"))
+# The record cards rarely change, the level at most.
+RECORD_CARD_TTL = int(os.getenv("GENSHIN_RECORD_CARD_TTL", "86400"))
+# Discord allows 10 attachments per message.
+MAX_CHARACTERS = 10
+# Discord's upload limit of a message, in the guilds without boosts.
+DEFAULT_FILESIZE_LIMIT = 8 << 20
+# Room left for the rest of the multipart request.
+UPLOAD_MARGIN = 16 << 10
+
+Model = TypeVar("Model", bound=pydantic.BaseModel)
+
+# Finished roster tiles of `draw_user_characters`, shared between the requests.
+character_tiles = ImageLRU(TILE_CACHE_MB << 20)
+
 
 def set_font(size: int = 20) -> ImageFont.FreeTypeFont:
-    return ImageFont.truetype("./static/fonts/font.ttf", size=size)
+    return fonts.get(size)
 
 
 def concat_images(images: List[Image.Image]) -> Image.Image:
@@ -77,7 +157,7 @@ def concat_images(images: List[Image.Image]) -> Image.Image:
 
 def draw_user_base(uid: int, data: PartialUserStats) -> Image.Image:
     server = SERVER_NAME.get(str(uid)[0], "")
-    img = Image.open("./static/genshin/card/info-new-upper.png")
+    img = assets.get("card", "info-new-upper")
     text_draw = ImageDraw.Draw(img)
     text_draw.text((280, 120), f"UID {uid}", "#263238", set_font(34))
     text_draw.text((380, 170), server, "#424242", set_font(30))
@@ -133,8 +213,8 @@ def draw_user_base(uid: int, data: PartialUserStats) -> Image.Image:
 
     for character in data.characters[::-1]:
         if character.id in [10000005, 10000007]:
-            with Image.open(f"./static/genshin/avatars/{character.id}.png").resize(
-                (180, 180), Image.BILINEAR
+            with assets.get(
+                "avatars", character.id, (180, 180), Image.BILINEAR
             ) as traveler:
                 img.paste(traveler, (90, 60), traveler)
                 break
@@ -142,41 +222,85 @@ def draw_user_base(uid: int, data: PartialUserStats) -> Image.Image:
     return img
 
 
+def character_key(uid: int, character_id: int) -> str:
+    return f"bot:genshin:character:{uid}:{character_id}"
+
+
+def split_character_names(text: str) -> List[str]:
+    """`胡桃, 钟离，甘雨` -> [胡桃, 钟离, 甘雨], without the duplicates."""
+    names = (name.strip() for name in re.split(r"[,，、]", text))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def batch_uploads(
+    files: List[Tuple[str, BytesIO]], max_bytes: int
+) -> Iterator[List[Tuple[str, BytesIO]]]:
+    """Group the cards in order into messages under `max_bytes` each."""
+    batch: List[Tuple[str, BytesIO]] = []
+    size = 0
+    for filename, file in files:
+        n = file.getbuffer().nbytes
+        if batch and (size + n > max_bytes or len(batch) == MAX_CHARACTERS):
+            yield batch
+            batch, size = [], 0
+        batch.append((filename, file))
+        size += n
+    if batch:
+        yield batch
+
+
 def chunk_list(l: List, n: int = 7):
     for i in range(0, len(l), n):
         yield l[i : i + n]
 
 
+def draw_character_tile(character: PartialCharacter) -> Image.Image:
+    """The roster tile of a character, it's cached and must not be modified."""
+    # The avatar's version changes when its file is replaced.
+    key = (
+        character.id,
+        character.constellation,
+        character.level,
+        character.friendship,
+        assets.version("avatars", character.id),
+    )
+    if (char_element := character_tiles.get(key)) is not None:
+        return char_element
+
+    char_element = assets.get("card", "element")
+    with assets.get("avatars", character.id, (150, 150), Image.BILINEAR) as char_img:
+        char_element.paste(char_img, (4, 4), char_img)
+    char_txt = ImageDraw.Draw(char_element)
+    char_txt.text(
+        (8, 2),
+        f"C{character.constellation}",
+        "#b388ff",
+        set_font(20),
+    )
+    char_txt.text(
+        (50, 165),
+        f"Lv.{character.level}",
+        "#64dd17",
+        set_font(22),
+    )
+    char_txt.text(
+        (50, 200),
+        f"^_^{character.friendship}",
+        "#ff80ab",
+        set_font(22),
+    )
+    character_tiles.put(key, char_element)
+
+    return char_element
+
+
 def draw_user_characters(characters: List[PartialCharacter]) -> Image.Image:
     box_x, box_y = 110, 10
-    middle = Image.open("./static/genshin/card/card-new-middle.png")
+    middle = assets.get("card", "card-new-middle")
     for character in characters:
-        with Image.open("./static/genshin/card/element.png") as char_element:
-            with Image.open(f"./static/genshin/avatars/{character.id}.png").resize(
-                (150, 150), Image.BILINEAR
-            ) as char_img:
-                char_element.paste(char_img, (4, 4), char_img)
-                char_txt = ImageDraw.Draw(char_element)
-                char_txt.text(
-                    (8, 2),
-                    f"C{character.constellation}",
-                    "#b388ff",
-                    set_font(20),
-                )
-                char_txt.text(
-                    (50, 165),
-                    f"Lv.{character.level}",
-                    "#64dd17",
-                    set_font(22),
-                )
-                char_txt.text(
-                    (50, 200),
-                    f"^_^{character.friendship}",
-                    "#ff80ab",
-                    set_font(22),
-                )
-                middle.paste(char_element, (box_x, box_y), char_element)
-                box_x += 180
+        char_element = draw_character_tile(character)
+        middle.paste(char_element, (box_x, box_y), char_element)
+        box_x += 180
 
     return middle
 
@@ -195,11 +319,9 @@ def draw_character(uid: int, character: Character) -> Image.Image:
         ELEMENT_BACKGROUND_COLORS[character.element],
     ) as background:
         img.paste(background, (20, 20))
-    with Image.open(f"./static/genshin/characters/{character.id}.png") as char_img:
+    with assets.get("characters", character.id) as char_img:
         img.paste(char_img, (240, 40), char_img)
-    with Image.open(
-        f"./static/genshin/elements/{character.element}.png"
-    ) as element_img:
+    with assets.get("elements", character.element) as element_img:
         img.paste(element_img, (40, 40), element_img)
 
     # base info
@@ -219,7 +341,7 @@ def draw_character(uid: int, character: Character) -> Image.Image:
         fill=element_color,
         font=set_font(50),
     )
-    w, h = text_draw.textsize(character.name, font=set_font(50))
+    w, h = fonts.textsize(character.name, 50)
     text_draw.text(
         (w + 130, 118),
         f"Lv.{character.level}",
@@ -234,9 +356,7 @@ def draw_character(uid: int, character: Character) -> Image.Image:
     )
 
     # weapon
-    with Image.open(f"./static/genshin/weapons/{character.weapon.id}.png").resize(
-        (100, 100)
-    ) as weapon_img:
+    with assets.get("weapons", character.weapon.id, (100, 100)) as weapon_img:
         img.paste(weapon_img, (40, 320), weapon_img)
     text_draw.text(
         (150, 320),
@@ -244,7 +364,7 @@ def draw_character(uid: int, character: Character) -> Image.Image:
         fill=element_color,
         font=set_font(26),
     )
-    w, h = text_draw.textsize(character.weapon.name, font=set_font(26))
+    w, h = fonts.textsize(character.weapon.name, 26)
     text_draw.text(
         (w + 156, h + 300),
         f"+{character.weapon.level} · 精{character.weapon.refinement}",
@@ -269,9 +389,7 @@ def draw_character(uid: int, character: Character) -> Image.Image:
         with Image.new("RGBA", (80, 80)) as item_img:
             item_draw = ImageDraw.Draw(item_img)
             item_draw.rounded_rectangle((0, 0, 80, 80), radius=10, fill=element_color)
-            with Image.open(f"./static/genshin/artifacts/{artifact.id}.png").resize(
-                (80, 80)
-            ) as artifact_img:
+            with assets.get("artifacts", artifact.id, (80, 80)) as artifact_img:
                 item_img.paste(artifact_img, (0, 0), artifact_img)
             img.paste(item_img, (pos_x, pos_y), item_img)
         text_draw.text(
@@ -280,7 +398,7 @@ def draw_character(uid: int, character: Character) -> Image.Image:
             fill=element_color,
             font=set_font(22),
         )
-        w, h = text_draw.textsize(artifact.name, font=set_font(22))
+        w, h = fonts.textsize(artifact.name, 22)
         text_draw.text(
             (pos_x + w + 96, pos_y + h - 20),
             f"+{artifact.level}",
@@ -298,17 +416,133 @@ def draw_character(uid: int, character: Character) -> Image.Image:
     return img
 
 
+def user_assets(stats: PartialUserStats) -> Iterable[AssetRequest]:
+    for character in stats.characters:
+        yield "avatars", character.id, character.icon
+
+
+def character_assets(character: Character) -> Iterable[AssetRequest]:
+    yield "characters", character.id, character.image
+    yield "weapons", character.weapon.id, character.weapon.icon
+    for artifact in character.artifacts:
+        yield "artifacts", artifact.id, artifact.icon
+
+
+# The `render_*` functions are the jobs of the render engine. They may run in
+# another process, so they take plain models and return the encoded image.
+def render_user_stats(
+    uid: int, stats: PartialUserStats, profile: str, max_bytes: int
+) -> EncodedImage:
+    start = time.perf_counter()
+    assets.refresh()
+    images = [
+        draw_user_base(uid, stats),
+        *[
+            draw_user_characters(characters)
+            for characters in chunk_list(stats.characters)
+        ],
+        assets.get("card", "card-new-bottom"),
+    ]
+    with concat_images(images) as user_stats_image:
+        drawn = time.perf_counter() - start
+        encoded = encode_image(user_stats_image, profile, max_bytes)
+    for img in images:
+        img.close()
+
+    return encoded._replace(render_seconds=drawn)
+
+
+def render_character(
+    uid: int, character: Character, profile: str, max_bytes: int
+) -> EncodedImage:
+    start = time.perf_counter()
+    assets.refresh()
+    with draw_character(uid, character) as img:
+        drawn = time.perf_counter() - start
+        return encode_image(img, profile, max_bytes)._replace(render_seconds=drawn)
+
+
+def warm_render_worker() -> None:
+    """Load the fonts and the card templates of a new render process."""
+    fonts.preload(FONT_SIZES)
+    for name in CARD_TEMPLATES:
+        assets.get("card", name)
+
+
 class CustomGenshinClient(genshin.MultiCookieClient):
-    def __init__(self, **kwargs) -> None:
+    """A `MultiCookieClient` spreading the requests over its cookies with a `CookiePool`."""
+
+    def __init__(self, http_pool: HttpPool, **kwargs) -> None:
+        self.http_pool = http_pool
+        self.pool = CookiePool()
+        self._pinned: ContextVar[Optional[aiohttp.ClientSession]] = ContextVar(
+            "pinned_session", default=None
+        )
         super().__init__(**kwargs)
 
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self._pinned.get() or super().session
+
+    @contextlib.contextmanager
+    def pinned(self, session: aiohttp.ClientSession):
+        """Send the requests of this context with `session` only,
+        for the endpoints about the cookie's own account.
+        """
+        token = self._pinned.set(session)
+        try:
+            yield
+        finally:
+            self._pinned.reset(token)
+
+    async def request(
+        self,
+        url: Union[str, URL],
+        method: str = "GET",
+        headers: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        headers = headers or {}
+        headers["user-agent"] = self.USER_AGENT
+
+        tried: List[Cookie] = []
+        while True:
+            try:
+                with stage("cookie_wait"):
+                    cookie = await self.pool.acquire(tried, self._pinned.get())
+            except CookieQuarantined as e:
+                raise genshin.errors.InvalidCookies({"retcode": -100}, str(e))
+            except NoCookieAvailable as e:
+                raise genshin.errors.TooManyRequests({"retcode": 10101}, str(e))
+
+            tried.append(cookie)
+            try:
+                with stage("hoyolab"):
+                    async with cookie.session.request(
+                        method, url, headers=headers, **kwargs
+                    ) as r:
+                        r.raise_for_status()
+                        data = await r.json()
+
+                if data["retcode"] == 0:
+                    self.pool.succeeded(cookie)
+                    return data["data"]
+
+                genshin.errors.raise_for_retcode(data)
+            except genshin.errors.TooManyRequests:
+                self.pool.rate_limit(cookie)
+            except genshin.errors.InvalidCookies as e:
+                self.pool.quarantine(cookie, e.msg)
+            finally:
+                self.pool.release(cookie)
+
     def set_cookies(
         self,
         cookie_list: Union[Iterable[Union[Mapping[str, Any], str]], str],
         clear: bool = True,
     ) -> List[Mapping[str, str]]:
-        """Same method as the parent class,
-        but allows the `aiohttp.ClientSession` to use the system proxy.
+        """Same method as the parent class, but the sessions share the
+        connections of `http_pool` and use the system proxy.
         It's useful when requesting `https://bbs-api-os.mihoyo.com/`
         from China raises `403 Forbidden`.
         """
@@ -323,43 +557,57 @@ class CustomGenshinClient(genshin.MultiCookieClient):
                 raise RuntimeError("Json file must contain a list of cookies")
 
         for cookies in cookie_list:
-            session = aiohttp.ClientSession(
-                cookies=SimpleCookie(cookies), trust_env=True
-            )
+            session = self.http_pool.session(cookies=SimpleCookie(cookies))
             self.sessions.append(session)
+        self.pool.reset(self.sessions)
 
         return self.cookies
 
-    def switch_session(self):
-        if len(self.sessions) > 1:
-            session = self.sessions.pop(0)
-            self.sessions.append(session)
-
 
 class Genshin(BaseCog):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.genshin_client = CustomGenshinClient(debug=True)
+        self.genshin_client = CustomGenshinClient(self.bot.http_pool, debug=True)
         if not (cookies := os.getenv("GENSHIN_COOKIES")):
             raise Exception("Please set your `GENSHIN_COOKIES` in `.env`.")
         self.genshin_client.set_cookies(cookies.split("#"))
+        self.render_cache = RenderCache(RENDER_VERSION)
+        self.lookups = SingleFlight(lambda: self.redis_session)
+        self.render = RenderEngine(warm=warm_render_worker)
+        if ENCODING_PROFILE not in PROFILES:
+            raise Exception(
+                f"Unknown `GENSHIN_CARD_PROFILE`: {ENCODING_PROFILE}, "
+                f"must be one of {', '.join(PROFILES)}."
+            )
+        self.encoding = (ENCODING_PROFILE, ENCODING_MAX_BYTES)
+
+        self.downloader = AssetDownloader(
+            self.http_session,
+            assets.image_dir,
+            ("avatars", "characters", "weapons", "artifacts"),
+            known=assets.bundled,
+            # The processes of a host share its image directory.
+            claims=Claims(
+                lambda: self.redis_session, f"bot:assets:{socket.gethostname()}:"
+            ),
+        )
+        self.downloader.on_downloaded.append(self._on_asset_downloaded)
 
-        self.q = asyncio.Queue()
-        self.image_dir = "./static/genshin/"
-        self.static = {
-            "avatars": [
-                int(i.stem) for i in Path(f"{self.image_dir}avatars").glob("*.png")
-            ],
-            "characters": [
-                int(i.stem) for i in Path(f"{self.image_dir}characters").glob("*.png")
-            ],
-            "weapons": [
-                int(i.stem) for i in Path(f"{self.image_dir}weapons").glob("*.png")
-            ],
-            "artifacts": [
-                int(i.stem) for i in Path(f"{self.image_dir}artifacts").glob("*.png")
-            ],
-        }
+        self.character_index = CharacterIndex()
+
+        cache_ratio(
+            "render", lambda: self.render_cache.hits, lambda: self.render_cache.misses
+        )
+        QUEUE_DEPTH.set_function(lambda: self.render.in_flight, queue="render")
+        QUEUE_DEPTH.set_function(lambda: self.render.waiting, queue="render_waiting")
+        QUEUE_DEPTH.set_function(
+            lambda: self.downloader.in_flight, queue="asset_download"
+        )
+        QUEUE_DEPTH.set_function(
+            lambda: sum(c.in_flight for c in self.genshin_client.pool.cookies.values()),
+            queue="hoyolab",
+        )
+        QUEUE_DEPTH.set_function(lambda: self.lookups.in_flight, queue="lookup")
 
         self.note_channel = None
         self.note_channel_id = None
@@ -367,8 +615,24 @@ class Genshin(BaseCog):
             self.note_channel_id = int(note_channel_id)
             self.note_task.start()
 
+    async def cog_ready(self) -> None:
+        loop = asyncio.get_running_loop()
+        with startup.phase("genshin schema"):
+            await database.async_create_tables()
+        self.character_index_task.start()
+        with startup.phase("genshin asset scan"):
+            await self.downloader.scan_all()
+        with startup.phase("genshin fonts"):
+            await loop.run_in_executor(None, fonts.preload, FONT_SIZES)
+        with startup.phase("genshin render workers"):
+            await self.render.start()
+
     def cog_unload(self) -> None:
+        super().cog_unload()
         self.note_task.cancel()
+        self.character_index_task.cancel()
+        self.render.shutdown()
+        asyncio.create_task(self.downloader.close())
         asyncio.create_task(self.genshin_client.close())
 
     @commands.command(name="u", help="查询游戏账号信息")
@@ -378,28 +642,68 @@ class Genshin(BaseCog):
         if msg:
             await ctx.send(msg)
         else:
-            await ctx.send(file=disnake.File(file, filename=filename))
+            with stage("discord_upload"):
+                await ctx.send(file=disnake.File(file, filename=filename))
 
         self.logger.info(
             f"User[{ctx.author}] request Genshin[{uid}] "
             f"costed: {time.perf_counter() - start:.2f}s"
         )
 
-    @commands.command(name="c", help="查询游戏角色详情")
+    @commands.command(name="c", help="查询游戏角色详情，多个角色用逗号分隔")
     async def genshin_character(self, ctx, uid: int, *character_name: str):
         name = " ".join(character_name)
         start = time.perf_counter()
-        msg, filename, file = await self.create_genshin_character_data(uid, name)
-        if msg:
-            await ctx.send(msg)
+        msg, files = await self.create_genshin_character_data(
+            uid, split_character_names(name)
+        )
+        if files:
+            limit = ctx.guild.filesize_limit if ctx.guild else DEFAULT_FILESIZE_LIMIT
+            await self.send_cards(ctx.send, ctx.send, msg, files, limit)
         else:
-            await ctx.send(file=disnake.File(file, filename=filename))
+            await ctx.send(msg)
 
         self.logger.info(
             f"User[{ctx.author}] request Genshin[{uid}] Character[{name}] "
             f"costed: {time.perf_counter() - start:.2f}s"
         )
 
+    async def send_cards(
+        self,
+        send_first: Callable[..., Awaitable[Any]],
+        send_more: Callable[..., Awaitable[Any]],
+        msg: str,
+        files: List[Tuple[str, BytesIO]],
+        max_bytes: int,
+    ) -> None:
+        """Send the cards in as many messages as the upload limit needs."""
+        content: Optional[str] = msg or None
+        sent = failed = 0
+        for batch in batch_uploads(files, max_bytes - UPLOAD_MARGIN):
+            send = send_more if sent else send_first
+            try:
+                with stage("discord_upload"):
+                    await send(
+                        content=content,
+                        files=[
+                            disnake.File(file, filename=filename)
+                            for filename, file in batch
+                        ],
+                    )
+            except disnake.HTTPException as e:
+                failed += len(batch)
+                self.logger.warning(
+                    f"Sending the cards {[filename for filename, _ in batch]} failed: {e}"
+                )
+            else:
+                sent += 1
+                content = None
+
+        if failed:
+            note = f"有 {failed} 张卡片没能发出来。。"
+            send = send_more if sent else send_first
+            await send(content="\n".join(filter(None, (content, note))))
+
     @commands.is_owner()
     @commands.command(name="n", help="查询原神实时便笺")
     async def genshin_note(self, ctx: commands.Context):
@@ -423,9 +727,10 @@ class Genshin(BaseCog):
         if msg:
             await inter.send(msg)
         else:
-            await inter.edit_original_message(
-                file=disnake.File(file, filename=filename)
-            )
+            with stage("discord_upload"):
+                await inter.edit_original_message(
+                    file=disnake.File(file, filename=filename)
+                )
 
         self.logger.info(
             f"User[{inter.author}] request Genshin[{uid}] "
@@ -437,26 +742,38 @@ class Genshin(BaseCog):
         self,
         inter: disnake.AppCmdInter,
         uid: int = commands.Param(desc="游戏内 UID"),
-        character_name: str = commands.Param(desc="角色名"),
+        character_name: str = commands.Param(desc="角色名，多个角色用逗号分隔"),
     ):
         start = time.perf_counter()
         await inter.response.defer()
 
-        msg, filename, file = await self.create_genshin_character_data(
-            uid, character_name
+        msg, files = await self.create_genshin_character_data(
+            uid, split_character_names(character_name)
         )
-        if msg:
-            await inter.send(msg)
-        else:
-            await inter.edit_original_message(
-                file=disnake.File(file, filename=filename)
+        if files:
+            limit = (
+                inter.guild.filesize_limit if inter.guild else DEFAULT_FILESIZE_LIMIT
+            )
+            await self.send_cards(
+                inter.edit_original_message, inter.followup.send, msg, files, limit
             )
+        else:
+            await inter.send(msg)
 
         self.logger.info(
             f"User[{inter.author}] request Genshin[{uid}] Character[{character_name}] "
             f"costed: {time.perf_counter() - start:.2f}s"
         )
 
+    @character.autocomplete("character_name")
+    async def character_name_autocomplete(
+        self, inter: disnake.AppCmdInter, user_input: str
+    ) -> List[str]:
+        # Complete the last of the comma separated names.
+        *names, last = re.split(r"[,，、]", user_input)
+        prefix = "".join(f"{name}," for name in names)
+        return [prefix + name for name in self.character_index.complete(last.strip())]
+
     @commands.is_owner()
     @genshin.sub_command()
     async def note(self, inter: disnake.AppCmdInter):
@@ -470,11 +787,26 @@ class Genshin(BaseCog):
         file = BytesIO()
         try:
             stats = await self.search_genshin_user(uid)
-            file = await self._draw_user_stats(uid, stats, file)
+            key = self.render_cache.key("user", uid, self.encoding, stats.dict())
+            if data := await self.render_cache.get(key):
+                file = BytesIO(data)
+            else:
+                # Don't cache the cards drawn with placeholders.
+                complete = await self.downloader.ensure(user_assets(stats))
+                file = await self._draw_user_stats(uid, stats, file)
+                if complete:
+                    await self._cache_render(key, file.getvalue())
+            filename = f"{uid}.{guess_extension(file.getvalue())}"
         except genshin.errors.AccountNotFound as e:
             msg = "查无此用户。"
         except genshin.errors.DataNotPublic as e:
             msg = "该用户隐藏了自己的秘密。"
+        except genshin.errors.TooManyRequests as e:
+            msg = "查询太频繁了，请稍后再试。"
+            self.logger.warning(e)
+        except genshin.errors.InvalidCookies as e:
+            msg = "查询用的账号已失效，请联系管理员。"
+            self.logger.error(e)
         except Exception as e:
             msg = "查询失败。"
             self.logger.error(e)
@@ -486,6 +818,18 @@ class Genshin(BaseCog):
         embed = await self.create_genshin_note_data()
         await self.note_channel.send(embed=embed)
 
+    @tasks.loop(seconds=CHARACTER_INDEX_REFRESH)
+    async def character_index_task(self):
+        await self.refresh_character_index()
+
+    async def refresh_character_index(self) -> None:
+        characters = await database.async_get_characters()
+        # `None` when the query failed, keep the current index.
+        if characters and self.character_index.update(characters):
+            self.logger.info(
+                f"Character index rebuilt: {len(self.character_index)} characters."
+            )
+
     @note_task.before_loop
     async def before_note_task(self):
         await self.bot.wait_until_ready()
@@ -501,48 +845,74 @@ class Genshin(BaseCog):
 
     async def search_genshin_user(self, uid: int) -> PartialUserStats:
         key = f"bot:genshin:user:{uid}"
-        stats = await self.redis_session.get(key)
-        if stats:
-            stats = PartialUserStats(**json.loads(stats))
-        else:
-            stats = await self.genshin_client.get_partial_user(uid, lang="zh-cn")
-            await self.redis_session.set(key, json.dumps(stats.dict()), ex=3600)
 
-        for character in stats.characters:
-            if character.id not in self.static["avatars"]:
-                await self.q.put(("avatars", character.id, character.icon))
+        async def cached(count: bool = True) -> Optional[PartialUserStats]:
+            return await self._cache_get(key, PartialUserStats, count)
 
-        return stats
+        async def fetch() -> PartialUserStats:
+            stats = await self.genshin_client.get_partial_user(uid, lang="zh-cn")
+            await self._cache_set(key, stats)
+            return stats
+
+        if stats := await cached():
+            return stats
+        # The miss above is counted, not the polls while another process fetches.
+        return await self.lookups.do(key, fetch, partial(cached, count=False))
 
     async def create_genshin_character_data(
-        self, uid: int, character_name: str
-    ) -> Tuple[str, str, BytesIO]:
+        self, uid: int, character_names: List[str]
+    ) -> Tuple[str, List[Tuple[str, BytesIO]]]:
         msg = ""
-        filename = ""
-        file = BytesIO()
+        files: List[Tuple[str, BytesIO]] = []
         try:
-            character = await self.search_genshin_character(uid, character_name)
-            filename = f"{uid}_{character.name}.png"
-            file = await self._draw_character(uid, character, file)
+            characters, missing = await self.search_genshin_characters(
+                uid, character_names
+            )
+            files = await asyncio.gather(
+                *[self._character_card(uid, character) for character in characters]
+            )
+            if missing:
+                msg = f"用户[**{uid}**] 无此角色: **{'**, **'.join(missing)}**"
         except GenshinCogError as e:
             msg = str(e)
         except genshin.errors.AccountNotFound as e:
             msg = "查无此用户。"
         except genshin.errors.DataNotPublic as e:
             msg = "该用户隐藏了自己的秘密。"
+        except genshin.errors.TooManyRequests as e:
+            msg = "查询太频繁了，请稍后再试。"
+            self.logger.warning(e)
+        except genshin.errors.InvalidCookies as e:
+            msg = "查询用的账号已失效，请联系管理员。"
+            self.logger.error(e)
         except Exception as e:
             msg = "查询失败。"
             self.logger.error(e)
-        return msg, filename, file
+        return msg, list(files)
+
+    async def _character_card(
+        self, uid: int, character: Character
+    ) -> Tuple[str, BytesIO]:
+        key = self.render_cache.key("character", uid, self.encoding, character.dict())
+        if data := await self.render_cache.get(key):
+            file = BytesIO(data)
+        else:
+            complete = await self.downloader.ensure(character_assets(character))
+            file = await self._draw_character(uid, character, BytesIO())
+            if complete:
+                await self._cache_render(key, file.getvalue())
 
-    async def search_genshin_character(
-        self, uid: int, character_name: str
-    ) -> Character:
-        loop = asyncio.get_event_loop()
-        characters = await loop.run_in_executor(
-            None, database.get_character_by_name, character_name
-        )
+        return f"{uid}_{character.name}.{guess_extension(file.getvalue())}", file
+
+    async def _cache_render(self, key: str, data: bytes) -> None:
+        """Cache a rendered card, the card is still sent when it can't be."""
+        try:
+            await self.render_cache.set(key, data)
+        except OSError as e:
+            self.logger.warning(f"Caching the render [{key}] failed: {e}")
 
+    def resolve_character(self, character_name: str) -> CharacterEntry:
+        characters = self.character_index.search(character_name)
         if not characters:
             raise GenshinCogError(f"没有**{character_name}**，请输入正确的角色名")
         if len(characters) > 1:
@@ -550,36 +920,75 @@ class Genshin(BaseCog):
                 f"查询到多个角色，要找的是不是 **{'**, **'.join(c.name for c in characters)}**"
             )
 
-        try:
-            key = f"bot:genshin:character:{uid}:{characters[0].id}"
-            character = await self.redis_session.get(key)
-            if character:
-                character = Character(**json.loads(character))
-            else:
-                character = await self.genshin_client.get_characters(
-                    uid, [characters[0].id], lang="zh-cn"
-                )
-                character = character[0]
-                await self.redis_session.set(key, json.dumps(character.dict()), ex=3600)
-
-            # The missing images.
-            if character.id not in self.static["characters"]:
-                await self.q.put(("characters", character.id, character.image))
-            if character.weapon.id not in self.static["weapons"]:
-                await self.q.put(
-                    ("weapons", character.weapon.id, character.weapon.icon)
-                )
-            for artifact in character.artifacts:
-                if artifact.id not in self.static["artifacts"]:
-                    await self.q.put(("artifacts", artifact.id, artifact.icon))
+        return characters[0]
+
+    async def search_genshin_characters(
+        self, uid: int, character_names: List[str]
+    ) -> Tuple[List[Character], List[str]]:
+        """The characters found, and the names of the ones the user doesn't have."""
+        if not character_names:
+            raise GenshinCogError("请输入角色名")
+        if len(character_names) > MAX_CHARACTERS:
+            raise GenshinCogError(f"一次最多查询 {MAX_CHARACTERS} 个角色")
+        if not self.character_index:
+            await self.refresh_character_index()
+        entries = [self.resolve_character(name) for name in character_names]
+
+        keys = [character_key(uid, entry.id) for entry in entries]
+        found = await self._cache_get_many(keys, Character)
+        if None in found:
+            roster = await self.search_genshin_roster(uid)
+            found = [
+                character or roster.get(entry.id)
+                for entry, character in zip(entries, found)
+            ]
+
+        missing = [entry.name for entry, c in zip(entries, found) if c is None]
+        if len(missing) == len(entries):
+            raise GenshinCogError(f"用户[**{uid}**] 无此角色")
+
+        return [character for character in found if character], missing
+
+    async def search_genshin_roster(self, uid: int) -> Dict[int, Character]:
+        """Every character of the user, fetched in one call and cached one by one."""
+        key = f"bot:genshin:roster:{uid}"
+
+        async def cached(count: bool = True) -> Optional[Dict[int, Character]]:
+            data = await self.redis_bytes_session.get(key)
+            if data is None or (roster := serializer.loads(data)) is None:
+                return None
+            ids = roster["ids"]
+            characters = await self._cache_get_many(
+                [character_key(uid, id) for id in ids], Character, count
+            )
+            if None in characters:
+                return None
+            return {character.id: character for character in characters}
 
-        except genshin.errors.GenshinException as e:
-            if e.msg.startswith("User does not have"):
-                raise GenshinCogError(f"用户[**{uid}**] 无此角色")
-            else:
-                raise
+        async def fetch() -> Dict[int, Character]:
+            stats = await self.search_genshin_user(uid)
+            ids = [character.id for character in stats.characters]
+            characters = await self.genshin_client.get_characters(
+                uid, ids, lang="zh-cn"
+            )
+            # One round trip, the roster key last so it never lists a missing one.
+            pipe = self.redis_bytes_session.pipeline(transaction=False)
+            for character in characters:
+                pipe.set(
+                    character_key(uid, character.id),
+                    serializer.dumps(character.dict()),
+                    ex=3600,
+                )
+            # The ids returned, HoYoLAB leaves out the ones it doesn't know.
+            returned = [character.id for character in characters]
+            pipe.set(key, serializer.dumps({"ids": returned}), ex=3600)
+            await pipe.execute()
+            return {character.id: character for character in characters}
 
-        return character
+        if roster := await cached():
+            return roster
+        # The miss above is counted, not the polls while another process fetches.
+        return await self.lookups.do(key, fetch, partial(cached, count=False))
 
     async def create_genshin_note_data(self) -> disnake.Embed:
         embed = disnake.Embed(title="实时便笺", timestamp=datetime.now())
@@ -589,9 +998,25 @@ class Genshin(BaseCog):
             icon_url="https://img-static.mihoyo.com/avatar/avatar1.png",
         )
 
-        for _ in self.genshin_client.sessions:
-            record_card = await self.genshin_client.get_record_card()
-            notes = await self.genshin_client.get_notes(record_card.uid)
+        sessions = self.genshin_client.sessions
+        results = await asyncio.gather(
+            *[
+                asyncio.wait_for(self._get_account_notes(session), NOTE_TIMEOUT)
+                for session in sessions
+            ],
+            return_exceptions=True,
+        )
+        for session, result in zip(sessions, results):
+            if isinstance(result, BaseException):
+                # Shown degraded, the other accounts are still reported.
+                name = self.genshin_client.pool.get(session).name
+                reason = "超时" if isinstance(result, asyncio.TimeoutError) else result
+                self.logger.warning(f"Notes of Cookie[{name}] failed: {result!r}")
+                embed.add_field(f"账号 {name}", f"⚠️ 获取失败: {reason}", inline=False)
+                embed.add_field(f"{'-' * 40}", "\u200b")
+                continue
+
+            record_card, notes = result
             embed.add_field(
                 f"{record_card.nickname}",
                 f"{record_card.server_name} Lv.{record_card.level}",
@@ -617,96 +1042,91 @@ class Genshin(BaseCog):
             )
             embed.add_field(f"{'-' * 40}", "\u200b")
 
-            self.genshin_client.switch_session()
-
         embed.remove_field(-1)
 
         return embed
 
+    async def _get_account_notes(
+        self, session: aiohttp.ClientSession
+    ) -> Tuple[RecordCard, Notes]:
+        # Each call runs in its own task, the pinned session stays in it.
+        with self.genshin_client.pinned(session):
+            record_card = None
+            if hoyolab_uid := self.genshin_client.hoyolab_uid:
+                key = f"bot:genshin:record_card:{hoyolab_uid}"
+                record_card = await self._cache_get(key, RecordCard)
+            if record_card is None:
+                record_card = await self.genshin_client.get_record_card()
+                if hoyolab_uid:
+                    await self._cache_set(key, record_card, RECORD_CARD_TTL)
+            notes = await self.genshin_client.get_notes(record_card.uid)
+
+        return record_card, notes
+
     async def _draw_user_stats(
         self, uid: int, stats: PartialUserStats, file: BytesIO
     ) -> BytesIO:
-        await self._download_images()
-        loop = asyncio.get_event_loop()
-        executor = ThreadPoolExecutor()
-        images = await asyncio.gather(
-            loop.run_in_executor(executor, draw_user_base, uid, stats),
-            *[
-                loop.run_in_executor(executor, draw_user_characters, characters)
-                for characters in chunk_list(stats.characters)
-            ],
-            loop.run_in_executor(
-                executor,
-                lambda: Image.open("./static/genshin/card/card-new-bottom.png"),
-            ),
-        )
-
-        user_stats_image = await loop.run_in_executor(executor, concat_images, images)
-
-        user_stats_image.save(file, format="PNG")
+        encoded = await self.render.run(render_user_stats, uid, stats, *self.encoding)
+        self._log_encoding(f"Genshin[{uid}]", encoded)
+        file.write(encoded.data)
         file.seek(0)
-        user_stats_image.close()
-        for img in images:
-            img.close()
 
         return file
 
     async def _draw_character(
         self, uid: int, character: Character, file: BytesIO
     ) -> BytesIO:
-        await self._download_images()
-        loop = asyncio.get_event_loop()
-        img = await loop.run_in_executor(None, draw_character, uid, character)
-
-        img.save(file, format="PNG")
+        encoded = await self.render.run(
+            render_character, uid, character, *self.encoding
+        )
+        self._log_encoding(f"Genshin[{uid}] Character[{character.id}]", encoded)
+        file.write(encoded.data)
         file.seek(0)
-        img.close()
 
         return file
 
-    async def _download_images(self) -> None:
-        tasks = [
-            asyncio.create_task(self._fetch_worker()) for _ in range(self.q.qsize())
-        ]
-        await asyncio.gather(*tasks)
-        await self.q.join()
-        for t in tasks:
-            t.cancel()
-
-    async def _fetch_worker(self) -> None:
-        try:
-            data = await self.q.get()
-            await self._fetch(data)
-            self.q.task_done()
-        except asyncio.CancelledError:
-            pass
-
-    async def _fetch(self, data: Tuple[str, int, str], retry: int = 3) -> None:
-        image_type, id, url = data
-        tries = 0
-        while tries < retry:
-            try:
-                resp = await self.http_session.get(url)
-                resp.raise_for_status()
-                break
-            except Exception:
-                pass
+    async def _cache_get(
+        self, key: str, model: Type[Model], count: bool = True
+    ) -> Optional[Model]:
+        with stage("redis"):
+            data = await self.redis_bytes_session.get(key)
+        obj = serializer.loads(data) if data else None
+        if count:
+            CACHE_REQUESTS.inc(cache="genshin", result="miss" if obj is None else "hit")
+        return model(**obj) if obj is not None else None
+
+    async def _cache_get_many(
+        self, keys: List[str], model: Type[Model], count: bool = True
+    ) -> List[Optional[Model]]:
+        with stage("redis"):
+            values = await self.redis_bytes_session.mget(keys)
+        objs = [serializer.loads(data) if data else None for data in values]
+        if count:
+            hits = sum(obj is not None for obj in objs)
+            CACHE_REQUESTS.inc(hits, cache="genshin", result="hit")
+            CACHE_REQUESTS.inc(len(objs) - hits, cache="genshin", result="miss")
+        return [model(**obj) if obj is not None else None for obj in objs]
+
+    async def _cache_set(
+        self, key: str, model: pydantic.BaseModel, ex: int = 3600
+    ) -> None:
+        data = serializer.dumps(model.dict())
+        with stage("redis"):
+            await self.redis_bytes_session.set(key, data, ex=ex)
+
+    def _log_encoding(self, name: str, encoded: EncodedImage) -> None:
+        STAGE_SECONDS.observe(encoded.render_seconds, stage="render")
+        for profile, seconds, size in encoded.attempts:
+            STAGE_SECONDS.observe(seconds, stage="encode")
+            self.logger.info(
+                f"Encode {name} with [{profile}]: {size / 1024:.0f}KiB "
+                f"costed: {seconds:.3f}s"
+            )
 
-            tries += 1
-        else:
-            self.logger.warning(f"Failed to download {url}")
-            # await asyncio.sleep(1)
-            await self.q.put(data)
-            return
-
-        async with aiofiles.open(f"{self.image_dir}{image_type}/{id}.png", "wb") as f:
-            await f.write(await resp.read())
-        await resp.release()
-        self.static[image_type].append(id)
-        self.logger.debug(
-            f"Download [{self.image_dir}{image_type}/{id}.png] "
-            f"succeed: {data[0]}[{data[1]}]: {data[2]}."
-        )
+    def _on_asset_downloaded(self, kind: str, id: Any) -> None:
+        assets.invalidate(kind, id)
+        if kind == "avatars":
+            character_tiles.invalidate(lambda key: key[0] == id)
 
 
 def setup(bot):
@@ -1,77 +1,170 @@
 import asyncio
 import os
 import re
+import time
+from datetime import timedelta
 from io import BytesIO
-from typing import Any, Dict, Optional, Tuple, Union
+from typing import IO, Any, Dict, List, Optional, Tuple
 
 import disnake
-from disnake.ext import commands, tasks
+from disnake.ext import commands
 
 from bot.utils.base_cog import BaseCog
+from bot.utils.claims import Claims
+from bot.utils.encoding import shrink_to_fit
 from bot.utils.errors import SetuCogError
+from bot.utils.metrics import QUEUE_DEPTH, cache_ratio, stage
+from bot.utils.reply_ledger import ReplyLedger
+from bot.utils.scheduler import HeapScheduler, Job
+from bot.utils.setu_buffer import SetuBuffer, SetuItem
+from bot.utils.streaming import file_size, read_spooled
 
 SETU_API = "https://api.lolicon.app/setu/v2"
 TIME_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+# Larger downloads are dropped before reaching the memory or the disk.
+SETU_MAX_DOWNLOAD_BYTES = int(os.getenv("SETU_MAX_DOWNLOAD_BYTES", str(32 << 20)))
+# Upload limit of the guilds without boosts, and of the DMs.
+DEFAULT_FILESIZE_LIMIT = 8 << 20
+# Room left for the rest of the multipart request.
+UPLOAD_MARGIN = 16 << 10
+# Discord's limit of a bulk deletion.
+MAX_BULK_DELETE = 100
+PIXIV_HEADERS = {
+    "Referer": "https://www.pixiv.net/",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/89.0.4389.114 Safari/537.36 Edg/89.0.774.68",
+}
 
 
 class Setu(BaseCog):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._tasks = {}
+        self.buffer = SetuBuffer(self.fetch_setu_api, self.download_setu)
+        self.scheduler = HeapScheduler(self.run_setu_jobs)
+        self.replies = ReplyLedger(lambda: self.redis_session)
+        # Exactly one process runs the task of a guild, the one of its shard.
+        self.owners = Claims(lambda: self.redis_session, "bot:setu:owner:")
+        self.owners.on_acquired.append(
+            lambda guild_id: asyncio.create_task(self._load_task(guild_id))
+        )
+        self.owners.on_lost.append(self._task_lost)
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        await super().on_ready()
+        cache_ratio("setu", lambda: self.buffer.hits, lambda: self.buffer.misses)
+        QUEUE_DEPTH.set_function(
+            lambda: sum(self.buffer.stats()["pools"].values()), queue="setu_buffered"
+        )
+        QUEUE_DEPTH.set_function(lambda: len(self.scheduler.jobs), queue="setu_jobs")
+
+    async def cog_ready(self) -> None:
+        for r18 in (0, 2):
+            self.buffer.warm(r18)
+        await self.replies.load_channels()
 
         tasks = await self.redis_session.hgetall("bot:setu:tasks")
-        for guild_id, task in tasks.items():
-            channel_id, num = task.split(";")
-            self._setu_task(guild_id, True, int(channel_id), int(num))
+        next_runs = await self.redis_session.hgetall("bot:setu:next_run")
+        guild_ids = [id for id in tasks if self.bot.owns_guild(int(id))]
+        owned = guild_ids
+        if self.bot.shards_claimed:
+            owned = await self.owners.acquire(guild_ids)
+            self.owners.start()
+        for guild_id in owned:
+            self._schedule(guild_id, tasks[guild_id], next_runs.get(guild_id))
+        self.scheduler.start()
+        self.logger.info(
+            f"Setu tasks scheduled: {len(owned)}, "
+            f"{len(guild_ids) - len(owned)} still run by another process."
+        )
 
     def cog_unload(self):
-        for task in self._tasks.values():
-            task.cancel()
+        super().cog_unload()
+        self.scheduler.stop()
+        asyncio.create_task(self.owners.close())
+        asyncio.create_task(self.buffer.close())
+        asyncio.create_task(self.replies.close())
+
+    @commands.Cog.listener()
+    async def on_message(self, message: disnake.Message):
+        if message.author.id == self.bot.user.id:
+            self.replies.record(message.channel.id, message.id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: disnake.RawMessageDeleteEvent):
+        message = payload.cached_message
+        if message and message.author.id != self.bot.user.id:
+            return
+        self.replies.forget(payload.channel_id, [payload.message_id])
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(
+        self, payload: disnake.RawBulkMessageDeleteEvent
+    ):
+        others = {
+            message.id
+            for message in payload.cached_messages
+            if message.author.id != self.bot.user.id
+        }
+        if ids := payload.message_ids - others:
+            self.replies.forget(payload.channel_id, ids)
 
     @commands.command(name=".", help="来点涩图")
     async def setu(self, ctx: commands.Context, *, query: str = "") -> None:
         self.logger.info(f"setu for {ctx.author}")
         r18 = 2 if getattr(ctx.channel, "nsfw", 0) else 0
-        msg, filename, file = await self.get_setu_source(r18, query)
-        if not filename:
+        limit = ctx.guild.filesize_limit if ctx.guild else DEFAULT_FILESIZE_LIMIT
+        msg, filename, file = await self.get_setu_source(r18, query, limit)
+        if file is None:
             await ctx.send(msg)
         else:
-            await ctx.send(msg, file=disnake.File(BytesIO(file), filename))
+            with file, stage("discord_upload"):
+                await ctx.send(msg, file=disnake.File(file, filename))
+
+    @commands.command(name="d", help="删除bot上条回复，或者上 n 条。不喜欢的涩图？那就跳过吧")
+    async def delete_last_message(self, ctx: commands.Context, n: int = 1):
+        n = max(1, min(n, MAX_BULK_DELETE))
+        ids = await self.replies.last(ctx.channel.id, n)
+        if not ids:
+            # Nothing recorded here, e.g. sent before the ledger existed.
+            message = await ctx.channel.history(limit=20).get(author=self.bot.user)
+            if message:
+                await message.delete()
+            return
+
+        self.replies.forget(ctx.channel.id, ids)
+        # Bulk deletion needs `manage_messages`, and messages under 14 days old.
+        min_id = disnake.utils.time_snowflake(
+            disnake.utils.utcnow() - timedelta(days=14) + timedelta(minutes=1)
+        )
+        bulk = [id for id in ids if id > min_id]
+        can_bulk = ctx.guild and ctx.channel.permissions_for(ctx.me).manage_messages
+        if can_bulk and len(bulk) > 1:
+            await ctx.channel.delete_messages([disnake.Object(id) for id in bulk])
+            ids = [id for id in ids if id not in bulk]
 
-    @commands.command(name="d", help="删除bot上条回复。不喜欢的涩图？那就跳过吧")
-    async def delete_last_message(self, ctx: commands.Context):
-        message = await ctx.channel.history(limit=20).get(author=self.bot.user)
-        if message:
-            await message.delete()
+        await asyncio.gather(
+            *[self._delete_message(ctx.channel, id) for id in ids],
+            return_exceptions=True,
+        )
+
+    async def _delete_message(self, channel: disnake.abc.Messageable, id: int) -> None:
+        try:
+            await channel.get_partial_message(id).delete()
+        except disnake.NotFound:
+            pass
 
     async def get_setu_source(
-        self, r18: int = 2, query: str = ""
-    ) -> Tuple[str, str, bytes]:
-        """Fetch the image from Pixiv."""
+        self, r18: int = 2, query: str = "", max_bytes: int = DEFAULT_FILESIZE_LIMIT
+    ) -> Tuple[str, str, Optional[IO[bytes]]]:
+        """A setu from the buffer, or fetched from Pixiv if it's empty.
+
+        The file fits in `max_bytes`, the caller closes it.
+        """
         msg = ""
         filename = ""
-        file = b""
+        file = None
         try:
-            setu_data = await self.fetch_setu_api(r18, query)
-            msg = (
-                f">>> *Source:* <https://www.pixiv.net/artworks/{setu_data['pid']}>\n"
-                f"*Title:* {setu_data['title']}\n"
-                f"*Author:* {setu_data['author']}\n"
-                f"*Tags:* {'|'.join(setu_data['tags'])}"
-            )
-            url = setu_data["urls"]["regular"]
-            filename = url.split("/")[-1]
-            headers = {
-                "Referer": "https://www.pixiv.net/",
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/89.0.4389.114 Safari/537.36 Edg/89.0.774.68",
-            }
-            async with self.http_session.get(url, headers=headers) as resp:
-                file = await resp.read()
+            msg, filename, fetched, _ = await self.buffer.get(r18, query)
+            # Closed by `fit_upload_limit` when it fails, never returned then.
+            filename, file = await self.fit_upload_limit(filename, fetched, max_bytes)
         except SetuCogError as e:
             msg = str(e)
         except Exception as e:
@@ -80,20 +173,67 @@ class Setu(BaseCog):
 
         return msg, filename, file
 
-    async def fetch_setu_api(self, r18: int, query: str) -> Dict[str, Any]:
-        params = {"r18": r18, "size": ["original", "regular"], "proxy": ""}
+    async def download_setu(self, setu_data: Dict[str, Any]) -> SetuItem:
+        msg = (
+            f">>> *Source:* <https://www.pixiv.net/artworks/{setu_data['pid']}>\n"
+            f"*Title:* {setu_data['title']}\n"
+            f"*Author:* {setu_data['author']}\n"
+            f"*Tags:* {'|'.join(setu_data['tags'])}"
+        )
+        url = setu_data["urls"]["regular"]
+        filename = url.split("/")[-1]
+        with stage("pixiv"):
+            async with self.http_session.get(url, headers=PIXIV_HEADERS) as resp:
+                resp.raise_for_status()
+                file = await read_spooled(resp, SETU_MAX_DOWNLOAD_BYTES)
+
+        return SetuItem(msg, filename, file, time.monotonic())
+
+    async def fit_upload_limit(
+        self, filename: str, file: IO[bytes], max_bytes: int
+    ) -> Tuple[str, IO[bytes]]:
+        """Downscale the image in the executor if it's over the upload limit."""
+        max_bytes -= UPLOAD_MARGIN
+        size = file_size(file)
+        if size <= max_bytes:
+            return filename, file
+
+        loop = asyncio.get_running_loop()
+        try:
+            with stage("encode"):
+                data = await loop.run_in_executor(
+                    None, shrink_to_fit, file, size, max_bytes
+                )
+        finally:
+            file.close()
+        if data is None:
+            raise SetuCogError("这张涩图太大了，发不出来。。")
+
+        self.logger.info(f"Setu [{filename}] shrunk: {size} -> {len(data)} bytes")
+        return f"{filename.rsplit('.', 1)[0]}.jpg", BytesIO(data)
+
+    async def fetch_setu_api(
+        self, r18: int, query: str, num: int = 1
+    ) -> List[Dict[str, Any]]:
+        params = {
+            "r18": r18,
+            "num": num,
+            "size": ["original", "regular"],
+            "proxy": "",
+        }
         if query:
             params["tag"] = query.split(",")
         if os.getenv("DISCORD_PROXY"):
             params["proxy"] = "i.pixiv.cat"
 
-        async with self.http_session.post(SETU_API, json=params) as resp:
-            data = await resp.json()
-            self.logger.debug(data)
-            if not data["data"]:
-                raise SetuCogError("没有这种涩图。。||(つд⊂) 这未免也太变态了吧||")
+        with stage("lolicon"):
+            async with self.http_session.post(SETU_API, json=params) as resp:
+                data = await resp.json()
+        self.logger.debug(data)
+        if not data["data"]:
+            raise SetuCogError("没有这种涩图。。||(つд⊂) 这未免也太变态了吧||")
 
-        return data["data"][0]
+        return data["data"]
 
     @commands.check_any(
         commands.is_owner(), commands.has_guild_permissions(manage_guild=True)
@@ -114,52 +254,126 @@ class Setu(BaseCog):
 
         num, unit = r.groups()
         time = TIME_UNITS[unit.lower()] * int(num)
-        result = self._setu_task(str(ctx.guild.id), option, channel, time)
+        channel = channel or ctx.channel
+        # Threads and voice channels aren't resolved when the task runs.
+        if option and not isinstance(channel, disnake.TextChannel):
+            return await ctx.send("只能在文字频道色色哦。")
+        result = await self._setu_task(str(ctx.guild.id), option, channel, time)
 
         await ctx.send(result)
 
-    async def send_setu(self, channel: disnake.TextChannel) -> None:
-        r18 = 2 if getattr(channel, "nsfw", 0) else 0
-        _, filename, file = await self.get_setu_source(r18)
-        if filename:
-            await channel.send(file=disnake.File(BytesIO(file), filename))
+    async def run_setu_jobs(self, jobs: List[Job]) -> None:
+        """Send the due setu tasks, with one fetch for each r18 mode."""
+        tasks = await self.redis_session.hmget(
+            "bot:setu:tasks", [job.key for job in jobs]
+        )
+        for job, task in zip(list(jobs), tasks):
+            if task is None:
+                self.scheduler.remove(job.key)
+                await self._release_task(job.key)
+                jobs.remove(job)
+        if not jobs:
+            return
+
+        await self.redis_session.hset(
+            "bot:setu:next_run", mapping={job.key: job.next_run for job in jobs}
+        )
+
+        channels: Dict[int, List[disnake.TextChannel]] = {}
+        for job in jobs:
+            channel = self.bot.get_channel(job.payload)
+            if isinstance(channel, disnake.TextChannel):
+                channels.setdefault(2 if channel.nsfw else 0, []).append(channel)
+            else:
+                self.logger.warning(f"Setu task of [{job.key}]: channel not found.")
+
+        await asyncio.gather(
+            *[self.send_setu(r18, group) for r18, group in channels.items()]
+        )
+
+    async def send_setu(self, r18: int, channels: List[disnake.TextChannel]) -> None:
+        try:
+            items = await self.buffer.take(r18, len(channels))
+        except Exception as e:
+            self.logger.error(f"Fetching Setu error：{e}")
+            return
+        if len(items) < len(channels):
+            self.logger.warning(
+                f"Only {len(items)} setu for {len(channels)} channels, "
+                "the others skip this time."
+            )
+
+        results = await asyncio.gather(
+            *[self._send_item(c, item) for c, item in zip(channels, items)],
+            return_exceptions=True,
+        )
+        for channel, result in zip(channels, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"Sending setu to #{channel} failed: {result}")
 
-    def _setu_task(
+    async def _send_item(self, channel: disnake.TextChannel, item: SetuItem) -> None:
+        filename, file = await self.fit_upload_limit(
+            item.filename, item.file, channel.guild.filesize_limit
+        )
+        with file, stage("discord_upload"):
+            await channel.send(file=disnake.File(file, filename))
+
+    def _schedule(self, guild_id: str, task: str, next_run: Optional[str]) -> None:
+        channel_id, interval = task.split(";")
+        # The runs missed while offline are done right away, in one batch.
+        next_run_at = float(next_run) if next_run else time.time()
+        self.scheduler.add(Job(guild_id, int(interval), next_run_at, int(channel_id)))
+
+    async def _load_task(self, guild_id: str) -> None:
+        """Schedule a task whose owner was gone, from its state in Redis."""
+        task = await self.redis_session.hget("bot:setu:tasks", guild_id)
+        if task is None:
+            await self._release_task(guild_id)
+            return
+        next_run = await self.redis_session.hget("bot:setu:next_run", guild_id)
+        self._schedule(guild_id, task, next_run)
+        self.logger.info(f"Setu task of [{guild_id}] taken over.")
+
+    async def _release_task(self, guild_id: str) -> None:
+        # Claimed only when the shards are split between processes.
+        if self.bot.shards_claimed:
+            await self.owners.release([guild_id])
+
+    def _task_lost(self, guild_id: str) -> None:
+        self.scheduler.remove(guild_id)
+        self.logger.warning(f"Setu task of [{guild_id}] is run by another process.")
+
+    async def _setu_task(
         self,
         guild_id: str,
         option: bool,
-        channel: Optional[Union[disnake.TextChannel, int]],
+        channel: disnake.TextChannel,
         interval_time: int,
     ) -> str:
-        task = self._tasks.get(guild_id)
-
         if option:
-            if task is None:
-                task = tasks.loop(seconds=interval_time)(self.send_setu)
-            if isinstance(channel, int):
-                channel = self.bot.get_channel(channel)  # type: ignore
-
             self.logger.info(
                 f"Create a Setu task in #{channel.name}, runing per {interval_time}s"
             )
-            task.change_interval(seconds=interval_time)
-            if task.is_running():
-                task.restart(channel)
-            else:
-                task.start(channel)
-            self._tasks[guild_id] = task
+            now = time.time()
+            # Otherwise its owner is leaving, this process takes it over then.
+            if not self.bot.shards_claimed or await self.owners.acquire([guild_id]):
+                self.scheduler.add(Job(guild_id, interval_time, now, channel.id))
             asyncio.create_task(
                 self.redis_session.hset(
                     "bot:setu:tasks", guild_id, f"{channel.id};{interval_time}"
                 )
             )
+            asyncio.create_task(
+                self.redis_session.hset("bot:setu:next_run", guild_id, now)
+            )
             result = "现在开始色色 (＾o＾)ﾉ"
         else:
             self.logger.info(f"Setu task in [{guild_id}] canceled.")
-            if task is not None:
-                task.cancel()
-                del self._tasks[guild_id]
-                asyncio.create_task(self.redis_session.hdel("bot:setu:tasks", guild_id))
+            self.scheduler.remove(guild_id)
+            # Also when scheduled by another process, its next run drops it.
+            asyncio.create_task(self.redis_session.hdel("bot:setu:tasks", guild_id))
+            asyncio.create_task(self.redis_session.hdel("bot:setu:next_run", guild_id))
+            await self._release_task(guild_id)
             result = "( *・ω・)✄╰ひ╯ 不可以色色"
 
         return result
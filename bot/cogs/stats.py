@@ -0,0 +1,124 @@
+from typing import List
+
+from disnake.ext import commands
+
+from bot.utils.base_cog import BaseCog
+from bot.utils.cookie_pool import (
+    COOKIE_COOLDOWN_LEFT,
+    COOKIE_FAILURES,
+    COOKIE_QUARANTINED,
+    COOKIE_REQUESTS,
+    COOKIE_TOKENS,
+)
+from bot.utils.http import HTTP_CONNECTIONS, HTTP_CONNECTS, HTTP_POOL_WAIT
+from bot.utils.metrics import (
+    CACHE_REQUESTS,
+    COMMAND_ERRORS,
+    COMMAND_SECONDS,
+    QUEUE_DEPTH,
+    STAGE_SECONDS,
+    Histogram,
+)
+from bot.utils.singleflight import LOOKUPS
+
+
+def _ms(seconds) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def latency_table(histogram: Histogram, label: str) -> List[str]:
+    lines = [f"{label:<16}{'count':>7}{'p50ms':>8}{'p95ms':>8}{'avgms':>8}"]
+    for labels in sorted(histogram.labels(), key=lambda l: l[label]):
+        count = histogram.count(**labels)
+        lines.append(
+            f"{labels[label][:15]:<16}{count:>7}"
+            f"{_ms(histogram.quantile(0.5, **labels)):>8}"
+            f"{_ms(histogram.quantile(0.95, **labels)):>8}"
+            f"{_ms(histogram.sum(**labels) / count if count else None):>8}"
+        )
+    return lines
+
+
+def cookie_table() -> List[str]:
+    lines = [
+        f"{'cookie':<16}{'state':<14}{'tokens':>7}"
+        f"{'requests':>9}{'limited':>8}{'invalid':>8}"
+    ]
+    for labels in sorted(COOKIE_REQUESTS.labels(), key=lambda l: l["cookie"]):
+        cookie = labels["cookie"]
+        cooldown = COOKIE_COOLDOWN_LEFT.value(cookie=cookie)
+        if COOKIE_QUARANTINED.value(cookie=cookie):
+            state = "quarantined"
+        elif cooldown > 0:
+            state = f"cooling {cooldown:.0f}s"
+        else:
+            state = "ok"
+        lines.append(
+            f"{cookie[:15]:<16}{state:<14}{COOKIE_TOKENS.value(cookie=cookie):>7.1f}"
+            f"{COOKIE_REQUESTS.value(cookie=cookie):>9.0f}"
+            f"{COOKIE_FAILURES.value(cookie=cookie, reason='rate_limited'):>8.0f}"
+            f"{COOKIE_FAILURES.value(cookie=cookie, reason='invalid'):>8.0f}"
+        )
+    return lines
+
+
+class Stats(BaseCog):
+    @commands.is_owner()
+    @commands.command(
+        name="stats", help="查看各阶段耗时、缓存命中率、队列长度和 Cookie 池状态"
+    )
+    async def stats(self, ctx: commands.Context):
+        lines = latency_table(STAGE_SECONDS, "stage")
+        lines += [""] + latency_table(COMMAND_SECONDS, "command")
+        for labels in COMMAND_ERRORS.labels():
+            lines.append(
+                f"{labels['command']} errors: {COMMAND_ERRORS.value(**labels):.0f}"
+            )
+
+        lines += ["", f"{'cache':<16}{'hits':>7}{'misses':>8}{'ratio':>8}"]
+        caches = sorted({labels["cache"] for labels in CACHE_REQUESTS.labels()})
+        for cache in caches:
+            hits = CACHE_REQUESTS.value(cache=cache, result="hit")
+            misses = CACHE_REQUESTS.value(cache=cache, result="miss")
+            total = hits + misses
+            ratio = f"{hits / total:.0%}" if total else "-"
+            lines.append(f"{cache:<16}{hits:>7.0f}{misses:>8.0f}{ratio:>8}")
+
+        lines += ["", f"{'queue':<16}{'depth':>7}"]
+        for labels in sorted(QUEUE_DEPTH.labels(), key=lambda l: l["queue"]):
+            lines.append(f"{labels['queue']:<16}{QUEUE_DEPTH.value(**labels):>7.0f}")
+
+        in_use, idle, waiting, limit = (
+            HTTP_CONNECTIONS.value(state=state)
+            for state in ("in_use", "idle", "waiting", "limit")
+        )
+        reused = HTTP_CONNECTS.value(result="reused")
+        connects = reused + HTTP_CONNECTS.value(result="created")
+        lines += [
+            "",
+            f"http pool: {in_use:.0f}/{limit:.0f} in use, {idle:.0f} idle, "
+            f"{waiting:.0f} waiting, {reused / connects if connects else 0:.0%} reused, "
+            f"{HTTP_POOL_WAIT.count()} waits p95 {_ms(HTTP_POOL_WAIT.quantile(0.95))}ms",
+        ]
+
+        leaders, coalesced, remote_hits, remote_waits = (
+            LOOKUPS.value(result=result)
+            for result in ("leader", "coalesced", "remote_hit", "remote_wait")
+        )
+        lookups = leaders + coalesced
+        upstream = leaders - remote_hits
+        lines += [
+            "",
+            f"lookups: {upstream:.0f} upstream, {coalesced:.0f} coalesced, "
+            f"{remote_waits:.0f} waited on another process "
+            f"({remote_hits:.0f} served by it), "
+            f"{1 - upstream / lookups if lookups else 0:.0%} saved",
+            "",
+        ]
+        lines += cookie_table()
+
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+
+def setup(bot):
+    bot.add_cog(Stats(bot))
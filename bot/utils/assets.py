@@ -0,0 +1,198 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from PIL import Image
+
+from .bundle import AssetBundle
+
+IMAGE_DIR = "./static/genshin/"
+ASSET_CACHE_MB = int(os.getenv("GENSHIN_ASSET_CACHE_MB", "128"))
+# The downloaded kinds, a transparent placeholder is used while they're missing.
+PLACEHOLDER_KINDS = ("avatars", "characters", "weapons", "artifacts")
+
+Size = Optional[Tuple[int, int]]
+
+
+def image_nbytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+class ImageLRU:
+    """A thread-safe LRU of decoded images, bounded by their decoded size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items: "OrderedDict[Hashable, Image.Image]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable) -> Optional[Image.Image]:
+        """Return the cached image itself, callers must not modify it."""
+        with self._lock:
+            img = self._items.get(key)
+            if img is None:
+                self.misses += 1
+            else:
+                self._items.move_to_end(key)
+                self.hits += 1
+
+        return img
+
+    def put(self, key: Hashable, img: Image.Image) -> None:
+        nbytes = image_nbytes(img)
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if (old := self._items.pop(key, None)) is not None:
+                self.nbytes -= image_nbytes(old)
+            self._items[key] = img
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= image_nbytes(evicted)
+                self.evictions += 1
+
+    def invalidate(self, predicate: Callable[[Any], bool]) -> int:
+        with self._lock:
+            keys = [key for key in self._items if predicate(key)]
+            for key in keys:
+                self.nbytes -= image_nbytes(self._items.pop(key))
+
+        return len(keys)
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            if (img := self._items.pop(key, None)) is not None:
+                self.nbytes -= image_nbytes(img)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "items": len(self._items),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class AssetCache:
+    """Decoded, already resized RGBA static images keyed by (kind, id, size).
+
+    `get` always hands out a copy, so the result can be drawn on or pasted
+    from any render thread without touching the cached image. Entries are
+    tagged with the file's mtime, so a replaced file is decoded again even
+    in a render process which never saw it being replaced. The mtimes are
+    checked once per render job, see `refresh`.
+
+    Missing images of `PLACEHOLDER_KINDS` are replaced by a transparent
+    placeholder, which is never cached.
+
+    Images in the asset bundle are preferred to the loose files. The ones
+    stored decoded are copied straight out of the mapped bundle.
+    """
+
+    def __init__(
+        self,
+        image_dir: str = IMAGE_DIR,
+        max_bytes: int = ASSET_CACHE_MB << 20,
+        bundle: Optional[AssetBundle] = None,
+    ):
+        self.image_dir = image_dir
+        self.bundle = bundle
+        self.bundle_hits = 0
+        self._lru = ImageLRU(max_bytes)
+        # The mtimes seen since the last `refresh`, and the one cached per image.
+        self._versions: Dict[Tuple[str, Any], Optional[int]] = {}
+        self._cached: Dict[Tuple[str, Any, Size], Optional[int]] = {}
+
+    def path(self, kind: str, id: Any) -> str:
+        return f"{self.image_dir}{kind}/{id}.png"
+
+    def bundled(self, kind: str) -> Set[str]:
+        return self.bundle.ids(kind) if self.bundle is not None else set()
+
+    def refresh(self) -> None:
+        """Look for replaced files again, called as each render job starts."""
+        self._versions.clear()
+
+    def version(self, kind: str, id: Any) -> Optional[int]:
+        if self.bundle is not None and self.bundle.has(kind, id):
+            return self.bundle.version
+        if (kind, id) in self._versions:
+            return self._versions[kind, id]
+        try:
+            version: Optional[int] = os.stat(self.path(kind, id)).st_mtime_ns
+        except FileNotFoundError:
+            version = None
+        self._versions[kind, id] = version
+        return version
+
+    def get(
+        self, kind: str, id: Any, size: Size = None, resample: Optional[int] = None
+    ) -> Image.Image:
+        if self.bundle is not None:
+            if (img := self.bundle.raw(kind, id, size)) is not None:
+                self.bundle_hits += 1
+                return img.copy()
+
+        version = self.version(kind, id)
+        if version is None and kind in PLACEHOLDER_KINDS:
+            return Image.new("RGBA", size or (1, 1))
+
+        key = (kind, id, size, version)
+        img = self._lru.get(key)
+        if img is None:
+            # Only the image decoded from the replaced file is left to drop.
+            if (old := self._cached.get(key[:3])) not in (None, version):
+                self._lru.discard((kind, id, size, old))
+            img = self._load(kind, id, size, resample)
+            self._lru.put(key, img)
+            self._cached[key[:3]] = version
+
+        return img.copy()
+
+    def invalidate(self, kind: str, id: Any) -> int:
+        self._versions.pop((kind, id), None)
+        return self._lru.invalidate(lambda key: key[0] == kind and key[1] == id)
+
+    def clear(self) -> None:
+        self._versions.clear()
+        self._cached.clear()
+        self._lru.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._lru.stats(), "bundle_hits": self.bundle_hits}
+
+    def _load(
+        self, kind: str, id: Any, size: Size, resample: Optional[int]
+    ) -> Image.Image:
+        if self.bundle is not None and self.bundle.has(kind, id):
+            im = self.bundle.open_image(kind, id)
+        else:
+            im = Image.open(self.path(kind, id))
+        with im:
+            img = im.convert("RGBA")
+        if size and img.size != size:
+            img = img.resize(size) if resample is None else img.resize(size, resample)
+
+        return img
+
+
+assets = AssetCache(bundle=AssetBundle.open())
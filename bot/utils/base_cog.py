@@ -6,6 +6,8 @@ from ..bot import Bot
 class BaseCog(commands.Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
+        # Cogs are loaded before or after `on_ready`, see `defer_extensions`.
+        self._ready_task = bot.loop.create_task(self._wait_until_ready())
 
     @property
     def http_session(self):
@@ -15,10 +17,27 @@ class BaseCog(commands.Cog):
     def redis_session(self):
         return self.bot.redis_session
 
+    @property
+    def redis_bytes_session(self):
+        return self.bot.redis_bytes_session
+
     @property
     def logger(self):
         return self.bot.logger
 
-    @commands.Cog.listener()
-    async def on_ready(self):
+    def cog_unload(self) -> None:
+        self._ready_task.cancel()
+
+    async def cog_ready(self) -> None:
+        """Called once the bot is ready and the cog loaded, whichever is last."""
+
+    async def _wait_until_ready(self) -> None:
+        await self.bot.wait_until_ready()
+        # Its `setup` failed after `__init__`.
+        if self.bot.get_cog(self.qualified_name) is not self:
+            return
         self.logger.info(f"{self.__class__.__name__} cog is ready.")
+        try:
+            await self.cog_ready()
+        except Exception as e:
+            self.logger.exception(f"{self.__class__.__name__}.cog_ready failed: {e}")
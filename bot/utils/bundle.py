@@ -0,0 +1,212 @@
+"""Pack the static Genshin images into one memory-mapped bundle file.
+
+Build it with `python -m bot.utils.bundle`, the images downloaded after that
+stay in the loose directories and are merged on the next build.
+
+A running bot keeps the bundle it mapped at start. The images `--prune`
+removes are downloaded again by it, until it's restarted on the new bundle.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from PIL import Image
+
+ASSET_BUNDLE = os.getenv("GENSHIN_ASSET_BUNDLE", "./static/genshin.bundle")
+
+MAGIC = b"GSAB"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sBQ")  # magic, format version, index length
+
+BUNDLE_KINDS = ("avatars", "characters", "weapons", "artifacts", "elements", "card")
+# Small and drawn on, stored decoded. The others keep their PNG bytes.
+RAW_KINDS = ("elements", "card")
+# The sizes the card renderers ask for, stored decoded and already resized.
+BUNDLE_VARIANTS = {
+    "avatars": [((150, 150), Image.BILINEAR), ((180, 180), Image.BILINEAR)],
+    "weapons": [((100, 100), None)],
+    "artifacts": [((80, 80), None)],
+}
+
+Size = Optional[Tuple[int, int]]
+
+
+def entry_name(kind: str, id: Any, size: Size = None) -> str:
+    name = f"{kind}/{id}"
+    if size:
+        name += f"@{size[0]}x{size[1]}"
+    return name
+
+
+class AssetBundle:
+    """Read only view of a bundle, the raw images share the mapped memory."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, format_version, index_length = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a bundle of version {FORMAT_VERSION}.")
+
+        index = json.loads(self._mmap[HEADER.size : HEADER.size + index_length])
+        self.version: int = index["version"]
+        # name: [offset, length, "raw" | "png", width, height]
+        self.entries: Dict[str, List[Any]] = index["entries"]
+        self._data_offset = HEADER.size + index_length
+
+    @classmethod
+    def open(cls, path: str = ASSET_BUNDLE) -> Optional["AssetBundle"]:
+        return cls(path) if os.path.exists(path) else None
+
+    def has(self, kind: str, id: Any) -> bool:
+        return entry_name(kind, id) in self.entries
+
+    def ids(self, kind: str) -> Set[str]:
+        prefix = f"{kind}/"
+        return {
+            name[len(prefix) :]
+            for name in self.entries
+            if name.startswith(prefix) and "@" not in name
+        }
+
+    def raw(self, kind: str, id: Any, size: Size = None) -> Optional[Image.Image]:
+        """The decoded image of this exact size, if it was stored decoded."""
+        entry = self.entries.get(entry_name(kind, id, size))
+        if entry is None and size:
+            entry = self.entries.get(entry_name(kind, id))
+            if entry is not None and tuple(entry[3:5]) != size:
+                return None
+        if entry is None or entry[2] != "raw":
+            return None
+
+        return self._frombuffer(entry)
+
+    def open_image(self, kind: str, id: Any) -> Optional[Image.Image]:
+        entry = self.entries.get(entry_name(kind, id))
+        if entry is None:
+            return None
+        if entry[2] == "raw":
+            return self._frombuffer(entry)
+
+        return Image.open(BytesIO(self._slice(entry)))
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def _slice(self, entry: List[Any]) -> memoryview:
+        offset = self._data_offset + entry[0]
+        return memoryview(self._mmap)[offset : offset + entry[1]]
+
+    def _frombuffer(self, entry: List[Any]) -> Image.Image:
+        return Image.frombuffer(
+            "RGBA", (entry[3], entry[4]), self._slice(entry), "raw", "RGBA", 0, 1
+        )
+
+
+def _iter_images(image_dir: str, kinds: Iterable[str]):
+    for kind in kinds:
+        for path in sorted(Path(f"{image_dir}{kind}").glob("*.png")):
+            yield kind, path.stem, path
+
+
+def build_bundle(
+    image_dir: str, output: str, prune: bool = False
+) -> Dict[str, List[Any]]:
+    """Pack every image of `image_dir` into `output`, replacing it atomically."""
+    previous = AssetBundle.open(output)
+    entries: Dict[str, List[Any]] = {}
+    chunks: List[bytes] = []
+    offset = 0
+
+    def add(name: str, data: bytes, fmt: str, size: Tuple[int, int]) -> None:
+        nonlocal offset
+        entries[name] = [offset, len(data), fmt, size[0], size[1]]
+        chunks.append(data)
+        offset += len(data)
+
+    sources: Dict[Tuple[str, str], Any] = {}
+    if previous is not None:
+        for name in previous.entries:
+            if "@" not in name:
+                kind, id = name.split("/", 1)
+                sources[(kind, id)] = previous
+    merged = []
+    for kind, id, path in _iter_images(image_dir, BUNDLE_KINDS):
+        sources[(kind, id)] = path
+        merged.append(path)
+
+    for (kind, id), source in sorted(sources.items()):
+        if isinstance(source, AssetBundle):
+            # Copied out, the previous bundle is closed before being replaced.
+            entry = source.entries[entry_name(kind, id)]
+            data = bytes(source._slice(entry))
+            if entry[2] == "raw":
+                im, encoded = Image.frombytes("RGBA", tuple(entry[3:5]), data), None
+            else:
+                im, encoded = Image.open(BytesIO(data)), data
+        else:
+            im = Image.open(source)
+            encoded = source.read_bytes()
+
+        with im:
+            img = im.convert("RGBA")
+        if kind in RAW_KINDS or encoded is None:
+            add(entry_name(kind, id), img.tobytes(), "raw", img.size)
+        else:
+            add(entry_name(kind, id), encoded, "png", img.size)
+        for size, resample in BUNDLE_VARIANTS.get(kind, []):
+            resized = (
+                img.resize(size) if resample is None else img.resize(size, resample)
+            )
+            add(entry_name(kind, id, size), resized.tobytes(), "raw", size)
+
+    index = json.dumps({"version": time.time_ns(), "entries": entries}).encode()
+    tmp = f"{output}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(index)))
+        f.write(index)
+        for chunk in chunks:
+            f.write(chunk)
+    if previous is not None:
+        previous.close()
+    os.replace(tmp, output)
+
+    if prune:
+        for path in merged:
+            if path.parent.name not in RAW_KINDS:
+                path.unlink()
+
+    return entries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("image_dir", nargs="?", default="./static/genshin/")
+    parser.add_argument("output", nargs="?", default=ASSET_BUNDLE)
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="remove the downloaded images once they are in the bundle",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    entries = build_bundle(args.image_dir, args.output, args.prune)
+    print(
+        f"Packed {len(entries)} images into {args.output} "
+        f"({os.path.getsize(args.output) / 1024 / 1024:.1f}MiB) "
+        f"in {time.perf_counter() - start:.2f}s."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import bisect
+import re
+import unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple
+
+NGRAM = 2
+FUZZY_THRESHOLD = 0.34
+
+# Match tiers, higher is better.
+EXACT, PREFIX, SUBSTRING, FUZZY = 3, 2, 1, 0
+
+
+class CharacterEntry(NamedTuple):
+    id: int
+    name: str
+    alias_name: str
+
+    @property
+    def aliases(self) -> List[str]:
+        return [self.name, *self.alias_name.split("|")]
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return re.sub(r"[\s·・.\-_']+", "", text)
+
+
+def ngrams(text: str, n: int = NGRAM) -> Set[str]:
+    if len(text) <= n:
+        return {text}
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+class CharacterIndex:
+    """In-process character name resolution over `genshin_characters`.
+
+    Every `|` separated alias is normalized into an exact match map, a sorted
+    list for the prefix matches and an n-gram index for the fuzzy ones.
+    A rebuilt index replaces the old one in one assignment, so lookups
+    never see it half built.
+    """
+
+    def __init__(self, characters: Iterable = ()):
+        self._state = self._build(characters)
+
+    def __len__(self) -> int:
+        return len(self._state[0])
+
+    @property
+    def entries(self) -> List[CharacterEntry]:
+        return list(self._state[0].values())
+
+    def update(self, characters: Iterable) -> bool:
+        """Rebuild the index, return whether anything changed."""
+        state = self._build(characters)
+        if state[0] == self._state[0]:
+            return False
+        self._state = state
+        return True
+
+    def rank(self, name: str) -> List[Tuple[int, float, CharacterEntry]]:
+        """All the matches of `name` as (tier, score, entry), best first."""
+        entries, aliases, sorted_aliases, grams = self._state
+        query = normalize(name)
+        if not query:
+            return []
+
+        best: Dict[int, Tuple[int, float]] = {}
+
+        def match(ids: Iterable[int], tier: int, score: float) -> None:
+            for id in ids:
+                if best.get(id, (-1, 0.0)) < (tier, score):
+                    best[id] = (tier, score)
+
+        match(aliases.get(query, ()), EXACT, 1.0)
+        start = bisect.bisect_left(sorted_aliases, query)
+        for alias in sorted_aliases[start:]:
+            if not alias.startswith(query):
+                break
+            match(aliases[alias], PREFIX, len(query) / len(alias))
+
+        query_grams = ngrams(query)
+        candidates: Dict[str, int] = {}
+        if len(query) < NGRAM:
+            # Shorter than a gram, only the substring matches make sense.
+            candidates = {alias: 1 for alias in aliases if query in alias}
+        for gram in query_grams:
+            for alias in grams.get(gram, ()):
+                candidates[alias] = candidates.get(alias, 0) + 1
+        for alias, shared in candidates.items():
+            if query in alias:
+                match(aliases[alias], SUBSTRING, len(query) / len(alias))
+                continue
+            score = shared / len(query_grams | ngrams(alias))
+            if score >= FUZZY_THRESHOLD:
+                match(aliases[alias], FUZZY, score)
+
+        ranked = [(tier, score, entries[id]) for id, (tier, score) in best.items()]
+        ranked.sort(key=lambda m: (m[0], m[1], -m[2].id), reverse=True)
+        return ranked
+
+    def search(self, name: str) -> List[CharacterEntry]:
+        """The characters of the best match tier, more than one means ambiguous."""
+        entries, aliases, _, _ = self._state
+        if ids := aliases.get(normalize(name)):
+            return sorted((entries[id] for id in ids), key=lambda e: e.id)
+
+        ranked = self.rank(name)
+        if not ranked:
+            return []
+
+        tier, score, _ = ranked[0]
+        if tier == FUZZY:
+            return [entry for t, s, entry in ranked if (t, s) == (tier, score)]
+        return [entry for t, _, entry in ranked if t == tier]
+
+    def complete(self, text: str, limit: int = 25) -> List[str]:
+        if not normalize(text):
+            return sorted(entry.name for entry in self.entries)[:limit]
+        return [entry.name for _, _, entry in self.rank(text)[:limit]]
+
+    @staticmethod
+    def _build(characters: Iterable):
+        entries: Dict[int, CharacterEntry] = {}
+        aliases: Dict[str, Set[int]] = {}
+        grams: Dict[str, Set[str]] = {}
+        for character in characters:
+            entry = CharacterEntry(
+                character.id, character.name, character.alias_name or character.name
+            )
+            entries[entry.id] = entry
+            for alias in entry.aliases:
+                if alias := normalize(alias):
+                    aliases.setdefault(alias, set()).add(entry.id)
+
+        for alias in aliases:
+            for gram in ngrams(alias):
+                grams.setdefault(gram, set()).add(alias)
+
+        return entries, aliases, sorted(aliases), grams
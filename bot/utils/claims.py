@@ -0,0 +1,148 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import Callable, Iterable, List, Optional, Set
+
+import aioredis
+import loguru
+
+from .singleflight import RELEASE_SCRIPT
+
+logger = loguru.logger
+
+# Seconds a claim lasts without being renewed, the time a dead process holds it.
+CLAIM_TTL = float(os.getenv("CLAIM_TTL", "60"))
+# The process in the values of the claims, for the logs and `redis-cli`. Set
+# it to a name unique to each process which stays the same across restarts
+# (e.g. the dyno), so a restarted process takes back its claims right away.
+INSTANCE_ID = (
+    os.getenv("INSTANCE_ID")
+    or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+)
+
+# Take the claim if it's free, or extend it if it's already ours.
+ACQUIRE_SCRIPT = """
+local owner = redis.call("get", KEYS[1])
+if owner == false or owner == ARGV[1] then
+    redis.call("set", KEYS[1], ARGV[1], "PX", ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+class Claims:
+    """Named leases in Redis, each held by one process at a time.
+
+    `keep` renews the held claims every third of their TTL and retries the
+    wanted ones, so the claims of a dead process move to a live one within
+    a TTL. `on_lost` is called with a claim taken over by another process,
+    or not renewed in time, `on_acquired` with a wanted one `keep` got.
+    """
+
+    def __init__(
+        self,
+        redis: Callable[[], aioredis.Redis],
+        prefix: str,
+        ttl: float = CLAIM_TTL,
+        owner: str = INSTANCE_ID,
+    ):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+        self.owner = owner
+        self.held: Set[str] = set()
+        self.wanted: Set[str] = set()
+        self.on_lost: List[Callable[[str], None]] = []
+        self.on_acquired: List[Callable[[str], None]] = []
+        self._renewed = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+    async def acquire(self, names: Iterable[str], want: bool = True) -> Set[str]:
+        """Take the free `names`, return the ones held. The others are
+        retried by `keep` if they're `want`ed.
+        """
+        names = list(names)
+        if want:
+            self.wanted.update(names)
+        if not names:
+            return set()
+
+        results = await self._acquire(names)
+        acquired = {name for name, ok in zip(names, results) if ok}
+        self.held |= acquired
+        return acquired
+
+    async def release(self, names: Iterable[str]) -> None:
+        names = list(names)
+        self.wanted.difference_update(names)
+        self.held.difference_update(names)
+        if not names:
+            return
+        try:
+            pipe = self.redis().pipeline(transaction=False)
+            for name in names:
+                pipe.eval(RELEASE_SCRIPT, 1, self.prefix + name, self.owner)
+            await pipe.execute()
+        except aioredis.RedisError as e:
+            # They expire on their own.
+            logger.warning(f"Releasing the claims {names} failed: {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._renewed = time.monotonic()
+            self._task = asyncio.create_task(self._keep())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+        await self.release(self.held | self.wanted)
+
+    async def renew(self) -> None:
+        names = list(self.held | self.wanted)
+        results = await self._acquire(names) if names else []
+        self._renewed = time.monotonic()
+        current = self.held | self.wanted
+        released = []
+        for name, ok in zip(names, results):
+            if name not in current:
+                # Released during the round trip, and set again by it.
+                if ok:
+                    released.append(name)
+            elif ok and name not in self.held:
+                self.held.add(name)
+                self._notify(self.on_acquired, name)
+            elif not ok and name in self.held:
+                self.held.discard(name)
+                self._notify(self.on_lost, name)
+        if released:
+            await self.release(released)
+
+    async def _keep(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                await self.renew()
+            except aioredis.RedisError as e:
+                logger.warning(f"Renewing the claims {self.prefix}* failed: {e}")
+                # Expired in Redis by now, another process may have them.
+                if time.monotonic() - self._renewed > self.ttl:
+                    for name in list(self.held):
+                        self.held.discard(name)
+                        self._notify(self.on_lost, name)
+
+    async def _acquire(self, names: List[str]) -> List[bool]:
+        ttl = int(self.ttl * 1000)
+        pipe = self.redis().pipeline(transaction=False)
+        for name in names:
+            pipe.eval(ACQUIRE_SCRIPT, 1, self.prefix + name, self.owner, ttl)
+        return [bool(result) for result in await pipe.execute()]
+
+    def _notify(self, callbacks: List[Callable[[str], None]], name: str) -> None:
+        for callback in callbacks:
+            try:
+                callback(name)
+            except Exception as e:
+                logger.exception(f"Claim callback of {self.prefix}{name} failed: {e}")
@@ -0,0 +1,233 @@
+import asyncio
+import os
+import time
+from typing import Dict, Iterable, Optional
+
+import aiohttp
+import loguru
+
+from .metrics import metrics
+
+logger = loguru.logger
+
+# Requests per second and burst of each cookie.
+COOKIE_RATE = float(os.getenv("GENSHIN_COOKIE_RATE", "1"))
+COOKIE_BURST = float(os.getenv("GENSHIN_COOKIE_BURST", "5"))
+# Seconds a rate limited cookie rests, doubled on each consecutive limit.
+COOKIE_COOLDOWN = float(os.getenv("GENSHIN_COOKIE_COOLDOWN", "600"))
+COOKIE_MAX_COOLDOWN = float(os.getenv("GENSHIN_COOKIE_MAX_COOLDOWN", "21600"))
+# Seconds a request waits for a cookie before giving up.
+COOKIE_MAX_WAIT = float(os.getenv("GENSHIN_COOKIE_MAX_WAIT", "10"))
+
+COOKIE_REQUESTS = metrics.counter(
+    "bot_cookie_requests_total", "HoYoLAB requests sent with each cookie.", ("cookie",)
+)
+COOKIE_FAILURES = metrics.counter(
+    "bot_cookie_failures_total",
+    "Requests of each cookie which were rate limited, or refused as invalid.",
+    ("cookie", "reason"),
+)
+COOKIE_TOKENS = metrics.gauge(
+    "bot_cookie_tokens", "Requests each cookie may send right away.", ("cookie",)
+)
+COOKIE_COOLDOWN_LEFT = metrics.gauge(
+    "bot_cookie_cooldown_seconds",
+    "Seconds each rate limited cookie still rests.",
+    ("cookie",),
+)
+COOKIE_QUARANTINED = metrics.gauge(
+    "bot_cookie_quarantined",
+    "1 while a cookie is quarantined for invalid credentials.",
+    ("cookie",),
+)
+
+
+class Cookie:
+    """A cookie's session, with its token bucket and health."""
+
+    def __init__(self, session: aiohttp.ClientSession, name: str, burst: float):
+        self.session = session
+        self.name = name
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.cooldowns = 0
+        self.quarantined: Optional[str] = None
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+
+
+class NoCookieAvailable(Exception):
+    pass
+
+
+class CookieQuarantined(NoCookieAvailable):
+    """Every cookie left is disabled for invalid credentials, not rate limited."""
+
+
+class CookiePool:
+    """Schedule the requests over the cookies of a `MultiCookieClient`.
+
+    Every cookie has a token bucket, a request takes the least loaded cookie
+    with a token left, so the healthy cookies are used in parallel. A cookie
+    hitting the rate limit cools down, one with invalid credentials is
+    quarantined until the cookies are set again.
+    """
+
+    def __init__(
+        self,
+        sessions: Iterable[aiohttp.ClientSession] = (),
+        rate: float = COOKIE_RATE,
+        burst: float = COOKIE_BURST,
+        cooldown: float = COOKIE_COOLDOWN,
+        max_cooldown: float = COOKIE_MAX_COOLDOWN,
+        max_wait: float = COOKIE_MAX_WAIT,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_wait = max_wait
+        self.cookies: Dict[aiohttp.ClientSession, Cookie] = {}
+        self._changed = asyncio.Event()
+        self.reset(sessions)
+
+    def reset(self, sessions: Iterable[aiohttp.ClientSession]) -> None:
+        for cookie in self.cookies.values():
+            self._unexpose(cookie)
+        self.cookies = {}
+        for session in sessions:
+            self.get(session)
+
+    def get(self, session: aiohttp.ClientSession) -> Cookie:
+        if session not in self.cookies:
+            cookie = Cookie(session, self._name(len(self.cookies), session), self.burst)
+            self.cookies[session] = cookie
+            self._expose(cookie)
+        return self.cookies[session]
+
+    async def acquire(
+        self,
+        exclude: Iterable[Cookie] = (),
+        session: Optional[aiohttp.ClientSession] = None,
+    ) -> Cookie:
+        """Take a token of the least loaded usable cookie, waiting for one if needed.
+
+        With `session`, only its cookie is used, for the requests bound to
+        that account.
+        """
+        exclude = set(exclude)
+        cookies = [self.get(session)] if session else list(self.cookies.values())
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            now = time.monotonic()
+            candidates = [
+                cookie
+                for cookie in cookies
+                if cookie not in exclude and not cookie.quarantined
+            ]
+            if not candidates:
+                if cookies and all(cookie.quarantined for cookie in cookies):
+                    raise CookieQuarantined(
+                        ", ".join(
+                            f"Cookie[{cookie.name}] is quarantined: {cookie.quarantined}"
+                            for cookie in cookies
+                        )
+                    )
+                raise NoCookieAvailable("All cookies are rate limited or invalid.")
+
+            ready = []
+            wait = float("inf")
+            for cookie in candidates:
+                self._refill(cookie, now)
+                if cookie.cooldown_until > now:
+                    wait = min(wait, cookie.cooldown_until - now)
+                elif cookie.tokens < 1:
+                    wait = min(wait, (1 - cookie.tokens) / self.rate)
+                else:
+                    ready.append(cookie)
+
+            if ready:
+                cookie = min(ready, key=lambda c: (c.in_flight, -c.tokens, c.requests))
+                cookie.tokens -= 1
+                cookie.in_flight += 1
+                cookie.requests += 1
+                return cookie
+
+            if now + wait > deadline:
+                raise NoCookieAvailable(
+                    f"No cookie available in {self.max_wait:.0f}s, "
+                    f"the next one in {wait:.0f}s."
+                )
+            # Woken up early when a cookie is released or recovers.
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, cookie: Cookie) -> None:
+        cookie.in_flight -= 1
+        self._changed.set()
+
+    def succeeded(self, cookie: Cookie) -> None:
+        cookie.cooldowns = 0
+
+    def rate_limit(self, cookie: Cookie) -> None:
+        cookie.rate_limited += 1
+        seconds = min(self.cooldown * 2**cookie.cooldowns, self.max_cooldown)
+        cookie.cooldowns += 1
+        cookie.cooldown_until = time.monotonic() + seconds
+        logger.warning(f"Cookie[{cookie.name}] is rate limited, rest {seconds:.0f}s.")
+
+    def quarantine(self, cookie: Cookie, reason: str) -> None:
+        cookie.errors += 1
+        cookie.quarantined = reason
+        logger.error(f"Cookie[{cookie.name}] is quarantined: {reason}")
+
+    def _expose(self, cookie: Cookie) -> None:
+        name = cookie.name
+        COOKIE_REQUESTS.set_function(lambda: cookie.requests, cookie=name)
+        COOKIE_FAILURES.set_function(
+            lambda: cookie.rate_limited, cookie=name, reason="rate_limited"
+        )
+        COOKIE_FAILURES.set_function(
+            lambda: cookie.errors, cookie=name, reason="invalid"
+        )
+        COOKIE_TOKENS.set_function(lambda: self._tokens(cookie), cookie=name)
+        COOKIE_COOLDOWN_LEFT.set_function(
+            lambda: max(0.0, cookie.cooldown_until - time.monotonic()), cookie=name
+        )
+        COOKIE_QUARANTINED.set_function(
+            lambda: float(cookie.quarantined is not None), cookie=name
+        )
+
+    def _unexpose(self, cookie: Cookie) -> None:
+        for metric in (
+            COOKIE_REQUESTS,
+            COOKIE_TOKENS,
+            COOKIE_COOLDOWN_LEFT,
+            COOKIE_QUARANTINED,
+        ):
+            metric.remove(cookie=cookie.name)
+        for reason in ("rate_limited", "invalid"):
+            COOKIE_FAILURES.remove(cookie=cookie.name, reason=reason)
+
+    def _tokens(self, cookie: Cookie) -> float:
+        self._refill(cookie, time.monotonic())
+        return cookie.tokens
+
+    def _refill(self, cookie: Cookie, now: float) -> None:
+        cookie.tokens = min(
+            self.burst, cookie.tokens + (now - cookie.updated) * self.rate
+        )
+        cookie.updated = now
+
+    @staticmethod
+    def _name(index: int, session: aiohttp.ClientSession) -> str:
+        for cookie in session.cookie_jar:
+            if cookie.key in ("ltuid", "account_id"):
+                return cookie.value
+        return f"#{index}"
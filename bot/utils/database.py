@@ -1,12 +1,17 @@
+import asyncio
 import functools
 import os
-from contextlib import contextmanager
-from typing import List
+import re
+import sys
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Iterable, List, Mapping
 
 import loguru
 from sqlalchemy import Column, Integer, String, create_engine, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 logger = loguru.logger
 
@@ -14,13 +19,48 @@ DATABASE_URL = os.environ["DATABASE_URL"]
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "5"))
+# Prepared statements cached per connection by asyncpg.
+DATABASE_STATEMENT_CACHE_SIZE = int(os.getenv("DATABASE_STATEMENT_CACHE_SIZE", "100"))
+
+# Used in place of the sync drivers of these databases.
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
 engine = create_engine(DATABASE_URL)
+SessionLocal = sessionmaker(bind=engine)
+
+
+def create_async_database_engine(database_url: str) -> AsyncEngine:
+    url = make_url(database_url)
+    if not url.get_dialect().is_async:
+        if url.get_backend_name() not in ASYNC_DRIVERS:
+            raise ValueError(
+                f"DATABASE_URL: no async driver for {url.drivername}, "
+                "name one in the URL, e.g. mysql+aiomysql://..."
+            )
+        url = url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+    kwargs = {"pool_pre_ping": True}
+    if url.get_backend_name() != "sqlite":
+        kwargs.update(pool_size=DATABASE_POOL_SIZE, max_overflow=DATABASE_MAX_OVERFLOW)
+    if url.get_driver_name() == "asyncpg":
+        url = url.update_query_dict(
+            {"prepared_statement_cache_size": str(DATABASE_STATEMENT_CACHE_SIZE)}
+        )
+
+    return create_async_engine(url, **kwargs)
+
+
+async_engine = create_async_database_engine(DATABASE_URL)
+AsyncSessionLocal = sessionmaker(
+    async_engine, class_=AsyncSession, expire_on_commit=False
+)
 
 Base = declarative_base()
 
 
 def get_session():
-    return scoped_session(sessionmaker(bind=engine))()
+    return SessionLocal()
 
 
 @contextmanager
@@ -50,6 +90,30 @@ def func_session(commit: bool = False):
     return decorator
 
 
+@asynccontextmanager
+async def async_db_session(commit):
+    async with AsyncSessionLocal() as session:
+        try:
+            yield session
+            if commit:
+                await session.commit()
+        except Exception as e:
+            await session.rollback()
+            logger.exception(e)
+
+
+def async_func_session(commit: bool = False):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with async_db_session(commit) as session:
+                return await func(session, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
 def same_as(column_name):
     def default_function(context):
         return context.current_parameters.get(column_name)
@@ -70,7 +134,9 @@ class GenshinCharacter(Base):
         return f"GenshinCharacter(id={self.id}, name={self.name})"
 
 
-Base.metadata.create_all(engine)
+async def async_create_tables() -> None:
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
 
 
 @func_session()
@@ -86,9 +152,106 @@ def get_character_by_name(session: Session, name: str) -> List[GenshinCharacter]
     )
 
 
+@func_session()
+def get_characters(session: Session) -> List[GenshinCharacter]:
+    return session.execute(select(GenshinCharacter)).scalars().all()
+
+
 @func_session()
 def get_character_name_by_id(session: Session, id: int) -> GenshinCharacter:
     (name,) = session.execute(
         select(GenshinCharacter).where(GenshinCharacter.id == id)
     ).first()
     return name
+
+
+@async_func_session()
+async def async_get_character_by_name(
+    session: AsyncSession, name: str
+) -> List[GenshinCharacter]:
+    result = await session.execute(
+        select(GenshinCharacter).where(GenshinCharacter.alias_name.ilike(f"%{name}%"))
+    )
+    return result.scalars().all()
+
+
+@async_func_session()
+async def async_get_characters(session: AsyncSession) -> List[GenshinCharacter]:
+    result = await session.execute(select(GenshinCharacter))
+    return result.scalars().all()
+
+
+@async_func_session()
+async def async_get_character_name_by_id(
+    session: AsyncSession, id: int
+) -> GenshinCharacter:
+    result = await session.execute(
+        select(GenshinCharacter).where(GenshinCharacter.id == id)
+    )
+    (name,) = result.first()
+    return name
+
+
+def parse_seed_file(path: str) -> List[Dict[str, object]]:
+    """Read the `(id, 'name', 'alias_name')` rows of `sample_genshin_characters.sql`."""
+    with open(path, encoding="utf-8") as f:
+        sql = f.read()
+
+    return [
+        {
+            "id": int(id),
+            "name": name.replace("''", "'"),
+            "alias_name": alias_name.replace("''", "'"),
+        }
+        for id, name, alias_name in re.findall(
+            r"\(\s*(\d+)\s*,\s*'((?:[^']|'')*)'\s*,\s*'((?:[^']|'')*)'\s*\)", sql
+        )
+    ]
+
+
+async def upsert_characters(rows: Iterable[Mapping[str, object]]) -> int:
+    rows = list(rows)
+    if not rows:
+        return 0
+
+    dialect = async_engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        async with AsyncSessionLocal() as session:
+            for row in rows:
+                await session.merge(GenshinCharacter(**row))
+            await session.commit()
+        return len(rows)
+
+    async with async_engine.begin() as conn:
+        # Chunked, SQLite limits the bound parameters of a statement.
+        for i in range(0, len(rows), 200):
+            stmt = insert(GenshinCharacter).values(rows[i : i + 200])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[GenshinCharacter.id],
+                set_={
+                    "name": stmt.excluded.name,
+                    "alias_name": stmt.excluded.alias_name,
+                },
+            )
+            await conn.execute(stmt)
+
+    return len(rows)
+
+
+async def load_seed_file(path: str = "sample_genshin_characters.sql") -> int:
+    return await upsert_characters(parse_seed_file(path))
+
+
+if __name__ == "__main__":
+    # python -m bot.utils.database [sample_genshin_characters.sql]
+    async def main() -> None:
+        await async_create_tables()
+        count = await load_seed_file(*sys.argv[1:2])
+        await async_engine.dispose()
+        logger.info(f"Upserted {count} characters.")
+
+    asyncio.run(main())
@@ -0,0 +1,231 @@
+import asyncio
+import os
+import random
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import aiofiles
+import aiohttp
+import aioredis
+import loguru
+
+from .claims import Claims
+from .metrics import stage
+
+logger = loguru.logger
+
+DOWNLOAD_CONCURRENCY = int(os.getenv("GENSHIN_DOWNLOAD_CONCURRENCY", "8"))
+DOWNLOAD_RETRIES = int(os.getenv("GENSHIN_DOWNLOAD_RETRIES", "4"))
+# Seconds before an asset which failed every retry is tried again.
+DOWNLOAD_COOLDOWN = int(os.getenv("GENSHIN_DOWNLOAD_COOLDOWN", "600"))
+
+# (kind, id, url)
+AssetRequest = Tuple[str, Any, str]
+
+
+class AssetDownloader:
+    """Download the missing static images, once.
+
+    Concurrent requests for the same asset share one download, failed ones
+    are retried with an exponential backoff and then left alone for a while,
+    the renders use a placeholder meanwhile. With `claims`, the processes
+    sharing the directory download each asset once between them.
+    """
+
+    def __init__(
+        self,
+        http_session: aiohttp.ClientSession,
+        image_dir: str,
+        kinds: Iterable[str],
+        known: Callable[[str], Iterable[Any]] = lambda kind: (),
+        concurrency: int = DOWNLOAD_CONCURRENCY,
+        retries: int = DOWNLOAD_RETRIES,
+        cooldown: int = DOWNLOAD_COOLDOWN,
+        backoff: float = 0.5,
+        claims: Optional[Claims] = None,
+        claim_poll: float = 0.5,
+        claim_wait: float = 60,
+    ):
+        self.http_session = http_session
+        self.image_dir = image_dir
+        self.retries = retries
+        self.cooldown = cooldown
+        self.backoff = backoff
+        self.claims = claims
+        self.claim_poll = claim_poll
+        self.claim_wait = claim_wait
+        self.known = known
+        # Filled by `scan_all`, off the startup path.
+        self.index: Dict[str, Set[Any]] = {kind: set() for kind in kinds}
+        self._known: Dict[str, Set[Any]] = {kind: set() for kind in kinds}
+        self._scanned: Optional[asyncio.Task] = None
+        self.on_downloaded: List[Callable[[str, Any], None]] = []
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._in_flight: Dict[Tuple[str, Any], asyncio.Task] = {}
+        self._given_up: Dict[Tuple[str, Any], float] = {}
+
+    def scan(self, kind: str) -> Set[Any]:
+        with os.scandir(f"{self.image_dir}{kind}") as entries:
+            return {
+                int(entry.name[:-4])
+                for entry in entries
+                if entry.name.endswith(".png") and entry.name[:-4].isdigit()
+            }
+
+    async def scan_all(self) -> None:
+        """Index the images on the disk, and the `known` ones, once."""
+        if self._scanned is None:
+            self._scanned = asyncio.create_task(self._scan_all())
+        await asyncio.shield(self._scanned)
+
+    async def _scan_all(self) -> None:
+        loop = asyncio.get_running_loop()
+        for kind, ids in self.index.items():
+            try:
+                ids.update(await loop.run_in_executor(None, self.scan, kind))
+            except OSError as e:
+                logger.warning(f"Can't scan the {kind} images: {e}")
+            self._known[kind] = {int(id) for id in self.known(kind) if id.isdigit()}
+            ids.update(self._known[kind])
+
+    def path(self, kind: str, id: Any) -> str:
+        return f"{self.image_dir}{kind}/{id}.png"
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def request(self, kind: str, id: Any, url: str) -> Optional[asyncio.Task]:
+        """Start downloading the asset if it's missing, without waiting for it."""
+        if id in self.index[kind]:
+            return None
+
+        key = (kind, id)
+        if task := self._in_flight.get(key):
+            return task
+        if self._given_up.get(key, 0) > time.monotonic():
+            return None
+
+        task = asyncio.create_task(self._download(kind, id, url))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return task
+
+    async def ensure(self, requests: Iterable[AssetRequest]) -> bool:
+        """Wait for the given assets, return whether all of them are available."""
+        requests = list(requests)
+        await self.scan_all()
+        await self._forget_removed(requests)
+        tasks = {task for request in requests if (task := self.request(*request))}
+        # Shielded, the download is shared with the other requests.
+        results = await asyncio.gather(*[asyncio.shield(t) for t in tasks])
+
+        return all(results) and all(id in self.index[kind] for kind, id, _ in requests)
+
+    async def close(self) -> None:
+        for task in list(self._in_flight.values()):
+            task.cancel()
+        if self.claims:
+            await self.claims.close()
+
+    async def _forget_removed(self, requests: List[AssetRequest]) -> None:
+        """Drop the indexed files removed since, to download them again."""
+        loose = [
+            (kind, id)
+            for kind, id, _ in requests
+            if id in self.index[kind] and id not in self._known[kind]
+        ]
+        if not loose:
+            return
+
+        loop = asyncio.get_running_loop()
+        exists = await loop.run_in_executor(
+            None, lambda: [os.path.exists(self.path(*asset)) for asset in loose]
+        )
+        for (kind, id), found in zip(loose, exists):
+            if not found:
+                # E.g. pruned into a bundle built after this one was mapped.
+                logger.warning(f"{self.path(kind, id)} was removed, download again.")
+                self.index[kind].discard(id)
+
+    async def _download(self, kind: str, id: Any, url: str) -> bool:
+        if self.claims is None:
+            return await self._fetch(kind, id, url)
+
+        name = f"{kind}:{id}"
+        deadline = time.monotonic() + self.claim_wait
+        while not await self._claim(name):
+            # Downloaded by another process into the same directory.
+            await asyncio.sleep(self.claim_poll)
+            if os.path.exists(self.path(kind, id)):
+                self._downloaded(kind, id)
+                return True
+            if time.monotonic() > deadline:
+                # Still downloading, or failing, a placeholder meanwhile.
+                logger.warning(f"Waited {self.claim_wait:.0f}s for {name}, skip it.")
+                return False
+        try:
+            return await self._fetch(kind, id, url)
+        finally:
+            await self.claims.release([name])
+
+    async def _claim(self, name: str) -> bool:
+        # Renews the claims of the long downloads.
+        self.claims.start()
+        try:
+            return bool(await self.claims.acquire([name], want=False))
+        except aioredis.RedisError as e:
+            # Downloading it twice is better than not at all.
+            logger.warning(f"Claiming the download of {name} failed: {e}")
+            return True
+
+    async def _fetch(self, kind: str, id: Any, url: str) -> bool:
+        delay = self.backoff
+        for tries in range(1, self.retries + 1):
+            try:
+                async with self._semaphore:
+                    with stage("asset_download"):
+                        async with self.http_session.get(url) as resp:
+                            resp.raise_for_status()
+                            data = await resp.read()
+                await self._write(self.path(kind, id), data)
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Download {url} failed ({tries}/{self.retries}): {e}")
+
+            if tries < self.retries:
+                await asyncio.sleep(delay + random.uniform(0, delay))
+                delay *= 2
+        else:
+            logger.warning(
+                f"Failed to download {url}, "
+                f"try again after {self.cooldown}s. Use a placeholder meanwhile."
+            )
+            self._given_up[(kind, id)] = time.monotonic() + self.cooldown
+            return False
+
+        self._downloaded(kind, id)
+        logger.debug(f"Download [{self.path(kind, id)}] succeed: {url}.")
+
+        return True
+
+    def _downloaded(self, kind: str, id: Any) -> None:
+        self._given_up.pop((kind, id), None)
+        self.index[kind].add(id)
+        for callback in self.on_downloaded:
+            callback(kind, id)
+
+    async def _write(self, path: str, data: bytes) -> None:
+        """Write to a temporary file first, a render never sees half of the image."""
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            async with aiofiles.open(tmp, "wb") as f:
+                await f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
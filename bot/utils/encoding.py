@@ -0,0 +1,127 @@
+import math
+import os
+import time
+from io import BytesIO
+from typing import IO, Any, Dict, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+ENCODING_PROFILE = os.getenv("GENSHIN_CARD_PROFILE", "png")
+# Discord's upload limit of the guilds without boosts.
+ENCODING_MAX_BYTES = int(os.getenv("GENSHIN_CARD_MAX_BYTES", str(8 << 20)))
+
+
+class EncodingProfile(NamedTuple):
+    format: str
+    extension: str
+    options: Dict[str, Any]
+    # Used when the output is larger than the byte budget.
+    fallback: Optional[str] = None
+    # Reduce to a 256 colors palette before saving.
+    palette: bool = False
+
+
+PROFILES = {
+    "png": EncodingProfile("PNG", "png", {"compress_level": 6}, "png-palette"),
+    "png-fast": EncodingProfile("PNG", "png", {"compress_level": 1}, "png-palette"),
+    "png-small": EncodingProfile(
+        "PNG", "png", {"compress_level": 9, "optimize": True}, "png-palette"
+    ),
+    "png-palette": EncodingProfile(
+        "PNG", "png", {"optimize": True}, "webp", palette=True
+    ),
+    "webp-lossless": EncodingProfile(
+        "WEBP", "webp", {"lossless": True, "quality": 80, "method": 4}, "webp"
+    ),
+    "webp": EncodingProfile("WEBP", "webp", {"quality": 90, "method": 4}, "jpeg"),
+    "jpeg": EncodingProfile(
+        "JPEG", "jpg", {"quality": 90, "optimize": True}, "jpeg-low"
+    ),
+    "jpeg-low": EncodingProfile("JPEG", "jpg", {"quality": 70, "optimize": True}),
+}
+
+# (profile, seconds, bytes)
+Attempt = Tuple[str, float, int]
+
+
+class EncodedImage(NamedTuple):
+    data: bytes
+    extension: str
+    attempts: List[Attempt]
+    # Seconds spent drawing the image, set by the render jobs.
+    render_seconds: float = 0.0
+
+
+def encode_with_profile(img: Image.Image, profile: EncodingProfile) -> bytes:
+    if profile.palette:
+        img = img.quantize(256, method=Image.FASTOCTREE)
+    elif profile.format == "JPEG" and img.mode != "RGB":
+        background = Image.new("RGB", img.size, "#FFFFFF")
+        background.paste(img, mask=img.getchannel("A") if "A" in img.mode else None)
+        img = background
+
+    with BytesIO() as file:
+        img.save(file, format=profile.format, **profile.options)
+        return file.getvalue()
+
+
+def encode_image(
+    img: Image.Image,
+    profile: str = ENCODING_PROFILE,
+    max_bytes: int = ENCODING_MAX_BYTES,
+) -> EncodedImage:
+    """Encode with `profile`, following its fallbacks until the output fits `max_bytes`.
+
+    The last attempt is returned even if it is still too large.
+    """
+    attempts: List[Attempt] = []
+    name: Optional[str] = profile
+    while name:
+        encoding_profile = PROFILES[name]
+        start = time.perf_counter()
+        data = encode_with_profile(img, encoding_profile)
+        attempts.append((name, time.perf_counter() - start, len(data)))
+        if len(data) <= max_bytes:
+            break
+        name = encoding_profile.fallback
+
+    return EncodedImage(data, encoding_profile.extension, attempts)
+
+
+def shrink_to_fit(
+    file: IO[bytes], size: int, max_bytes: int, profile: str = "jpeg", tries: int = 5
+) -> Optional[bytes]:
+    """Downscale the image of `file` until it's encoded in `max_bytes`.
+
+    Meant for an executor, JPEGs are decoded already reduced, so the memory
+    follows the output size rather than the original one.
+    """
+    encoding_profile = PROFILES[profile]
+    file.seek(0)
+    with Image.open(file) as im:
+        # The area, and roughly the bytes, scale with its square.
+        scale = min(1.0, math.sqrt(max_bytes / size))
+        width, height = im.size
+        im.draft("RGB", (int(width * scale), int(height * scale)))
+        img = im.convert("RGBA" if "A" in im.mode else "RGB")
+
+    for _ in range(tries):
+        target = (max(1, int(width * scale)), max(1, int(height * scale)))
+        resized = img if target == img.size else img.resize(target, Image.LANCZOS)
+        data = encode_with_profile(resized, encoding_profile)
+        if len(data) <= max_bytes:
+            return data
+        scale *= math.sqrt(max_bytes / len(data)) * 0.9
+
+    return None
+
+
+def guess_extension(data: bytes) -> str:
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+
+    return "png"
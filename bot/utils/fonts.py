@@ -0,0 +1,56 @@
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+
+from PIL import ImageFont
+
+FONT_PATH = os.getenv("GENSHIN_FONT_PATH", "./static/fonts/font.ttf")
+
+
+class FontRegistry:
+    """Load every (font file, size) pair once and share it between render threads.
+
+    `FreeTypeFont` objects are read-only once created, so a single instance can be
+    used by all the executor threads. Text measurements are memoized as well,
+    since most measured strings (names, stars, `Lv.` labels) repeat a lot.
+    """
+
+    def __init__(self, path: str = FONT_PATH, measure_cache_size: int = 4096):
+        self.path = path
+        self._fonts: Dict[Tuple[str, int], ImageFont.FreeTypeFont] = {}
+        self._lock = threading.Lock()
+        self._textsize = lru_cache(maxsize=measure_cache_size)(self._measure)
+
+    def preload(self, sizes: Iterable[int], path: Optional[str] = None) -> None:
+        for size in sizes:
+            self.get(size, path)
+
+    def get(self, size: int = 20, path: Optional[str] = None) -> ImageFont.FreeTypeFont:
+        key = (path or self.path, size)
+        font = self._fonts.get(key)
+        if font is None:
+            with self._lock:
+                font = self._fonts.get(key)
+                if font is None:
+                    font = ImageFont.truetype(key[0], size=size)
+                    self._fonts[key] = font
+
+        return font
+
+    def textsize(
+        self, text: str, size: int = 20, path: Optional[str] = None
+    ) -> Tuple[int, int]:
+        """Same as `ImageDraw.textsize` for single line text, but cached."""
+        return self._textsize(text, size, path or self.path)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._fonts.clear()
+        self._textsize.cache_clear()
+
+    def _measure(self, text: str, size: int, path: str) -> Tuple[int, int]:
+        return self.get(size, path).getsize(text)
+
+
+fonts = FontRegistry()
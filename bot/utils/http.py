@@ -0,0 +1,113 @@
+import os
+import time
+from types import SimpleNamespace
+from typing import Any
+
+import aiohttp
+
+from .metrics import metrics
+
+# Connections of the whole process, and to each host.
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", "100"))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", "20"))
+# Seconds an idle connection is kept for the next request.
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "30"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+# Seconds of a whole request, of the connection, and between two reads of the body.
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+
+HTTP_CONNECTIONS = metrics.gauge(
+    "bot_http_connections",
+    "Connections of the shared HTTP pool: in use, idle, waited for, and the limit.",
+    ("state",),
+)
+HTTP_CONNECTS = metrics.counter(
+    "bot_http_connects_total",
+    "Connections taken from the HTTP pool, reused or created.",
+    ("result",),
+)
+HTTP_POOL_WAIT = metrics.histogram(
+    "bot_http_pool_wait_seconds", "Seconds a request waited for a free connection."
+)
+
+
+class HttpPool:
+    """One connector for the whole process, shared by every `ClientSession`.
+
+    The sessions only keep their own cookies, the connections, the DNS cache
+    and the limits are the pool's. Every request has the default timeouts,
+    a stalled body fails after `HTTP_READ_TIMEOUT` instead of hanging.
+    """
+
+    def __init__(
+        self,
+        limit: int = HTTP_LIMIT,
+        limit_per_host: int = HTTP_LIMIT_PER_HOST,
+        keepalive: float = HTTP_KEEPALIVE,
+        dns_cache_ttl: int = HTTP_DNS_CACHE_TTL,
+    ):
+        self.connector = aiohttp.TCPConnector(
+            limit=limit,
+            limit_per_host=limit_per_host,
+            keepalive_timeout=keepalive,
+            use_dns_cache=True,
+            ttl_dns_cache=dns_cache_ttl,
+            enable_cleanup_closed=True,
+        )
+        self.timeout = aiohttp.ClientTimeout(
+            total=HTTP_TIMEOUT,
+            connect=HTTP_CONNECT_TIMEOUT,
+            sock_read=HTTP_READ_TIMEOUT,
+        )
+        self.trace = aiohttp.TraceConfig()
+        self.trace.on_connection_queued_start.append(self._queued_start)
+        self.trace.on_connection_queued_end.append(self._queued_end)
+        self.trace.on_connection_create_end.append(self._created)
+        self.trace.on_connection_reuseconn.append(self._reused)
+
+        HTTP_CONNECTIONS.set_function(lambda: self.in_use, state="in_use")
+        HTTP_CONNECTIONS.set_function(lambda: self.idle, state="idle")
+        HTTP_CONNECTIONS.set_function(lambda: self.waiting, state="waiting")
+        HTTP_CONNECTIONS.set_function(lambda: limit, state="limit")
+
+    @property
+    def in_use(self) -> int:
+        # Not public in aiohttp, the sets behind `limit` and the keep-alive.
+        return len(self.connector._acquired)
+
+    @property
+    def idle(self) -> int:
+        return sum(len(conns) for conns in self.connector._conns.values())
+
+    @property
+    def waiting(self) -> int:
+        # Counted off the queues, a timed out wait never ends its trace.
+        return sum(len(waiters) for waiters in self.connector._waiters.values())
+
+    def session(self, **kwargs: Any) -> aiohttp.ClientSession:
+        """A session of the pool, with a cookie jar of its own."""
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs.setdefault("trust_env", True)
+        return aiohttp.ClientSession(
+            connector=self.connector,
+            connector_owner=False,
+            trace_configs=[self.trace],
+            **kwargs,
+        )
+
+    async def close(self) -> None:
+        await self.connector.close()
+
+    async def _queued_start(self, session, ctx: SimpleNamespace, params) -> None:
+        ctx.queued = time.perf_counter()
+
+    async def _queued_end(self, session, ctx: SimpleNamespace, params) -> None:
+        HTTP_POOL_WAIT.observe(time.perf_counter() - ctx.queued)
+
+    async def _created(self, session, ctx: SimpleNamespace, params) -> None:
+        HTTP_CONNECTS.inc(result="created")
+
+    async def _reused(self, session, ctx: SimpleNamespace, params) -> None:
+        HTTP_CONNECTS.inc(result="reused")
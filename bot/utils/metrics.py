@@ -0,0 +1,279 @@
+import bisect
+import contextlib
+import os
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import loguru
+from aiohttp import web
+
+logger = loguru.logger
+
+# The Prometheus endpoint, 0 disables it.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Seconds, from a Redis hit to a slow upload.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value != value:
+        return "NaN"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, Any] = {}
+        # Read when collected, for the values already counted somewhere else.
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set_function(self, function: Callable[[], float], **labels: Any) -> None:
+        self._functions[self._key(labels)] = function
+
+    def remove(self, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values.pop(key, None)
+        self._functions.pop(key, None)
+
+    def value(self, **labels: Any) -> float:
+        key = self._key(labels)
+        if function := self._functions.get(key):
+            return self._call(key, function)
+        return self._values.get(key, 0)
+
+    def labels(self) -> List[Dict[str, str]]:
+        return [
+            dict(zip(self.labelnames, key))
+            for key in {**self._values, **self._functions}
+        ]
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        for key, value in list(self._values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+        for key, function in list(self._functions.items()):
+            yield self.name, dict(zip(self.labelnames, key)), self._call(key, function)
+
+    def _call(self, key: LabelValues, function: Callable[[], float]) -> float:
+        try:
+            return function()
+        except Exception as e:
+            logger.debug(f"Collecting {self.name}{key} failed: {e}")
+            return float("nan")
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} takes the labels {self.labelnames}, not {tuple(labels)}."
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        if key not in self._values:
+            # [count per bucket, sum, count]
+            self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts, _, _ = state = self._values[key]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: Any) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def sum(self, **labels: Any) -> float:
+        state = self._values.get(self._key(labels))
+        return state[1] if state else 0.0
+
+    def quantile(self, q: float, **labels: Any) -> Optional[float]:
+        """Estimated from the buckets, like `histogram_quantile` of Prometheus."""
+        state = self._values.get(self._key(labels))
+        if not state or not state[2]:
+            return None
+
+        counts, _, total = state
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i]
+                if upper == float("inf"):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-2]
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        for key, (counts, total, count) in list(self._values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = {**labels, "le": _format_value(bucket)}
+                yield f"{self.name}_bucket", le, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class Registry:
+    """The metrics of the process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = BUCKETS,
+    ) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _get(
+        self, cls: type, name: str, help: str, labelnames: Sequence[str], **kwargs
+    ) -> Any:
+        # Registered again when a cog is reloaded, the values are kept.
+        if metric := self.metrics.get(name):
+            if type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"{name} is already registered differently.")
+            return metric
+        self.metrics[name] = metric = cls(name, help, labelnames, **kwargs)
+        return metric
+
+
+async def serve(registry: "Registry", host: str, port: int) -> web.AppRunner:
+    """Serve `GET /metrics` for Prometheus."""
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(
+            text=registry.render(), content_type="text/plain", charset="utf-8"
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+metrics = Registry()
+
+STAGE_SECONDS = metrics.histogram(
+    "bot_stage_seconds", "Seconds spent in each stage of a request.", ("stage",)
+)
+COMMAND_SECONDS = metrics.histogram(
+    "bot_command_seconds", "Seconds to answer each command.", ("command",)
+)
+COMMAND_ERRORS = metrics.counter(
+    "bot_command_errors_total", "Commands which failed.", ("command",)
+)
+CACHE_REQUESTS = metrics.counter(
+    "bot_cache_requests_total", "Cache lookups by result.", ("cache", "result")
+)
+QUEUE_DEPTH = metrics.gauge(
+    "bot_queue_depth", "Jobs waiting or running in each queue.", ("queue",)
+)
+
+
+def stage(name: str) -> "contextlib.AbstractContextManager[None]":
+    return STAGE_SECONDS.time(stage=name)
+
+
+def cache_ratio(
+    cache: str, hits: Callable[[], float], misses: Callable[[], float]
+) -> None:
+    """Expose the hit and miss counters of a cache which counts them itself."""
+    CACHE_REQUESTS.set_function(hits, cache=cache, result="hit")
+    CACHE_REQUESTS.set_function(misses, cache=cache, result="miss")
@@ -0,0 +1,112 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, TypeVar
+
+import loguru
+
+from .metrics import stage
+
+logger = loguru.logger
+
+RENDER_MODE = os.getenv("GENSHIN_RENDER_MODE", "process")
+# How the render processes are started, `forkserver` or `spawn`. Never forked
+# from the bot itself, whose threads and sockets would be copied half-way.
+RENDER_START_METHOD = os.getenv("GENSHIN_RENDER_START_METHOD", "forkserver")
+RENDER_WORKERS = int(os.getenv("GENSHIN_RENDER_WORKERS", "0"))
+RENDER_MAX_IN_FLIGHT = int(os.getenv("GENSHIN_RENDER_MAX_IN_FLIGHT", "8"))
+
+T = TypeVar("T")
+
+
+def _init_worker(warm: Optional[Callable[[], None]]) -> None:
+    # Ctrl+C reaches the whole process group, leave it to the bot.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if warm is not None:
+        warm()
+
+
+def _noop() -> None:
+    pass
+
+
+class RenderEngine:
+    """A long-lived executor for the CPU-bound image work.
+
+    Render jobs run in a process pool so they don't hold the GIL of the event
+    loop, falling back to a thread pool where processes can't be started.
+    At most `max_in_flight` jobs are submitted at once, the rest wait here.
+
+    Each process has its own asset and tile caches, filled by `warm` when it
+    starts, so the memory of the caches is paid once per worker. Changes
+    made to the caches of the bot process don't reach the workers, which
+    find replaced files by their mtime instead.
+    """
+
+    def __init__(
+        self,
+        mode: str = RENDER_MODE,
+        max_workers: int = RENDER_WORKERS,
+        max_in_flight: int = RENDER_MAX_IN_FLIGHT,
+        start_method: str = RENDER_START_METHOD,
+        warm: Optional[Callable[[], None]] = None,
+    ):
+        self.mode = mode
+        self.start_method = start_method
+        self.warm = warm
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self.executor = self._create_executor()
+
+    def _create_executor(self) -> Executor:
+        if self.mode == "process":
+            try:
+                return ProcessPoolExecutor(
+                    self.max_workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_init_worker,
+                    initargs=(self.warm,),
+                )
+            except (ValueError, OSError) as e:
+                logger.warning(f"Render process pool unavailable ({e}), use threads.")
+                self.mode = "thread"
+
+        return ThreadPoolExecutor(self.max_workers, thread_name_prefix="render")
+
+    async def start(self) -> None:
+        """Start the workers ahead of the first renders, which would wait for them."""
+        await asyncio.gather(*(self.run(_noop) for _ in range(self.max_workers)))
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        self.waiting += 1
+        try:
+            with stage("render_queue"):
+                await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            self.in_flight += 1
+            executor = self.executor
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(executor, func, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory), the pool can't be reused.
+                if executor is self.executor:
+                    logger.error("Render process pool is broken, recreating it.")
+                    self.executor = self._create_executor()
+                    executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            finally:
+                self.in_flight -= 1
+        finally:
+            self._semaphore.release()
+
+    def shutdown(self, wait: bool = False) -> None:
+        self.executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,126 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Any, Optional
+
+RENDER_CACHE_DIR = os.getenv("GENSHIN_RENDER_CACHE_DIR", "./cache/renders/")
+RENDER_CACHE_TTL = int(os.getenv("GENSHIN_RENDER_CACHE_TTL", "3600"))
+RENDER_CACHE_MB = int(os.getenv("GENSHIN_RENDER_CACHE_MB", "256"))
+
+
+class RenderCache:
+    """Content-addressed cache of encoded card images on the local disk.
+
+    Entries are keyed by a hash of the render inputs and the template version,
+    expire after `ttl` seconds and are pruned oldest first once the directory
+    grows past `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        directory: str = RENDER_CACHE_DIR,
+        ttl: int = RENDER_CACHE_TTL,
+        max_bytes: int = RENDER_CACHE_MB << 20,
+    ):
+        self.version = version
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.nbytes = sum(
+            entry.stat().st_size for entry in os.scandir(directory) if entry.is_file()
+        )
+        self._pruning = False
+
+    def key(self, kind: str, *parts: Any) -> str:
+        payload = json.dumps(
+            [self.version, kind, *parts],
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self._read, self.path(key))
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    async def set(self, key: str, data: bytes) -> None:
+        loop = asyncio.get_running_loop()
+        replaced = await loop.run_in_executor(None, self._write, self.path(key), data)
+
+        self.nbytes += len(data) - replaced
+        if self.nbytes > self.max_bytes and not self._pruning:
+            self._pruning = True
+            try:
+                self.nbytes = await loop.run_in_executor(None, self._prune)
+            finally:
+                self._pruning = False
+
+    def _read(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as f:
+                if time.time() - os.fstat(f.fileno()).st_mtime > self.ttl:
+                    return None
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path: str, data: bytes) -> int:
+        """Write the entry atomically, return the size of the one it replaced."""
+        # Unique per write, the same card may be rendered twice at once.
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return replaced
+
+    def _prune(self) -> int:
+        """Drop expired entries, then the oldest ones until under the size cap."""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime > self.ttl:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        # Leave some headroom so that every write does not trigger a new scan.
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
+
+        return total
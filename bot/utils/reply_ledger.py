@@ -0,0 +1,144 @@
+import asyncio
+import collections
+import os
+from typing import Callable, Deque, Iterable, List, Optional
+
+import aioredis
+import loguru
+
+logger = loguru.logger
+
+# Replies remembered per channel, for how long in Redis, and in how many channels.
+REPLY_LEDGER_SIZE = int(os.getenv("REPLY_LEDGER_SIZE", "50"))
+REPLY_LEDGER_TTL = int(os.getenv("REPLY_LEDGER_TTL", "86400"))
+REPLY_LEDGER_CHANNELS = int(os.getenv("REPLY_LEDGER_CHANNELS", "10000"))
+
+
+class ReplyLedger:
+    """The ids of the bot's latest messages in each channel, newest last.
+
+    Kept in memory and mirrored to a Redis list `bot:replies:<channel>`, which
+    is read back for the channels unknown after a restart. The channels with
+    a list are in the set `bot:replies:channels`, the deletions elsewhere
+    aren't mirrored.
+    """
+
+    CHANNELS_KEY = "bot:replies:channels"
+
+    def __init__(
+        self,
+        redis: Callable[[], Optional[aioredis.Redis]] = lambda: None,
+        size: int = REPLY_LEDGER_SIZE,
+        ttl: int = REPLY_LEDGER_TTL,
+        max_channels: int = REPLY_LEDGER_CHANNELS,
+    ):
+        self.redis = redis
+        self.size = size
+        self.ttl = ttl
+        self.max_channels = max_channels
+        self._channels: "collections.OrderedDict[int, Deque[int]]" = (
+            collections.OrderedDict()
+        )
+        # The channels whose Redis mirror was read back.
+        self._loaded: set = set()
+        # The channels which may have a Redis list.
+        self._replied: set = set()
+        self._tasks: set = set()
+
+    @staticmethod
+    def key(channel_id: int) -> str:
+        return f"bot:replies:{channel_id}"
+
+    async def load_channels(self) -> None:
+        """Read back the channels with replies, before `forget` is called."""
+        if (redis := self.redis()) is None:
+            return
+        try:
+            channels = await redis.smembers(self.CHANNELS_KEY)
+        except aioredis.RedisError as e:
+            logger.warning(f"Loading the channels with replies failed: {e}")
+            return
+        self._replied.update(int(id) for id in channels)
+
+    def record(self, channel_id: int, message_id: int) -> None:
+        self._channel(channel_id).append(message_id)
+        self._replied.add(channel_id)
+        self._mirror(self._push, channel_id, message_id)
+
+    def forget(self, channel_id: int, message_ids: Iterable[int]) -> None:
+        if channel_id not in self._replied:
+            return
+        message_ids = set(message_ids)
+        if replies := self._channels.get(channel_id):
+            kept = [id for id in replies if id not in message_ids]
+            replies.clear()
+            replies.extend(kept)
+        self._mirror(self._remove, channel_id, message_ids)
+
+    async def last(self, channel_id: int, n: int = 1) -> List[int]:
+        """The ids of the `n` latest replies, newest first."""
+        if channel_id not in self._loaded:
+            loaded = await self._load(channel_id)
+            if loaded:
+                self._replied.add(channel_id)
+            # Older than the ones recorded since the start.
+            replies = self._channel(channel_id)
+            merged = dict.fromkeys([*reversed(loaded), *replies])
+            replies.clear()
+            replies.extend(merged)
+            self._loaded.add(channel_id)
+        replies = self._channel(channel_id)
+
+        return list(reversed(replies))[:n]
+
+    async def close(self) -> None:
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+
+    def _channel(self, channel_id: int) -> Deque[int]:
+        if channel_id not in self._channels:
+            self._channels[channel_id] = collections.deque(maxlen=self.size)
+            while len(self._channels) > self.max_channels:
+                evicted, _ = self._channels.popitem(last=False)
+                self._loaded.discard(evicted)
+        self._channels.move_to_end(channel_id)
+        return self._channels[channel_id]
+
+    def _mirror(self, func, *args) -> None:
+        if (redis := self.redis()) is None:
+            return
+        task = asyncio.create_task(func(redis, *args))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and (e := task.exception()):
+            logger.warning(f"Mirroring the replies to Redis failed: {e}")
+
+    async def _push(self, redis: aioredis.Redis, channel_id: int, id: int) -> None:
+        key = self.key(channel_id)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.lpush(key, id)
+            pipe.ltrim(key, 0, self.size - 1)
+            pipe.expire(key, self.ttl)
+            pipe.sadd(self.CHANNELS_KEY, channel_id)
+            pipe.expire(self.CHANNELS_KEY, self.ttl)
+            await pipe.execute()
+
+    async def _remove(self, redis: aioredis.Redis, channel_id: int, ids) -> None:
+        key = self.key(channel_id)
+        async with redis.pipeline(transaction=False) as pipe:
+            for id in ids:
+                pipe.lrem(key, 0, id)
+            await pipe.execute()
+
+    async def _load(self, channel_id: int) -> List[int]:
+        """Newest first, as stored."""
+        if (redis := self.redis()) is None:
+            return []
+        try:
+            return [int(id) for id in await redis.lrange(self.key(channel_id), 0, -1)]
+        except aioredis.RedisError as e:
+            logger.warning(f"Loading the replies from Redis failed: {e}")
+            return []
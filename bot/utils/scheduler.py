@@ -0,0 +1,146 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import loguru
+
+logger = loguru.logger
+
+# Jobs due within this many seconds of the first one run in the same batch.
+SCHEDULE_WINDOW = float(os.getenv("SCHEDULE_WINDOW", "60"))
+# A job runs at most this fraction of its interval early, for the short ones.
+SCHEDULE_WINDOW_FRACTION = float(os.getenv("SCHEDULE_WINDOW_FRACTION", "0.1"))
+# Random shift of every next run, as a fraction of the interval, capped.
+SCHEDULE_JITTER = float(os.getenv("SCHEDULE_JITTER", "0.05"))
+SCHEDULE_MAX_JITTER = float(os.getenv("SCHEDULE_MAX_JITTER", "300"))
+
+
+class Job:
+    __slots__ = ("key", "interval", "next_run", "payload")
+
+    def __init__(self, key: str, interval: float, next_run: float, payload: Any):
+        self.key = key
+        self.interval = interval
+        # A unix timestamp, so it means the same after a restart.
+        self.next_run = next_run
+        self.payload = payload
+
+    def __repr__(self) -> str:
+        return f"<Job {self.key} every {self.interval}s, next at {self.next_run:.0f}>"
+
+
+class HeapScheduler:
+    """Run every job of a min-heap of next run times from one task.
+
+    The due jobs are handed over together to `callback`, with their
+    `next_run` already moved to the following run.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[List[Job]], Awaitable[None]],
+        window: float = SCHEDULE_WINDOW,
+        window_fraction: float = SCHEDULE_WINDOW_FRACTION,
+        jitter: float = SCHEDULE_JITTER,
+        max_jitter: float = SCHEDULE_MAX_JITTER,
+    ):
+        self.callback = callback
+        self.window = window
+        self.window_fraction = window_fraction
+        self.jitter = jitter
+        self.max_jitter = max_jitter
+        self.jobs: Dict[str, Job] = {}
+        # (next_run, tie breaker, job), replaced jobs are skipped when popped.
+        self._heap: List[Tuple[float, int, Job]] = []
+        self._counter = itertools.count()
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running: set = set()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def add(self, job: Job) -> None:
+        self.jobs[job.key] = job
+        heapq.heappush(self._heap, (job.next_run, next(self._counter), job))
+        self._changed.set()
+
+    def remove(self, key: str) -> Optional[Job]:
+        job = self.jobs.pop(key, None)
+        self._changed.set()
+        return job
+
+    def start(self) -> None:
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+        for task in self._running:
+            task.cancel()
+
+    def next_run(self, job: Job, now: float) -> float:
+        # From the planned time so the runs don't drift, unless a run was missed.
+        base = job.next_run if job.next_run > now - job.interval else now
+        jitter = min(job.interval * self.jitter, self.max_jitter)
+        return base + job.interval + random.uniform(-jitter, jitter)
+
+    def window_of(self, job: Job) -> float:
+        return min(self.window, job.interval * self.window_fraction)
+
+    def _pop_due(self, now: float) -> List[Job]:
+        due, later = [], []
+        while self._heap and self._heap[0][0] <= now + self.window:
+            entry = heapq.heappop(self._heap)
+            next_run, _, job = entry
+            if self.jobs.get(job.key) is not job or job.next_run != next_run:
+                continue
+            if next_run <= now + self.window_of(job):
+                due.append(job)
+            else:
+                later.append(entry)
+        for entry in later:
+            heapq.heappush(self._heap, entry)
+        return due
+
+    async def _run(self) -> None:
+        while True:
+            # Drop the replaced jobs from the top, they don't need a wakeup.
+            while (
+                self._heap
+                and self.jobs.get(self._heap[0][2].key) is not self._heap[0][2]
+            ):
+                heapq.heappop(self._heap)
+
+            self._changed.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = time.time()
+            jobs = self._pop_due(now)
+            for job in jobs:
+                job.next_run = self.next_run(job, now)
+                heapq.heappush(self._heap, (job.next_run, next(self._counter), job))
+            if jobs:
+                task = asyncio.create_task(self._callback(jobs))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _callback(self, jobs: List[Job]) -> None:
+        try:
+            await self.callback(jobs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"Scheduled jobs {jobs} failed: {e}")
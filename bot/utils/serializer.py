@@ -0,0 +1,147 @@
+import enum
+import json
+import os
+import struct
+import zlib
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Tuple
+
+import loguru
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+logger = loguru.logger
+
+CACHE_FORMAT = os.getenv("CACHE_FORMAT", "msgpack")
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zlib")
+# Smaller values are stored uncompressed.
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "512"))
+
+# Bump when the shape of the cached models changes, older entries become misses.
+SCHEMA_VERSION = 1
+
+# 0xC1 is neither used by msgpack nor valid UTF-8, so it can't start a legacy
+# JSON entry.
+MAGIC = b"\xc1G"
+HEADER = struct.Struct("<2sBBB")  # magic, schema version, format, compression
+
+FORMATS = {"json": 0, "msgpack": 1}
+COMPRESSIONS = {"none": 0, "zlib": 1, "zstd": 2}
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Can't serialize {type(obj).__name__}: {obj!r}")
+
+
+def _available(format: str, compression: str) -> Tuple[str, str]:
+    if format == "msgpack" and msgpack is None:
+        logger.warning("msgpack is not installed, cache entries use JSON.")
+        format = "json"
+    if compression == "zstd" and zstandard is None:
+        logger.warning("zstandard is not installed, cache entries use zlib.")
+        compression = "zlib"
+    if format not in FORMATS or compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown cache encoding: {format}+{compression}.")
+
+    return format, compression
+
+
+class Serializer:
+    """Encode the cached models as `header + payload`.
+
+    Values without the header are the JSON text written before, they are
+    still read. Values of another schema version, or of a codec not installed
+    here, read as `None` so the caller refetches them.
+    """
+
+    def __init__(
+        self,
+        format: str = CACHE_FORMAT,
+        compression: str = CACHE_COMPRESSION,
+        min_compress: int = CACHE_COMPRESS_MIN_BYTES,
+        level: Optional[int] = None,
+        schema_version: int = SCHEMA_VERSION,
+    ):
+        self.format, self.compression = _available(format, compression)
+        self.min_compress = min_compress
+        self.level = level
+        self.schema_version = schema_version
+        self.legacy_reads = 0
+        self.stale_reads = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.format}+{self.compression}"
+
+    def dumps(self, obj: Dict[str, Any]) -> bytes:
+        payload = self._encode(obj)
+        compression = self.compression
+        if len(payload) < self.min_compress:
+            compression = "none"
+        payload = self._compress(payload, compression)
+        header = HEADER.pack(
+            MAGIC,
+            self.schema_version,
+            FORMATS[self.format],
+            COMPRESSIONS[compression],
+        )
+        return header + payload
+
+    def loads(self, data: bytes) -> Optional[Dict[str, Any]]:
+        if data[:2] != MAGIC:
+            self.legacy_reads += 1
+            return json.loads(data)
+
+        _, schema_version, format, compression = HEADER.unpack_from(data)
+        if schema_version != self.schema_version:
+            self.stale_reads += 1
+            return None
+
+        payload = memoryview(data)[HEADER.size :]
+        try:
+            if compression == COMPRESSIONS["zlib"]:
+                payload = zlib.decompress(payload)
+            elif compression == COMPRESSIONS["zstd"]:
+                payload = zstandard.ZstdDecompressor().decompress(payload)
+            elif compression != COMPRESSIONS["none"]:
+                raise ValueError(f"unknown compression {compression}")
+
+            if format == FORMATS["msgpack"]:
+                return msgpack.unpackb(payload, raw=False)
+            if format == FORMATS["json"]:
+                return json.loads(bytes(payload))
+            raise ValueError(f"unknown format {format}")
+        except Exception as e:
+            # Written by a newer or differently configured process.
+            logger.warning(f"Can't decode a cache entry: {e}")
+            self.stale_reads += 1
+            return None
+
+    def _encode(self, obj: Dict[str, Any]) -> bytes:
+        if self.format == "msgpack":
+            return msgpack.packb(obj, default=_default, use_bin_type=True)
+        return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+    def _compress(self, payload: bytes, compression: str) -> bytes:
+        if compression == "zlib":
+            return zlib.compress(payload, 6 if self.level is None else self.level)
+        if compression == "zstd":
+            return zstandard.ZstdCompressor(level=self.level or 3).compress(payload)
+        return payload
+
+
+serializer = Serializer()
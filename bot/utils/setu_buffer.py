@@ -0,0 +1,223 @@
+import asyncio
+import collections
+import os
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    IO,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+import loguru
+
+logger = loguru.logger
+
+# Ready images kept per pool, refilled once half of them are gone.
+SETU_BUFFER_SIZE = int(os.getenv("SETU_BUFFER_SIZE", "4"))
+# Seconds an image stays in the buffer, and an unused pool is kept.
+SETU_BUFFER_TTL = int(os.getenv("SETU_BUFFER_TTL", "1800"))
+# Pools of tagged queries, created once a query was asked this many times.
+SETU_BUFFER_POOLS = int(os.getenv("SETU_BUFFER_POOLS", "8"))
+SETU_BUFFER_POPULAR = int(os.getenv("SETU_BUFFER_POPULAR", "2"))
+# The lolicon API returns at most 20 results per call.
+API_MAX_NUM = 20
+
+# (r18, tags)
+PoolKey = Tuple[int, Tuple[str, ...]]
+
+
+class SetuItem(NamedTuple):
+    msg: str
+    filename: str
+    # A file object, closed by whoever takes the item.
+    file: IO[bytes]
+    created: float
+
+
+class Pool:
+    def __init__(self):
+        self.items: Deque[SetuItem] = collections.deque()
+        self.task: Optional[asyncio.Task] = None
+        self.used = time.monotonic()
+        self.retry_at = 0.0
+
+
+def pool_key(r18: int, query: str = "") -> PoolKey:
+    tags = (tag.strip() for tag in query.split(","))
+    return r18, tuple(sorted({tag for tag in tags if tag}))
+
+
+class SetuBuffer:
+    """Keep a few downloaded setu ready to send for each (r18, tags) pool.
+
+    The untagged pools are always kept, the tagged ones only for the popular
+    queries. Pools are refilled in the background with one API call for the
+    whole batch, a request only waits for the API and Pixiv when its pool is
+    empty.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[int, str, int], Awaitable[List[Dict[str, Any]]]],
+        download: Callable[[Dict[str, Any]], Awaitable[SetuItem]],
+        size: int = SETU_BUFFER_SIZE,
+        ttl: int = SETU_BUFFER_TTL,
+        max_pools: int = SETU_BUFFER_POOLS,
+        popular: int = SETU_BUFFER_POPULAR,
+        retry_after: int = 60,
+    ):
+        self.fetch = fetch
+        self.download = download
+        self.size = size
+        self.ttl = ttl
+        self.max_pools = max_pools
+        self.popular = popular
+        self.retry_after = retry_after
+        self.pools: Dict[PoolKey, Pool] = {}
+        self.requests: collections.Counter = collections.Counter()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, r18: int, query: str = "") -> SetuItem:
+        key = pool_key(r18, query)
+        self._sweep()
+        self.requests[key] += 1
+        pool = self._pool(key)
+
+        item = None
+        if pool is not None:
+            pool.used = time.monotonic()
+            if pool.items:
+                item = pool.items.popleft()
+            self._refill(key, pool)
+
+        if item is not None:
+            self.hits += 1
+            return item
+
+        self.misses += 1
+        data = await self.fetch(r18, query, 1)
+        return await self.download(data[0])
+
+    async def take(self, r18: int, n: int, query: str = "") -> List[SetuItem]:
+        """Up to `n` items at once, the ones missing from the pool come from one
+        API call. Failed downloads are left out.
+        """
+        key = pool_key(r18, query)
+        self._sweep()
+        self.requests[key] += 1
+        pool = self._pool(key)
+
+        items: List[SetuItem] = []
+        if pool is not None:
+            pool.used = time.monotonic()
+            while pool.items and len(items) < n:
+                items.append(pool.items.popleft())
+        self.hits += len(items)
+
+        while (missing := n - len(items)) > 0:
+            self.misses += missing
+            results = await self.fetch(r18, query, min(missing, API_MAX_NUM))
+            downloaded = await asyncio.gather(
+                *[self.download(data) for data in results], return_exceptions=True
+            )
+            items.extend(i for i in downloaded if isinstance(i, SetuItem))
+            if len(results) < min(missing, API_MAX_NUM) or not any(
+                isinstance(i, SetuItem) for i in downloaded
+            ):
+                break
+
+        if pool is not None:
+            self._refill(key, pool)
+        return items
+
+    def warm(self, r18: int, query: str = "") -> None:
+        key = pool_key(r18, query)
+        pool = self.pools.setdefault(key, Pool())
+        self._refill(key, pool)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pools": {key: len(pool.items) for key, pool in self.pools.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    async def close(self) -> None:
+        for pool in self.pools.values():
+            if pool.task:
+                pool.task.cancel()
+            while pool.items:
+                pool.items.popleft().file.close()
+
+    def _pool(self, key: PoolKey) -> Optional[Pool]:
+        if pool := self.pools.get(key):
+            return pool
+        if key[1] and self.requests[key] < self.popular:
+            return None
+
+        tagged = [k for k in self.pools if k[1]]
+        if key[1] and len(tagged) >= self.max_pools:
+            # Replace the least asked tagged pool, if this one is asked more.
+            coldest = min(tagged, key=lambda k: self.requests[k])
+            if self.requests[coldest] >= self.requests[key]:
+                return None
+            self._drop(coldest)
+
+        self.pools[key] = Pool()
+        return self.pools[key]
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        deadline = now - self.ttl
+        for key, pool in list(self.pools.items()):
+            while pool.items and pool.items[0].created < deadline:
+                pool.items.popleft().file.close()
+            if key[1] and pool.used < deadline:
+                self._drop(key)
+
+    def _drop(self, key: PoolKey) -> None:
+        pool = self.pools.pop(key)
+        if pool.task:
+            pool.task.cancel()
+        while pool.items:
+            pool.items.popleft().file.close()
+        # Counted again from zero, so the popular queries of the moment win.
+        del self.requests[key]
+
+    def _refill(self, key: PoolKey, pool: Pool) -> None:
+        if pool.task or len(pool.items) > self.size // 2:
+            return
+        if pool.retry_at > time.monotonic():
+            return
+
+        pool.task = asyncio.create_task(self._fill(key, pool))
+
+    async def _fill(self, key: PoolKey, pool: Pool) -> None:
+        r18, tags = key
+        try:
+            while (missing := self.size - len(pool.items)) > 0:
+                results = await self.fetch(
+                    r18, ",".join(tags), min(missing, API_MAX_NUM)
+                )
+                items = await asyncio.gather(
+                    *[self.download(data) for data in results], return_exceptions=True
+                )
+                downloaded = [i for i in items if isinstance(i, SetuItem)]
+                pool.items.extend(downloaded)
+                if not downloaded:
+                    raise Exception("every download of the batch failed")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Refilling the setu pool {key} failed: {e}")
+            pool.retry_at = time.monotonic() + self.retry_after
+        finally:
+            pool.task = None
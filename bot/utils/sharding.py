@@ -0,0 +1,48 @@
+import asyncio
+import os
+from typing import List
+
+import loguru
+
+from .claims import Claims
+
+logger = loguru.logger
+
+# 0 takes Discord's recommendation, required when several processes share the shards.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+# Shards run by each process, 0 runs all of them in one, without claims.
+SHARDS_PER_PROCESS = int(os.getenv("SHARDS_PER_PROCESS", "0"))
+
+
+def shard_of(guild_id: int, shard_count: int) -> int:
+    """The shard receiving the events of a guild, as computed by Discord."""
+    return (guild_id >> 22) % shard_count
+
+
+def shard_ranges(shard_count: int, per_process: int = 0) -> List[range]:
+    per_process = per_process or shard_count
+    return [
+        range(start, min(start + per_process, shard_count))
+        for start in range(0, shard_count, per_process)
+    ]
+
+
+async def claim_shards(
+    claims: Claims, shard_count: int, per_process: int = SHARDS_PER_PROCESS
+) -> List[int]:
+    """Claim the first free range of shards, waiting as a standby while
+    every range is run by another process.
+    """
+    waiting = False
+    while True:
+        for shards in shard_ranges(shard_count, per_process):
+            # The count is in the name, ranges of another count don't collide.
+            name = f"{shard_count}:{shards.start}-{shards.stop - 1}"
+            if await claims.acquire([name], want=False):
+                logger.info(f"Claimed the shards {name} of {shard_count}.")
+                return list(shards)
+
+        if not waiting:
+            waiting = True
+            logger.info("Every shard range is taken, waiting as a standby.")
+        await asyncio.sleep(claims.ttl / 3)
@@ -0,0 +1,134 @@
+import asyncio
+import os
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import aioredis
+import loguru
+
+from .metrics import metrics
+
+logger = loguru.logger
+
+T = TypeVar("T")
+
+# Seconds a leader holds the cross-process lock.
+SINGLEFLIGHT_LOCK_TTL = float(os.getenv("SINGLEFLIGHT_LOCK_TTL", "10"))
+
+LOOKUPS = metrics.counter(
+    "bot_lookups_total",
+    "Coalesced lookups: leading an upstream call, coalesced onto one in flight, "
+    "waiting on another process, or served by it.",
+    ("result",),
+)
+
+# Delete the lock only if it's still ours.
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """Share one upstream call between the concurrent misses of the same key.
+
+    Within the process the callers await the same task. Across processes the
+    leader holds a short Redis lock `<key>:lock`, the others poll `check` (the
+    cache lookup) until the leader has filled it, or do the call themselves
+    once the lock expires.
+    """
+
+    def __init__(
+        self,
+        redis: Callable[[], Optional[aioredis.Redis]] = lambda: None,
+        lock_ttl: float = SINGLEFLIGHT_LOCK_TTL,
+        poll_interval: float = 0.1,
+    ):
+        self.redis = redis
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[T]],
+        check: Optional[Callable[[], Awaitable[Optional[T]]]] = None,
+    ) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            LOOKUPS.inc(result="leader")
+            # A task of its own, so a cancelled caller doesn't cancel the others.
+            task = asyncio.create_task(self._lead(key, fn, check))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            LOOKUPS.inc(result="coalesced")
+
+        return await asyncio.shield(task)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Retrieved here, in case every caller was cancelled meanwhile.
+        if not task.cancelled():
+            task.exception()
+
+    async def _lead(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[T]],
+        check: Optional[Callable[[], Awaitable[Optional[T]]]],
+    ) -> T:
+        redis = self.redis()
+        if redis is None:
+            return await fn()
+
+        lock, token = f"{key}:lock", uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lock_ttl
+        waited = False
+        while True:
+            try:
+                locked = await redis.set(
+                    lock, token, nx=True, px=int(self.lock_ttl * 1000)
+                )
+            except aioredis.RedisError as e:
+                logger.warning(f"SingleFlight lock of {key} failed: {e}")
+                return await fn()
+
+            if locked:
+                try:
+                    # Filled by another process while waiting for the lock.
+                    if waited and check and (value := await check()) is not None:
+                        LOOKUPS.inc(result="remote_hit")
+                        return value
+                    return await fn()
+                finally:
+                    await self._release(key, redis, lock, token)
+
+            if not waited:
+                waited = True
+                LOOKUPS.inc(result="remote_wait")
+            await asyncio.sleep(self.poll_interval)
+            if check and (value := await check()) is not None:
+                LOOKUPS.inc(result="remote_hit")
+                return value
+            if loop.time() > deadline:
+                # The other process is too slow or gone, do it ourselves.
+                return await fn()
+
+    async def _release(
+        self, key: str, redis: aioredis.Redis, lock: str, token: str
+    ) -> None:
+        try:
+            await redis.eval(RELEASE_SCRIPT, 1, lock, token)
+        except aioredis.RedisError as e:
+            # It expires on its own, keep the result of the lookup.
+            logger.warning(f"SingleFlight unlock of {key} failed: {e}")
@@ -0,0 +1,56 @@
+import contextlib
+import time
+from typing import Iterator, List, Tuple
+
+import loguru
+
+logger = loguru.logger
+
+
+class StartupProfile:
+    """Time the phases of a start, from the process start to the first `on_ready`.
+
+    The phases done before `report()` are logged together, the ones still
+    running in the background after it are logged once they finish.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # (name, started at, duration), relative to `start`.
+        self.phases: List[Tuple[str, float, float]] = []
+        self.reported = False
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = self.elapsed()
+        try:
+            yield
+        finally:
+            self._add(name, started, self.elapsed() - started)
+
+    def mark(self, name: str) -> None:
+        """A point in time, like the first `on_ready`."""
+        self._add(name, self.elapsed(), 0.0)
+
+    def report(self) -> str:
+        self.reported = True
+        lines = [f"Startup profile ({self.elapsed():.2f}s):"]
+        for name, started, duration in self.phases:
+            lines.append(self._format(name, started, duration))
+        return "\n".join(lines)
+
+    def _add(self, name: str, started: float, duration: float) -> None:
+        self.phases.append((name, started, duration))
+        if self.reported:
+            logger.info(f"Startup phase {self._format(name, started, duration)}")
+
+    @staticmethod
+    def _format(name: str, started: float, duration: float) -> str:
+        took = f"{duration * 1000:8.1f}ms" if duration else " " * 10
+        return f"  {started:7.2f}s {took}  {name}"
+
+
+startup = StartupProfile()
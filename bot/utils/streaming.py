@@ -0,0 +1,61 @@
+import io
+import os
+import tempfile
+from typing import IO
+
+import aiohttp
+
+# Downloads larger than this are written to a temporary file instead of memory.
+SPOOL_BYTES = int(os.getenv("DOWNLOAD_SPOOL_BYTES", str(1 << 20)))
+CHUNK_BYTES = 64 << 10
+
+
+class DownloadTooLarge(Exception):
+    pass
+
+
+class SpooledFile(tempfile.SpooledTemporaryFile):
+    """A buffer for `disnake.File`, which before Python 3.11 takes a
+    `SpooledTemporaryFile` for a path.
+    """
+
+    def readable(self) -> bool:
+        return self._file.readable()
+
+    def seekable(self) -> bool:
+        return self._file.seekable()
+
+
+io.IOBase.register(SpooledFile)
+
+
+async def read_spooled(
+    resp: aiohttp.ClientResponse, max_bytes: int, spool_bytes: int = SPOOL_BYTES
+) -> IO[bytes]:
+    """Stream the body into a spooled temporary file, at most `max_bytes` of it.
+
+    The caller closes the returned file, which is positioned at the start.
+    """
+    if resp.content_length is not None and resp.content_length > max_bytes:
+        raise DownloadTooLarge(f"{resp.url} is {resp.content_length} bytes.")
+
+    file = SpooledFile(max_size=spool_bytes)
+    try:
+        size = 0
+        async for chunk in resp.content.iter_chunked(CHUNK_BYTES):
+            size += len(chunk)
+            if size > max_bytes:
+                raise DownloadTooLarge(f"{resp.url} is over {max_bytes} bytes.")
+            file.write(chunk)
+        file.seek(0)
+        return file
+    except BaseException:
+        file.close()
+        raise
+
+
+def file_size(file: IO[bytes]) -> int:
+    position = file.tell()
+    size = file.seek(0, os.SEEK_END)
+    file.seek(position)
+    return size
@@ -0,0 +1,42 @@
+import asyncio
+
+import disnake
+import pytest
+
+from bot.utils.streaming import DownloadTooLarge, read_spooled
+
+
+class FakeContent:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def iter_chunked(self, n: int):
+        for i in range(0, len(self.body), n):
+            yield self.body[i : i + n]
+
+
+class FakeResponse:
+    url = "https://i.pximg.net/img-master/1_p0.jpg"
+
+    def __init__(self, body: bytes, content_length=None):
+        self.content = FakeContent(body)
+        self.content_length = content_length
+
+
+@pytest.mark.parametrize("spool_bytes", [1 << 20, 16], ids=["memory", "disk"])
+def test_read_spooled_is_a_disnake_file_buffer(spool_bytes):
+    body = b"\x89PNG" + bytes(range(256)) * 8
+    file = asyncio.run(read_spooled(FakeResponse(body), 1 << 20, spool_bytes))
+
+    with file:
+        upload = disnake.File(file, "setu.png")
+        # Taken for a path, disnake would have tried to open a file of its own.
+        assert upload.fp is file
+        assert upload.fp.read() == body
+
+
+def test_read_spooled_stops_over_max_bytes():
+    with pytest.raises(DownloadTooLarge):
+        asyncio.run(read_spooled(FakeResponse(b"x" * 100), 10))
+    with pytest.raises(DownloadTooLarge):
+        asyncio.run(read_spooled(FakeResponse(b"", content_length=100), 10))